@@ -1,156 +1,2551 @@
-from flask import Flask, render_template, request, flash, redirect, url_for, session
-from datetime import timedelta
+from flask import (
+    Flask,
+    Response,
+    render_template,
+    request,
+    flash,
+    redirect,
+    url_for,
+    session,
+    g,
+    has_app_context,
+    has_request_context,
+    before_render_template,
+    template_rendered,
+    make_response,
+    abort,
+    send_from_directory,
+)
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import click
+import csv
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import math
+import mimetypes
+import multiprocessing
+import os
+import queue
+import re
+import secrets
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+from bcrypt import gensalt as bcrypt_salt
+from bcrypt import hashpw as bcrypt_hash
 from flask_bcrypt import Bcrypt
+from flask.sessions import SecureCookieSessionInterface
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from itsdangerous import BadSignature, URLSafeSerializer
+from logging.handlers import RotatingFileHandler
+from markupsafe import Markup, escape
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import safe_join
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+# initialize flask
+app = Flask(__name__)
+bcrypt = Bcrypt(app)
+app.config["SECRET_KEY"] = (
+    "8a0f946f1471e113e528d927220ad977ed8b2cce63303beff10c8cb4a15e1a99"
+)
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///course.db"
+
+# sessions slide: every request renews the idle timeout, up to SESSION_MAX_AGE
+app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(minutes=30)  # idle timeout
+app.config["SESSION_REFRESH_EACH_REQUEST"] = True
+app.config["SESSION_MAX_AGE"] = timedelta(hours=12)
+app.config["REMEMBER_ME_LIFETIME"] = timedelta(days=30)
+app.config["REMEMBER_ME_COOKIE"] = "remember"
+
+# feedback write coalescing, off by default
+app.config["FEEDBACK_GROUP_COMMIT"] = os.environ.get("FEEDBACK_GROUP_COMMIT") == "1"
+app.config["FEEDBACK_BATCH_SIZE"] = 64
+app.config["FEEDBACK_BATCH_WAIT"] = 0.02  # seconds to wait for more rows
+app.config["FEEDBACK_ACK_TIMEOUT"] = 10  # seconds a request waits for its commit
+
+# instructor feedback digest, see update_feedback_digest()
+app.config["FEEDBACK_DIGEST_PERIODS"] = 10  # weeks shown, newest first
+app.config["FEEDBACK_DIGEST_TERMS"] = 8  # top terms shown per question
+app.config["FEEDBACK_PAGE_SIZE"] = 20  # full responses per page
+
+# background jobs
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 2))
+app.config["JOB_MAX_ATTEMPTS"] = 3
+app.config["JOB_RETRY_DELAY"] = 5  # seconds, doubled after every failed attempt
+
+# calendar feeds
+app.config["COURSE_TIMEZONE"] = "America/Toronto"
+app.config["CALENDAR_CACHE_SIZE"] = 512  # feeds kept in memory
+app.config["UPCOMING_DEADLINES"] = 5  # deadlines shown on the home page
+
+# open regrade requests shown per assessment on each page of the queue
+app.config["REGRADE_PAGE_SIZE"] = 25
+
+# live regrade updates, see EventHub
+app.config["EVENTS_KEEPALIVE"] = 15  # seconds between keepalive comments
+app.config["EVENTS_QUEUE_SIZE"] = 32  # events kept for a slow connection
+app.config["EVENTS_RETRY"] = 5000  # milliseconds browsers wait before reconnecting
+
+# course files, SENDFILE_BACKEND can be "nginx" (X-Accel-Redirect) or "apache" (X-Sendfile)
+app.config["FILES_FOLDER"] = os.path.join(app.root_path, "static", "files")
+app.config["FILES_MAX_AGE"] = 3600  # seconds handouts may be cached
+app.config["SOLUTIONS_FILES"] = {"solutions.pdf"}  # also any Assessments.solutions_link
+app.config["SENDFILE_BACKEND"] = os.environ.get("SENDFILE_BACKEND")
+app.config["X_ACCEL_PREFIX"] = "/protected/files/"  # internal location in nginx
+
+# courses, see CourseEngines
+app.config["COURSES_FOLDER"] = os.environ.get(
+    "COURSES_FOLDER", os.path.join(app.instance_path, "courses")
+)
+app.config["COURSE_URL_PREFIX"] = "/c/"
+app.config["COURSE_DOMAIN"] = os.environ.get("COURSE_DOMAIN")  # e.g. courses.utsc.ca
+app.config["COURSE_ENGINES_OPEN"] = 32  # course databases each process keeps open
+app.config["COURSE_IDLE_TIMEOUT"] = 600  # seconds before an unused one is closed
+
+# database maintenance, see maintain_database()
+app.config["DB_MAINTENANCE_STEPS"] = ("analyze", "vacuum", "checkpoint", "integrity")
+app.config["DB_VACUUM_PAGES"] = None  # free pages returned per run, None for all
+
+# slow request log, off by default, see RequestProfile
+app.config["PROFILE_REQUESTS"] = os.environ.get("PROFILE_REQUESTS") == "1"
+app.config["PROFILE_THRESHOLD"] = 0.5  # seconds, slower requests are logged
+app.config["PROFILE_SAMPLE_INTERVAL"] = 0.005  # seconds between stack samples
+app.config["PROFILE_LOG"] = os.path.join(app.instance_path, "slow_requests.jsonl")
+app.config["PROFILE_LOG_BYTES"] = 5 * 1024 * 1024  # rotated at this size
+app.config["PROFILE_LOG_BACKUPS"] = 3
+
+# letter grades (lowest mark for each) and the what-if calculator, see what_if()
+app.config["GRADE_SCALE"] = (
+    ("A+", 90),
+    ("A", 85),
+    ("A-", 80),
+    ("B+", 77),
+    ("B", 73),
+    ("B-", 70),
+    ("C+", 67),
+    ("C", 63),
+    ("C-", 60),
+    ("D+", 57),
+    ("D", 53),
+    ("D-", 50),
+    ("F", 0),
+)
+app.config["WHATIF_AVERAGES"] = (50, 60, 70, 80, 90, 100)  # rows of the what-if grid
+app.config["WHATIF_CACHE_SIZE"] = 1024  # students kept in memory
+
+# grade distribution charts, see grade_chart()
+app.config["CHARTS_FOLDER"] = os.path.join(app.instance_path, "charts")
+app.config["CHART_BUCKET"] = 10  # marks per histogram bar
+app.config["CHART_MAX_AGE"] = 365 * 24 * 3600  # chart urls change with the data
+
+# the header and footer of every page, see layout_fragment()
+app.config["LAYOUT_FRAGMENT_CACHE"] = True
+
+# people caches shared across requests, see current_user() and query_people()
+app.config["PROFILE_CACHE_SIZE"] = 2048  # logged in users kept in memory
+app.config["PROFILE_CACHE_TTL"] = 300  # seconds
+app.config["ROSTER_CACHE_SIZE"] = 64  # (course, role) rosters kept in memory
+app.config["ROSTER_CACHE_TTL"] = 60  # seconds
+
+# grade change log, see consume_grade_changes()
+app.config["GRADE_CHANGES_BATCH"] = 500  # log entries applied per transaction
+app.config["GRADE_CHANGES_PAGE"] = 100  # default page size of /api/grade_changes
+
+# roster imports, see import_roster()
+app.config["ROSTER_HASH_WORKERS"] = os.cpu_count() or 1  # hashing processes
+app.config["ROSTER_HASH_MIN_PARALLEL"] = 16  # smaller rosters are hashed inline
+
+# optional settings file, e.g. COURSE_SETTINGS=/etc/course/settings.py
+app.config.from_envvar("COURSE_SETTINGS", silent=True)
+
+# database url and connection pool, environment variables win over the settings file
+if os.environ.get("DATABASE_URL"):
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
+
+for setting, option, cast in (
+    ("DB_POOL_SIZE", "pool_size", int),
+    ("DB_MAX_OVERFLOW", "max_overflow", int),
+    ("DB_POOL_TIMEOUT", "pool_timeout", int),
+    ("DB_POOL_RECYCLE", "pool_recycle", int),
+    ("DB_POOL_PRE_PING", "pool_pre_ping", lambda value: value in ("1", "true", True)),
+):
+    value = os.environ.get(setting, app.config.get(setting))
+    if value is not None:
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})[option] = cast(value)
+
+app.config["USE_X_SENDFILE"] = app.config["SENDFILE_BACKEND"] == "apache"
+
+
+# REQUEST PROFILING
+# with PROFILE_REQUESTS on, every request is timed by phase (database, templates,
+# password hashing) while a background thread samples its stack. Requests slower
+# than PROFILE_THRESHOLD are written to PROFILE_LOG, one json object per line,
+# and `flask profile-summary` shows the hottest frames of each route
+
+
+# the timings and stack samples of one request
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {"db": 0.0, "template": 0.0, "hashing": 0.0}
+        self.queries = 0
+        self.stacks = Counter()
+        self.status = None
+
+        # templates can run queries, that time only counts as db
+        self.render_started = []
+
+    # returns the running request's profile, None when it is not profiled
+    @staticmethod
+    def current():
+        return g.get("profile") if has_request_context() else None
+
+
+# samples the stacks of the threads serving profiled requests
+class StackSampler:
+    def __init__(self):
+        self.profiles = {}  # thread id -> RequestProfile
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        self.start()
+        self.profiles[threading.get_ident()] = profile
+
+    def remove(self):
+        self.profiles.pop(threading.get_ident(), None)
+
+    # starts the sampling thread, once per process
+    def start(self):
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.profiles = {}
+                self.thread = threading.Thread(target=self.run, name="stack-sampler")
+                self.thread.daemon = True
+                self.thread.start()
+                self.pid = os.getpid()
+
+    # the sampler sleeps between samples and only looks at profiled threads,
+    # so the cost stays small while requests are being served
+    def run(self):
+        while True:
+            time.sleep(app.config["PROFILE_SAMPLE_INTERVAL"])
+            if not self.profiles:
+                continue
+
+            frames = sys._current_frames()
+            for thread_id, profile in list(self.profiles.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.stacks[fold_stack(frame)] += 1
+
+
+stack_sampler = StackSampler()
+
+
+# this function names a frame by its file and function, e.g. "engine/base.py:execute"
+def frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{'/'.join(path[-2:]) if len(path) > 2 else path[-1]}:{code.co_name}"
+
+
+# this function turns a stack into one line, outermost frame first
+def fold_stack(frame, depth=40) -> str:
+    labels = []
+    while frame is not None and len(labels) < depth:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+# this decorator adds the time spent in a function to a phase of the request
+def profiled_phase(phase):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = RequestProfile.current()
+            if profile is None:
+                return func(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.phases[phase] += time.perf_counter() - started
+
+        return wrapper
+
+    return decorate
+
+
+# bcrypt is slow on purpose, so its time is counted apart
+for method in ("generate_password_hash", "check_password_hash"):
+    setattr(bcrypt, method, profiled_phase("hashing")(getattr(bcrypt, method)))
+
+
+# every engine, course databases included, reports its query time
+@event.listens_for(Engine, "before_cursor_execute")
+def profile_query_start(conn, cursor, statement, parameters, context, executemany):
+    if RequestProfile.current() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def profile_query_end(conn, cursor, statement, parameters, context, executemany):
+    profile = RequestProfile.current()
+    if profile is not None and conn.info.get("profile_started"):
+        profile.phases["db"] += time.perf_counter() - conn.info["profile_started"].pop()
+        profile.queries += 1
+
+
+@before_render_template.connect_via(app)
+def profile_render_start(sender, template, context, **extra):
+    profile = RequestProfile.current()
+    if profile is not None:
+        profile.render_started.append((time.perf_counter(), profile.phases["db"]))
+
+
+@template_rendered.connect_via(app)
+def profile_render_end(sender, template, context, **extra):
+    profile = RequestProfile.current()
+    if profile is not None and profile.render_started:
+        started, db_before = profile.render_started.pop()
+        db_time = profile.phases["db"] - db_before
+        profile.phases["template"] += time.perf_counter() - started - db_time
+
+
+@app.before_request
+def start_profile():
+    if app.config["PROFILE_REQUESTS"]:
+        g.profile = RequestProfile()
+        stack_sampler.add(g.profile)
+
+
+@app.after_request
+def record_profile_status(response):
+    profile = RequestProfile.current()
+    if profile is not None:
+        profile.status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_profile(error=None):
+    profile = RequestProfile.current()
+    if profile is None:
+        return
+
+    stack_sampler.remove()
+    elapsed = time.perf_counter() - profile.started
+
+    if elapsed >= app.config["PROFILE_THRESHOLD"]:
+        slow_request_log().info(
+            json.dumps(profile_entry(profile, elapsed), separators=(",", ":"))
+        )
+
+
+# this function builds the log entry of a slow request
+def profile_entry(profile, elapsed) -> dict:
+    phases = {name: round(value * 1000, 1) for name, value in profile.phases.items()}
+    phases["other"] = round(elapsed * 1000 - sum(phases.values()), 1)
+
+    return {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "course": g.get("course"),
+        "status": profile.status,
+        "ms": round(elapsed * 1000, 1),
+        "queries": profile.queries,
+        "cache_lookups": dict(g.get("cache_lookups", {})),
+        "phases_ms": phases,
+        "samples": sum(profile.stacks.values()),
+        "stacks": dict(profile.stacks.most_common(50)),
+    }
+
+
+# this function returns the logger of the slow request log, opening the file once
+def slow_request_log():
+    logger = logging.getLogger("course.slow_requests")
+
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(app.config["PROFILE_LOG"]), exist_ok=True)
+        handler = RotatingFileHandler(
+            app.config["PROFILE_LOG"],
+            maxBytes=app.config["PROFILE_LOG_BYTES"],
+            backupCount=app.config["PROFILE_LOG_BACKUPS"],
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    return logger
+
+
+@app.cli.command("profile-summary")
+@click.option("--top", default=10, help="Frames shown per route.")
+@click.option("--endpoint", default=None, help="Only summarize this route.")
+def profile_summary_command(top, endpoint):
+    """Summarize the slow request log: phases and hottest frames per route."""
+    path = app.config["PROFILE_LOG"]
+    files = [path] + [
+        f"{path}.{n}" for n in range(1, app.config["PROFILE_LOG_BACKUPS"] + 1)
+    ]
+
+    routes = {}
+    for name in files:
+        if not os.path.exists(name):
+            continue
+        with open(name) as file:
+            for line in file:
+                entry = json.loads(line)
+                if endpoint and entry["endpoint"] != endpoint:
+                    continue
+                routes.setdefault(entry["endpoint"] or entry["path"], []).append(entry)
+
+    if not routes:
+        click.echo("No slow requests logged")
+        return
+
+    for route, entries in sorted(routes.items(), key=lambda item: -len(item[1])):
+        times = [entry["ms"] for entry in entries]
+        click.echo(
+            f"{route}: {len(entries)} slow request(s), "
+            f"median {statistics.median(times):.0f} ms, max {max(times):.0f} ms"
+        )
+
+        # requests logged at 0 ms have no shares to show
+        total = sum(times)
+        shares = Counter()
+        for entry in entries:
+            shares.update(entry["phases_ms"])
+        if total:
+            click.echo(
+                "  "
+                + "  ".join(
+                    f"{phase} {shares[phase] / total:.0%}"
+                    for phase in ("db", "template", "hashing", "other")
+                )
+            )
+
+        # self: the frame was running, total: the frame was on the stack
+        own, inclusive = Counter(), Counter()
+        samples = 0
+        for entry in entries:
+            for stack, count in entry["stacks"].items():
+                frames = stack.split(";")
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    inclusive[frame] += count
+                samples += count
+
+        if not samples:
+            continue
+        click.echo(f"  {'self':>6}{'total':>7}  frame ({samples} samples)")
+        for frame, count in own.most_common(top):
+            click.echo(
+                f"  {count / samples:>6.0%}{inclusive[frame] / samples:>7.0%}  {frame}"
+            )
+
+
+# COURSES
+# one deployment serves many courses, each with its own sqlite file in COURSES_FOLDER
+# a course is picked by the /c/<key>/ url prefix or the <key>.COURSE_DOMAIN host,
+# requests without a course key use SQLALCHEMY_DATABASE_URI like before
+
+# course keys end up in file names, so only simple ones are allowed
+COURSE_KEY = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+
+
+# opens course databases on first use and closes the ones that were not used lately,
+# so memory grows with the courses in use rather than with the courses that exist
+class CourseEngines:
+    def __init__(self):
+        self.engines = OrderedDict()  # course -> (engine, last used)
+        self.upgraded = set()
+        self.lock = threading.Lock()
+        self.upgrade_lock = threading.Lock()
+        self.pid = os.getpid()
+
+    # returns the database file of a course
+    def path(self, course) -> str:
+        return os.path.join(app.config["COURSES_FOLDER"], course + ".db")
+
+    def exists(self, course) -> bool:
+        return bool(COURSE_KEY.match(course)) and os.path.exists(self.path(course))
+
+    # returns the engine of a course, opening it if needed
+    def get(self, course):
+        now = time.monotonic()
+
+        with self.lock:
+            # connections must not be shared with a parent process
+            if self.pid != os.getpid():
+                for engine, _ in self.engines.values():
+                    engine.dispose(close=False)
+                self.engines.clear()
+                self.pid = os.getpid()
+
+            if course in self.engines:
+                engine = self.engines[course][0]
+                self.engines.move_to_end(course)
+            else:
+                engine = create_engine("sqlite:///" + self.path(course))
+            self.engines[course] = (engine, now)
+
+            closed = self.evict(now)
+
+        # requests still using a closed engine keep their connection until they end
+        for old_engine in closed:
+            old_engine.dispose()
+
+        return engine
+
+    # drops the least recently used engines, returns them so they can be closed
+    def evict(self, now) -> list:
+        closed = []
+        while len(self.engines) > 1:
+            course, (engine, last_used) = next(iter(self.engines.items()))
+            if (
+                len(self.engines) <= app.config["COURSE_ENGINES_OPEN"]
+                and now - last_used < app.config["COURSE_IDLE_TIMEOUT"]
+            ):
+                break
+            del self.engines[course]
+            closed.append(engine)
+        return closed
+
+    # brings a course's tables up to date, once per process
+    def prepare(self, course):
+        if course in self.upgraded:
+            return
+
+        with self.upgrade_lock:
+            if course not in self.upgraded:
+                upgrade_schema()
+                self.upgraded.add(course)
+
+
+course_engines = CourseEngines()
+
+
+# this function returns the key of the course being served, None for the default one
+def current_course():
+    return g.get("course") if has_app_context() else None
+
+
+# this function runs code outside a request (jobs, cli commands) against a course
+# the course's tables are brought up to date first, once per process
+@contextmanager
+def course_context(course):
+    with app.app_context():
+        g.course = course
+        course_engines.prepare(course)
+        yield
+
+
+# binds the session to the database of the current course
+class CourseSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        course = current_course()
+        if bind is None and course:
+            return course_engines.get(course)
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# takes the course key out of the url, so routes and url_for work the same in every
+# course: /c/cscb20/grades is routed as /grades with /c/cscb20 as the script root
+class CourseDispatcher:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        prefix = app.config["COURSE_URL_PREFIX"]
+        domain = app.config["COURSE_DOMAIN"]
+        course = None
+
+        if path.startswith(prefix):
+            course, _, rest = path[len(prefix) :].partition("/")
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix + course
+            environ["PATH_INFO"] = "/" + rest
+        elif domain:
+            host = environ.get("HTTP_HOST", "").split(":")[0]
+            if host.endswith("." + domain):
+                course = host[: -len(domain) - 1]
+
+        environ["course.key"] = course
+        return self.wsgi_app(environ, start_response)
+
+
+# this function adds the course key to a cookie name. The default course's
+# cookies use path / and so are also sent to /c/<key>/, the names keep them apart
+def course_cookie_name(name: str) -> str:
+    course = request.environ.get("course.key")
+    return f"{name}_{course}" if course else name
+
+
+# gives every course its own session cookie, sent only to the course's urls
+class CourseSessionInterface(SecureCookieSessionInterface):
+    def get_cookie_name(self, app):
+        return course_cookie_name(super().get_cookie_name(app))
+
+    def get_cookie_path(self, app):
+        if request.environ.get("course.key") and request.script_root:
+            return request.script_root + "/"
+
+        return super().get_cookie_path(app)
+
+
+app.wsgi_app = CourseDispatcher(app.wsgi_app)
+app.session_interface = CourseSessionInterface()
+
+
+# intitalize db
+db = SQLAlchemy(app, session_options={"class_": CourseSession})
+
+
+# picks the database of the requested course
+@app.before_request
+def select_course():
+    # static files are the same in every course and need no database
+    if request.endpoint == "static":
+        return
+
+    course = request.environ.get("course.key")
+
+    if course is not None:
+        if not course_engines.exists(course):
+            return (
+                render_template("error.html", pagename="error", title="Error"),
+                404,
+            )
+        g.course = course
+
+    # the first request of a process migrates its database, nothing does on import
+    course_engines.prepare(course)
+
+    # the cookie is signed with the same key in every course, so a login only
+    # counts in the course it was made in
+    if "name" in session and session.get("course") != course:
+        session.clear()
+
+
+# this function formats a due date for display
+def parse_date(date) -> str:
+    if not date:
+        return ""
+    return date.strftime("%Y-%m-%d, %H:%M")
+
+
+# this function parses a due date from a datetime-local form field
+# returns None if the date is not valid
+def parse_form_date(date: str):
+    try:
+        return datetime.fromisoformat(date)
+    except ValueError:
+        return None
+
+
+# add the parse data function to jinja2 template
+app.jinja_env.globals.update(parse_date=parse_date)
+
+
+# database response class
+class DBResponse:
+    def __init__(self, success, message):
+        self.success = success
+        self.message = message
+
+    def to_dict(self):
+        return {"success": self.success, "message": self.message}
+
+
+# tables
+class Person(db.Model):
+    __tablename__ = "Person"
+
+    username = db.Column(db.String(20), primary_key=True)
+    last_name = db.Column(db.String(20), nullable=False)
+    first_name = db.Column(db.String(20), nullable=False)
+    # bcrypt hashes are 60 characters, stricter databases enforce the length
+    password = db.Column(db.String(100), nullable=False)
+    user_type = db.Column(db.String(20), nullable=False)
+
+    def __repr__(self):
+        return f"Person('{self.username}', '{self.first_name}')"
+
+
+class Grades(db.Model):
+    __tablename__ = "Grades"
+
+    student_username = db.Column(
+        db.String(20), db.ForeignKey("Person.username"), primary_key=True
+    )
+    assessment_name = db.Column(
+        db.String(30), db.ForeignKey("Assessments.assessment_name"), primary_key=True
+    )
+    assessment_type = db.Column(db.String(20), nullable=False)
+    grade = db.Column(db.Integer, default=None)
+
+
+# append only log of every grade write, see log_grade_changes()
+# seq only grows (autoincrement never reuses a number), so consumers of the log
+# can remember the last seq they applied and read only what came after it
+class GradeChanges(db.Model):
+
+    __tablename__ = "GradeChanges"
+
+    seq = db.Column(db.Integer, primary_key=True)
+    student_username = db.Column(db.String(20), nullable=False)
+    assessment_name = db.Column(db.String(30), nullable=False)
+    assessment_type = db.Column(db.String(20), nullable=False)
+    # None when the grade was first entered
+    old_grade = db.Column(db.Integer)
+    new_grade = db.Column(db.Integer)
+    # insert, regrade or backfill
+    source = db.Column(db.String(20), nullable=False)
+    regrade_id = db.Column(db.Integer)
+    changed_by = db.Column(db.String(20))
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # serve the history of one grade and a student's own changes, and the
+    # latest change of each assessment
+    __table_args__ = (
+        db.Index("ix_GradeChanges_grade", "student_username", "assessment_name", "seq"),
+        db.Index("ix_GradeChanges_assessment", "assessment_name", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class Regrades(db.Model):
+    __tablename__ = "Regrades"
+
+    regrade_id = db.Column(db.Integer, primary_key=True)
+    assessment_name = db.Column(
+        db.String(30), db.ForeignKey("Assessments.assessment_name"), nullable=False
+    )
+    student_username = db.Column(
+        db.String(20), db.ForeignKey("Person.username"), nullable=False
+    )
+    description = db.Column(db.String(1000), nullable=False)
+    status = db.Column(db.Boolean, default=False, nullable=False)
+
+    # serves the open regrade queue, grouped by assessment and oldest first
+    __table_args__ = (
+        db.Index("ix_Regrades_queue", "status", "assessment_name", "regrade_id"),
+    )
+
+
+class Assessments(db.Model):
+
+    __tablename__ = "Assessments"
+
+    assessment_name = db.Column(db.String(30), primary_key=True)
+    assessment_type = db.Column(db.String(20), nullable=False)
+    due_date = db.Column(db.DateTime, index=True)
+    location = db.Column(db.String(20))
+    weight = db.Column(db.REAL)
+    handout_link = db.Column(db.String(100))
+    solutions_link = db.Column(db.String(100))
+    description = db.Column(db.String(1000), nullable=False)
+
+
+class Feedback(db.Model):
+
+    __tablename__ = "Feedback"
+
+    id = db.Column(db.Integer, primary_key=True)
+    instructor_username = db.Column(
+        db.String(20), db.ForeignKey("Person.username"), nullable=False
+    )
+    instructor_like = db.Column(db.String(1000))
+    instructor_improve = db.Column(db.String(1000))
+    labs_like = db.Column(db.String(1000))
+    labs_improve = db.Column(db.String(1000))
+    # None for feedback sent before submission times were kept
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # serves an instructor's responses, newest first
+    __table_args__ = (db.Index("ix_Feedback_instructor", "instructor_username", "id"),)
+
+
+# responses per instructor and week, kept up to date by update_feedback_digest()
+class FeedbackPeriods(db.Model):
+
+    __tablename__ = "FeedbackPeriods"
+
+    instructor_username = db.Column(db.String(20), primary_key=True)
+    # monday of the week as YYYY-MM-DD, or "earlier" for feedback without a time
+    period = db.Column(db.String(10), primary_key=True)
+    responses = db.Column(db.Integer, nullable=False, default=0)
+
+
+# how many responses to each question used a term, see update_feedback_digest()
+class FeedbackTerms(db.Model):
+
+    __tablename__ = "FeedbackTerms"
+
+    instructor_username = db.Column(db.String(20), primary_key=True)
+    field = db.Column(db.String(30), primary_key=True)
+    term = db.Column(db.String(40), primary_key=True)
+    responses = db.Column(db.Integer, nullable=False, default=0)
+
+    # serves the top terms of a question without sorting the whole vocabulary
+    __table_args__ = (
+        db.Index("ix_FeedbackTerms_top", "instructor_username", "field", "responses"),
+    )
+
+
+# background jobs, see submit_job()
+class Jobs(db.Model):
+
+    __tablename__ = "Jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    # queued, running, done or failed
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    result = db.Column(db.Text)
+    error = db.Column(db.String(1000))
+    submitted_by = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# "keep me logged in" tokens, see issue_remember_token()
+# the cookie holds selector:validator, only a keyed hash of the validator is stored
+class RememberTokens(db.Model):
+
+    __tablename__ = "RememberTokens"
+
+    id = db.Column(db.Integer, primary_key=True)
+    selector = db.Column(db.String(32), nullable=False, unique=True)
+    validator_hash = db.Column(db.String(64), nullable=False)
+    username = db.Column(
+        db.String(20), db.ForeignKey("Person.username"), nullable=False, index=True
+    )
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+# one change counter per table, bumped by the helpers that write to that table
+class DataVersions(db.Model):
+
+    __tablename__ = "DataVersions"
+
+    table_name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+
+# how far each consumer of the grade change log has read, see consume_grade_changes()
+class ChangeCursors(db.Model):
+
+    __tablename__ = "ChangeCursors"
+
+    name = db.Column(db.String(50), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# running totals per assessment, kept up to date from the grade change log
+class GradeStats(db.Model):
+
+    __tablename__ = "GradeStats"
+
+    assessment_name = db.Column(db.String(30), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# tables that have a change counter
+VERSIONED_TABLES = ("Person", "Assessments", "Grades", "Regrades", "Feedback")
+
+
+# this function creates missing tables and version counters
+def upgrade_schema():
+    engine = db.session.get_bind()
+    db.metadata.create_all(engine)
+    add_missing_columns(engine)
+
+    existing = set(db.session.execute(db.select(DataVersions.table_name)).scalars())
+
+    for table in VERSIONED_TABLES:
+        if table not in existing:
+            db.session.add(DataVersions(table_name=table, version=0))
+
+    db.session.commit()
+
+    migrate_due_dates()
+    backfill_grade_changes()
+    backfill_feedback_digest()
+
+    # create_all skips tables that exist, so add indexes declared after them
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+# this function adds columns declared after their table was created
+# only nullable columns can be added this way, existing rows get NULL
+def add_missing_columns(engine):
+    inspector = db.inspect(engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.execute(
+                    db.text(
+                        f'ALTER TABLE "{table.name}" '
+                        f'ADD COLUMN "{column.name}" {column_type}'
+                    )
+                )
+
+
+# this function converts due dates saved as "2024-02-13T19:00" strings
+# (from when the column was a String) to the format sqlite datetimes are stored in,
+def migrate_due_dates():
+    if db.session.get_bind().dialect.name == "sqlite":
+        # read the column as plain text, so old values don't go through datetime parsing
+        due_date = Assessments.__table__.c.due_date.cast(db.String)
+
+        for pattern, suffix in (
+            ("____-__-__T__:__", ":00.000000"),
+            ("____-__-__T__:__:__", ".000000"),
+        ):
+            db.session.execute(
+                db.update(Assessments.__table__)
+                .where(due_date.like(pattern))
+                .values(due_date=db.func.replace(due_date, "T", " ").concat(suffix))
+            )
+        db.session.commit()
+
+
+# this function seeds the grade change log with the grades saved before it existed,
+# so consumers reading from seq 0 see every grade exactly once
+def backfill_grade_changes():
+    if db.session.execute(db.select(GradeChanges.seq).limit(1)).first():
+        return
+
+    db.session.execute(
+        db.insert(GradeChanges).from_select(
+            [
+                "student_username",
+                "assessment_name",
+                "assessment_type",
+                "new_grade",
+                "source",
+                "changed_at",
+            ],
+            db.select(
+                Grades.student_username,
+                Grades.assessment_name,
+                Grades.assessment_type,
+                Grades.grade,
+                db.literal("backfill"),
+                db.literal(datetime.utcnow(), db.DateTime),
+            ).order_by(Grades.assessment_name, Grades.student_username),
+        )
+    )
+    db.session.commit()
+
+
+@app.cli.command("upgrade-db")
+@click.option(
+    "--course", default=None, help="Course key, the default database if unset."
+)
+def upgrade_db_command(course):
+    """Create missing tables and indexes and migrate old data."""
+    if course and not course_engines.exists(course):
+        raise click.ClickException(f"Unknown course: {course}")
+
+    with app.app_context():
+        g.course = course
+        upgrade_schema()
+    click.echo("Database is up to date")
+
+
+@app.cli.command("create-course")
+@click.argument("course")
+def create_course_command(course):
+    """Create the database of a new course."""
+    if not COURSE_KEY.match(course):
+        raise click.ClickException(
+            "Course keys use lowercase letters, digits, - and _ (at most 40)"
+        )
+    if course_engines.exists(course):
+        raise click.ClickException(f"Course {course} already exists")
+
+    os.makedirs(app.config["COURSES_FOLDER"], exist_ok=True)
+    open(course_engines.path(course), "a").close()
+
+    with course_context(course):
+        pass
+
+    prefix = app.config["COURSE_URL_PREFIX"]
+    click.echo(f"Created course {course}, served at {prefix}{course}/")
+
+
+# VERSIONS AND ETAGS
+
+
+# etags change whenever the code or templates are redeployed
+ETAG_SALT = str(
+    max(
+        os.path.getmtime(path)
+        for path in [__file__]
+        + [
+            os.path.join(app.root_path, "templates", name)
+            for name in os.listdir(os.path.join(app.root_path, "templates"))
+        ]
+    )
+)
+
+
+# this function bumps the change counters of the given tables
+# it does not commit, so the bump lands in the same transaction as the write
+def bump_versions(*tables):
+    db.session.execute(
+        db.update(DataVersions)
+        .where(DataVersions.table_name.in_(tables))
+        .values(version=DataVersions.version + 1)
+    )
+
+
+# this function returns an insert that supports on_conflict for the current database
+def dialect_insert(model):
+    if db.session.get_bind().dialect.name == "postgresql":
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
+
+# this function returns the change counters of the given tables as a dict
+def get_versions(tables) -> dict:
+    rows = db.session.execute(
+        db.select(DataVersions.table_name, DataVersions.version).where(
+            DataVersions.table_name.in_(tables)
+        )
+    )
+    return {table: version for table, version in rows}
+
+
+# this function builds an etag from the table versions, the current user and the
+# url, query string included, since pages like ?page=2 read the same tables
+def make_etag(tables) -> str:
+    versions = get_versions(tables)
+
+    parts = [
+        ETAG_SALT,
+        current_course() or "",
+        session.get("name", ""),
+        session.get("user_type", ""),
+        request.full_path,
+    ]
+    parts += [f"{table}={versions.get(table, 0)}" for table in tables]
+
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+# this function answers with a 304 if the client already has the current page
+# render is only called when the page has changed, so a 304 skips the orm and jinja
+def versioned_response(tables, render):
+    etag = make_etag(tables)
+
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+# BACKGROUND JOBS
+# slow work is stored in the Jobs table and run by a small thread pool,
+# so the route that submits it can return right away
+
+
+# handlers by job kind, registered with @job_handler
+JOB_HANDLERS = {}
+
+# kinds that take no payload and may be submitted through the /jobs route
+WEB_JOB_KINDS = set()
+
+# the pool is created lazily so every worker process gets its own threads
+job_pool = None
+job_pool_pid = None
+job_pool_lock = threading.Lock()
+
+# timers of failed jobs waiting for their retry, see schedule_retry()
+job_retries = set()
+job_retries_lock = threading.Lock()
+
+
+# this decorator registers a function as the handler of a job kind
+# the handler gets the job payload as keyword arguments and returns a json result
+# web=True lets instructors submit the kind through the /jobs route
+def job_handler(kind, web=False):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        if web:
+            WEB_JOB_KINDS.add(kind)
+        return func
+
+    return register
+
+
+# this function returns the worker pool of this process
+def get_job_pool():
+    global job_pool, job_pool_pid
+
+    with job_pool_lock:
+        if job_pool is None or job_pool_pid != os.getpid():
+            job_pool = ThreadPoolExecutor(
+                max_workers=app.config["JOB_WORKERS"], thread_name_prefix="job"
+            )
+            job_pool_pid = os.getpid()
+
+        return job_pool
+
+
+# this function stores a new job and hands it to the worker pool
+# returns the id of the job, which can be polled at /jobs/<id>
+def submit_job(kind, payload=None, max_attempts=None, submitted_by=None) -> int:
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job = Jobs(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status="queued",
+        max_attempts=max_attempts or app.config["JOB_MAX_ATTEMPTS"],
+        submitted_by=submitted_by,
+    )  # type: ignore
+
+    db.session.add(job)
+    db.session.commit()
+
+    get_job_pool().submit(run_job, job.id, current_course())
+    return job.id
+
+
+# this function runs a job in a worker thread
+# course is the key of the course whose Jobs table holds the job
+def run_job(job_id, course=None):
+    with course_context(course):
+        # claim the job, a job that is not queued anymore is left alone
+        claimed = db.session.execute(
+            db.update(Jobs)
+            .where(Jobs.id == job_id, Jobs.status == "queued")
+            .values(
+                status="running",
+                attempts=Jobs.attempts + 1,
+                updated_at=datetime.utcnow(),
+            )
+            .returning(Jobs.kind, Jobs.payload, Jobs.attempts, Jobs.max_attempts)
+        ).first()
+        db.session.commit()
+
+        if not claimed:
+            return
+
+        values = {"updated_at": datetime.utcnow()}
+
+        try:
+            result = JOB_HANDLERS[claimed.kind](**json.loads(claimed.payload))
+            values.update(
+                status="done",
+                result=json.dumps(result, default=api_json_default),
+                error=None,
+            )
+        except Exception as error:
+            db.session.rollback()
+            app.logger.exception("Job %s (%s) failed", job_id, claimed.kind)
+
+            values["error"] = f"{type(error).__name__}: {error}"[:1000]
+
+            if claimed.attempts < claimed.max_attempts:
+                values["status"] = "queued"
+            else:
+                values["status"] = "failed"
+
+        db.session.execute(db.update(Jobs).where(Jobs.id == job_id).values(**values))
+        db.session.commit()
+
+        # retry later, waiting twice as long after every failed attempt
+        if values["status"] == "queued":
+            delay = app.config["JOB_RETRY_DELAY"] * 2 ** (claimed.attempts - 1)
+            schedule_retry(job_id, course, delay)
+
+
+# this function hands a failed job back to the pool after a delay
+# the timer stays in job_retries until the job is in the pool, so wait_for_jobs()
+# always sees either the timer or the pool holding the job
+def schedule_retry(job_id, course, delay):
+    def retry():
+        get_job_pool().submit(run_job, job_id, course)
+        with job_retries_lock:
+            job_retries.discard(timer)
+
+    timer = threading.Timer(delay, retry)
+    timer.daemon = True
+    with job_retries_lock:
+        job_retries.add(timer)
+    timer.start()
+
+
+# this function waits until every job of this process is finished, retries included
+# the pool is taken away before it is shut down, so a retry that comes due
+# meanwhile gets a new pool instead of one that refuses work
+def wait_for_jobs():
+    global job_pool
+
+    while True:
+        with job_pool_lock:
+            pool, job_pool = job_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+        with job_retries_lock:
+            timers = list(job_retries)
+        with job_pool_lock:
+            if not timers and job_pool is None:
+                return
+
+        for timer in timers:
+            timer.join()
+
+
+# this function puts jobs left behind by a stopped process back in the pool
+def requeue_jobs(stale_after: timedelta) -> int:
+    cutoff = datetime.utcnow() - stale_after
+
+    db.session.execute(
+        db.update(Jobs)
+        .where(Jobs.status == "running", Jobs.updated_at < cutoff)
+        .values(status="queued", updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+    job_ids = db.session.execute(
+        db.select(Jobs.id).where(Jobs.status == "queued").order_by(Jobs.id)
+    ).scalars()
+
+    count = 0
+    for job_id in job_ids:
+        get_job_pool().submit(run_job, job_id, current_course())
+        count += 1
+
+    return count
+
+
+@app.cli.command("requeue-jobs")
+@click.option(
+    "--stale-minutes",
+    default=30,
+    help="Running jobs not updated for this long are considered abandoned.",
+)
+@click.option(
+    "--course", default=None, help="Course key, the default database if unset."
+)
+def requeue_jobs_command(stale_minutes, course):
+    """Resubmit queued and abandoned jobs, and wait for them to finish."""
+    if course and not course_engines.exists(course):
+        raise click.ClickException(f"Unknown course: {course}")
+
+    with course_context(course):
+        count = requeue_jobs(timedelta(minutes=stale_minutes))
+    wait_for_jobs()
+    click.echo(f"Requeued {count} job(s)")
+
+
+@app.cli.command("submit-job")
+@click.argument("kind")
+@click.option("--payload", default="{}", help="Keyword arguments as a json object.")
+@click.option(
+    "--course", default=None, help="Course key, the default database if unset."
+)
+def submit_job_command(kind, payload, course):
+    """Run a background job, with retries, and wait for it to finish."""
+    # handlers are registered further down the file, so the kind is checked here
+    if kind not in JOB_HANDLERS:
+        raise click.ClickException(
+            f"Unknown job kind: {kind}, choose from {', '.join(sorted(JOB_HANDLERS))}"
+        )
+    if course and not course_engines.exists(course):
+        raise click.ClickException(f"Unknown course: {course}")
+
+    try:
+        payload = json.loads(payload)
+    except ValueError as error:
+        raise click.ClickException(f"The payload is not valid json: {error}")
+    if not isinstance(payload, dict):
+        raise click.ClickException("The payload must be a json object")
+
+    with course_context(course):
+        job_id = submit_job(kind, payload, submitted_by="cli")
+    wait_for_jobs()
+
+    with course_context(course):
+        job = db.session.get(Jobs, job_id)
+        click.echo(
+            f"Job {job_id} ({kind}) {job.status} after {job.attempts} attempt(s)"
+        )
+        click.echo(job.result if job.status == "done" else job.error)
+
+    if job.status != "done":
+        sys.exit(1)
+
+
+# WRITE COALESCING
+# under a submission spike, rows are queued and inserted in small batches,
+# so many requests share one commit (and one fsync) instead of paying for their own
+
+
+# collects rows for one table and inserts them in batches from a single thread
+class WriteBatcher:
+    # on_flush(rows) runs in the transaction of every batch, before the commit
+    def __init__(self, model, config_prefix, on_flush=None):
+        self.model = model
+        self.config_prefix = config_prefix
+        self.on_flush = on_flush
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    # queues a row for the current course and returns a future that resolves once
+    # the row is committed
+    def submit(self, row) -> Future:
+        self.start()
+
+        future = Future()
+        self.queue.put((current_course(), row, future))
+        return future
+
+    # starts the writer thread, once per process
+    def start(self):
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(
+                    target=self.run, name=f"batcher-{self.model.__tablename__}"
+                )
+                self.thread.daemon = True
+                self.thread.start()
+                self.pid = os.getpid()
+
+    # waits for a first row, then collects more until the batch is full or the
+    # wait time runs out
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            batch_size = app.config[self.config_prefix + "_BATCH_SIZE"]
+            deadline = time.monotonic() + app.config[self.config_prefix + "_BATCH_WAIT"]
+
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # every course database gets its own transaction
+            by_course = {}
+            for course, row, future in batch:
+                by_course.setdefault(course, []).append((row, future))
+
+            for course, rows in by_course.items():
+                self.flush(course, rows)
+
+    # inserts a batch in one transaction and answers every waiting request
+    def flush(self, course, batch):
+        # rows whose request gave up waiting were cancelled, they are not written.
+        # The others can't be cancelled any more once they are marked running
+        batch = [(row, f) for row, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        with course_context(course):
+            try:
+                rows = [row for row, _ in batch]
+                db.session.execute(db.insert(self.model), rows)
+                if self.on_flush:
+                    self.on_flush(rows)
+                bump_versions(self.model.__tablename__)
+                db.session.commit()
+            except Exception as error:
+                db.session.rollback()
+                for _, future in batch:
+                    future.set_exception(error)
+                return
+
+        for _, future in batch:
+            future.set_result(True)
+
+
+feedback_batcher = WriteBatcher(
+    Feedback, "FEEDBACK", on_flush=lambda rows: update_feedback_digest(rows)
+)
+
+
+# CALENDAR FEEDS
+# .ics feeds are built from the Assessments table and kept in memory until the
+# tables they depend on change, so polling calendar clients mostly get a 304
+
+
+# built feeds by key, each entry is (versions, body, etag, built_at)
+calendar_cache = OrderedDict()
+calendar_cache_lock = threading.Lock()
+
+
+# this function returns the signer of links to personal feeds, calendar clients
+# can't log in. Every course has its own salt, so a link only works in its course
+def calendar_signer():
+    course = current_course()
+    salt = f"calendar-feed:{course}" if course else "calendar-feed"
+    return URLSafeSerializer(app.config["SECRET_KEY"], salt=salt)
+
+
+# this function escapes text for an icalendar property value
+def ics_escape(text) -> str:
+    text = str(text or "")
+    for old, new in (("\\", "\\\\"), (";", "\\;"), (",", "\\,"), ("\n", "\\n")):
+        text = text.replace(old, new)
+    return text
+
+
+# this function folds a content line to 75 octets, as icalendar requires
+def ics_fold(line: str) -> str:
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line
+
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        # don't cut a multi byte character in half
+        while limit < len(data) and (data[limit] & 0xC0) == 0x80:
+            limit -= 1
+        parts.append(data[:limit].decode("utf-8"))
+        data = data[limit:]
+
+    return "\r\n ".join(parts)
+
+
+# this function returns the timezone due dates are saved in
+# returns None if this machine has no timezone data
+def course_timezone():
+    try:
+        return ZoneInfo(app.config["COURSE_TIMEZONE"])
+    except ZoneInfoNotFoundError:
+        return None
+
+
+# this function formats a due date as a utc icalendar timestamp
+def ics_time(due_date) -> str:
+    zone = course_timezone()
+
+    if zone is None:
+        # no timezone data on this machine, fall back to floating local time
+        return due_date.strftime("%Y%m%dT%H%M%S")
+
+    due_date = due_date.replace(tzinfo=zone).astimezone(timezone.utc)
+    return due_date.strftime("%Y%m%dT%H%M%SZ")
+
+
+# this function builds the text of a feed
+# notes holds extra lines for some assessments, by assessment name
+def build_calendar(name, notes=None) -> str:
+    notes = notes or {}
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+
+    assessments = db.session.execute(
+        db.select(
+            Assessments.assessment_name,
+            Assessments.assessment_type,
+            Assessments.due_date,
+            Assessments.location,
+            Assessments.weight,
+            Assessments.description,
+        )
+        .where(Assessments.due_date.is_not(None))
+        .order_by(Assessments.due_date)
+    )
+
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//CSCB20//Course Calendar//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{ics_escape(name)}",
+        f"X-WR-TIMEZONE:{app.config['COURSE_TIMEZONE']}",
+    ]
+
+    for assessment in assessments:
+        if not assessment.due_date:
+            continue
+
+        uid = hashlib.sha1(assessment.assessment_name.encode("utf-8")).hexdigest()
+        description = [assessment.description, f"Weight: {assessment.weight}%"]
+        description += notes.get(assessment.assessment_name, [])
+
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{uid}@cscb20",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{ics_time(assessment.due_date)}",
+            f"SUMMARY:{ics_escape(assessment.assessment_name)}",
+            f"DESCRIPTION:{ics_escape(chr(10).join(description))}",
+            f"CATEGORIES:{ics_escape(assessment.assessment_type)}",
+        ]
+        if assessment.location:
+            lines.append(f"LOCATION:{ics_escape(assessment.location)}")
+        lines.append("END:VEVENT")
+
+    lines.append("END:VCALENDAR")
+
+    return "\r\n".join(ics_fold(line) for line in lines) + "\r\n"
+
+
+# this function builds the grade and regrade notes of a student's feed
+def student_calendar_notes(username) -> dict:
+    notes = {}
+
+    grades = db.session.execute(
+        db.select(Grades.assessment_name, Grades.grade).where(
+            Grades.student_username == username
+        )
+    )
+    for assessment_name, grade in grades:
+        notes.setdefault(assessment_name, []).append(f"Your grade: {grade}%")
+
+    regrades = db.session.execute(
+        db.select(Regrades.assessment_name, Regrades.status).where(
+            Regrades.student_username == username
+        )
+    )
+    for assessment_name, status in regrades:
+        state = "resolved" if status else "open"
+        notes.setdefault(assessment_name, []).append(f"Regrade request: {state}")
+
+    return notes
+
+
+# this function serves a feed, rebuilding it only when its tables changed
+def calendar_response(key, tables, build, cache_control):
+    key = (current_course(), key)
+    versions = get_versions(tables)
+
+    with calendar_cache_lock:
+        cached = calendar_cache.get(key)
+        if cached and cached[0] == versions:
+            calendar_cache.move_to_end(key)
+
+    if not cached or cached[0] != versions:
+        body = build()
+        etag = hashlib.sha1(
+            f"{ETAG_SALT}|{key}|{sorted(versions.items())}".encode("utf-8")
+        ).hexdigest()
+        built_at = datetime.now(timezone.utc).replace(microsecond=0)
+
+        cached = (versions, body, etag, built_at)
+
+        with calendar_cache_lock:
+            calendar_cache[key] = cached
+            calendar_cache.move_to_end(key)
+            while len(calendar_cache) > app.config["CALENDAR_CACHE_SIZE"]:
+                calendar_cache.popitem(last=False)
+
+    _, body, etag, built_at = cached
+
+    response = app.response_class(body, mimetype="text/calendar")
+    response.set_etag(etag)
+    response.last_modified = built_at
+    response.headers["Cache-Control"] = cache_control
+    return response.make_conditional(request)
+
+
+# this function returns the secret link to a student's personal feed
+def personal_calendar_url(username) -> str:
+    token = calendar_signer().dumps(username)
+    return url_for("personal_calendar_feed", token=token, _external=True)
+
+
+# FILE DOWNLOADS
+# handouts and solutions are served by the download route below instead of the
+# static handler, so solutions can require a login and a front proxy can send the bytes
+
+
+# this function checks if a file in the files folder holds solutions
+def is_solutions_file(filename: str) -> bool:
+    name = os.path.basename(filename).lower()
+
+    if name in app.config["SOLUTIONS_FILES"]:
+        return True
+
+    linked = db.session.execute(
+        db.select(Assessments.assessment_name)
+        .where(db.func.lower(Assessments.solutions_link) == name)
+        .limit(1)
+    ).first()
+    return linked is not None
+
+
+# this function hands the transfer of a file to the front proxy
+# the response has no body, the proxy reads the file from disk itself
+def proxy_file_response(filename: str, path: str):
+    response = app.response_class()
+    # the header is a uri, so spaces and non-ascii names must be percent-encoded
+    location = app.config["X_ACCEL_PREFIX"] + urllib.parse.quote(filename)
+    response.headers["X-Accel-Redirect"] = location
+    response.headers["Content-Type"] = (
+        mimetypes.guess_type(path)[0] or "application/octet-stream"
+    )
+    return response
+
+
+# send old /static/files/ links to the download route
+@app.before_request
+def redirect_static_files():
+    if request.endpoint == "static" and request.view_args:
+        path = request.view_args.get("filename", "")
+        if path.startswith("files/"):
+            return redirect(url_for("download", filename=path[6:]), 301)
+
+
+# LIVE UPDATES
+# pages subscribe to a channel over server-sent events and the write helpers
+# publish to it after they commit, so students don't have to keep reloading
+# the hub lives in memory, so it only reaches connections held by the same process:
+# run a single process with threads (or an async worker) when using the streams
+
+
+# fans events out to the connections subscribed to each channel
+class EventHub:
+    def __init__(self):
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    # returns a queue that receives the events of a channel
+    def subscribe(self, channel) -> queue.Queue:
+        events = queue.Queue(maxsize=app.config["EVENTS_QUEUE_SIZE"])
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(events)
+        return events
+
+    def unsubscribe(self, channel, events):
+        with self.lock:
+            subscribers = self.channels.get(channel, set())
+            subscribers.discard(events)
+            if not subscribers:
+                self.channels.pop(channel, None)
+
+    # sends an event to every connection on a channel
+    # a connection that stopped reading loses the event instead of blocking the writer
+    def publish(self, channel, event, data):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+
+        for events in subscribers:
+            try:
+                events.put_nowait((event, data))
+            except queue.Full:
+                pass
+
+    # returns how many connections are open, by channel
+    def count(self) -> dict:
+        with self.lock:
+            return {channel: len(events) for channel, events in self.channels.items()}
+
+
+event_hub = EventHub()
+
+
+# this function formats one server-sent event
+def sse_message(event, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+# this function streams the events of a channel until the client disconnects
+# keepalive comments stop proxies from closing an idle connection
+def event_stream(channel):
+    events = event_hub.subscribe(channel)
+    keepalive = app.config["EVENTS_KEEPALIVE"]
+
+    def generate():
+        try:
+            yield f"retry: {app.config['EVENTS_RETRY']}\n\n"
+            while True:
+                try:
+                    event, data = events.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_message(event, data)
+        finally:
+            event_hub.unsubscribe(channel, events)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # nginx must not buffer the stream
+    return response
+
+
+# this function returns the channel of a student's regrade updates
+def regrade_channel(username: str) -> str:
+    return f"regrades:{current_course() or ''}:{username}"
+
+
+# SESSIONS
+# a login lasts while the user keeps using the site (PERMANENT_SESSION_LIFETIME of
+# idle time), but at most SESSION_MAX_AGE. With "keep me logged in", a returning
+# user is logged back in from a remember-me token, checked with a sha256 hmac
+# instead of a bcrypt verification
+
+
+# this function returns the keyed hash a remember-me validator is stored as
+def remember_hash(validator: str) -> str:
+    key = app.config["SECRET_KEY"].encode("utf-8")
+    return hmac.new(key, validator.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+# this function logs a user in
+def start_session(username: str, user_type: str):
+    session["name"] = username
+    session["user_type"] = user_type
+    session["course"] = current_course()
+    session["login_at"] = time.time()
+    session.permanent = True
+
+
+# this function stores a new remember-me token and sets its cookie on the response
+def issue_remember_token(response, username: str):
+    selector = secrets.token_urlsafe(12)
+    validator = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+
+    # expired tokens of the user are cleared on the way
+    db.session.execute(
+        db.delete(RememberTokens).where(
+            RememberTokens.username == username, RememberTokens.expires_at < now
+        )
+    )
+    db.session.add(
+        RememberTokens(
+            selector=selector,
+            validator_hash=remember_hash(validator),
+            username=username,
+            created_at=now,
+            expires_at=now + app.config["REMEMBER_ME_LIFETIME"],
+        )
+    )  # type: ignore
+    db.session.commit()
+
+    response.set_cookie(
+        course_cookie_name(app.config["REMEMBER_ME_COOKIE"]),
+        f"{selector}:{validator}",
+        max_age=int(app.config["REMEMBER_ME_LIFETIME"].total_seconds()),
+        path=app.session_interface.get_cookie_path(app),
+        secure=app.config["SESSION_COOKIE_SECURE"],
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def forget_remember_cookie(response):
+    response.delete_cookie(
+        course_cookie_name(app.config["REMEMBER_ME_COOKIE"]),
+        path=app.session_interface.get_cookie_path(app),
+    )
+
+
+# this function checks a remember-me cookie
+# returns the username and user type it belongs to, or None if it is not valid
+def check_remember_token(cookie: str):
+    selector, _, validator = cookie.partition(":")
+
+    token = db.session.execute(
+        db.select(
+            RememberTokens.id,
+            RememberTokens.validator_hash,
+            RememberTokens.expires_at,
+            Person.username,
+            Person.user_type,
+        )
+        .join(Person, Person.username == RememberTokens.username)
+        .where(RememberTokens.selector == selector)
+    ).first()
+
+    if (
+        not token
+        or token.expires_at < datetime.utcnow()
+        or not hmac.compare_digest(token.validator_hash, remember_hash(validator))
+    ):
+        return None
+
+    db.session.execute(
+        db.update(RememberTokens)
+        .where(RememberTokens.id == token.id)
+        .values(last_used_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+    return token
+
+
+# this function deletes remember-me tokens, the one in the cookie or all of a user's
+def revoke_remember_tokens(cookie=None, username=None):
+    statement = db.delete(RememberTokens)
+
+    if username:
+        statement = statement.where(RememberTokens.username == username)
+    elif cookie:
+        statement = statement.where(RememberTokens.selector == cookie.partition(":")[0])
+    else:
+        return
+
+    db.session.execute(statement)
+    db.session.commit()
+
+
+# ends sessions past their maximum age and logs users back in from their token
+@app.before_request
+def restore_session():
+    if request.endpoint == "static":
+        return
+
+    if "name" in session:
+        # sessions from before login_at was recorded start counting now
+        login_at = session.setdefault("login_at", time.time())
+        if time.time() - login_at < app.config["SESSION_MAX_AGE"].total_seconds():
+            return
+        session.clear()
+
+    cookie = request.cookies.get(course_cookie_name(app.config["REMEMBER_ME_COOKIE"]))
+    if not cookie:
+        return
+
+    token = check_remember_token(cookie)
+    if token:
+        start_session(token.username, token.user_type)
+    else:
+        g.forget_remember_cookie = True
+
+
+@app.after_request
+def clear_remember_cookie(response):
+    if g.get("forget_remember_cookie"):
+        forget_remember_cookie(response)
+    return response
+
+
+# DATABASE MAINTENANCE
+# sqlite never refreshes its planner statistics or gives freed pages back on its own,
+# run `flask db-maintain` from cron after busy weeks, or `flask submit-job
+# db_maintenance` to keep a record in the Jobs table with retries
+
+
+# this function returns the size of a sqlite database, with its wal file
+def database_stats(connection) -> dict:
+    path = connection.engine.url.database
+    stats = {
+        "file_bytes": sum(
+            os.path.getsize(name)
+            for name in (path, path + "-wal")
+            if path and os.path.exists(name)
+        )
+    }
+
+    for pragma in ("page_size", "page_count", "freelist_count"):
+        stats[pragma] = connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+
+    return stats
 
 
-# initialize flask
-app = Flask(__name__)
-bcrypt = Bcrypt(app)
-app.config["SECRET_KEY"] = (
-    "8a0f946f1471e113e528d927220ad977ed8b2cce63303beff10c8cb4a15e1a99"
-)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///course.db"
-app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(minutes=10)
+# refreshes planner statistics, a full ANALYZE the first time and
+# PRAGMA optimize (which only analyzes tables that changed a lot) after that
+def maintenance_analyze(connection):
+    analyzed = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).scalar()
 
-# intitalize db
-db = SQLAlchemy(app)
+    if analyzed:
+        connection.exec_driver_sql("PRAGMA optimize")
+        return "optimize"
 
+    connection.exec_driver_sql("ANALYZE")
+    return "full analyze"
 
-# this function parses a raw date string into a more presentable format
-def parse_date(date: str) -> str:
-    return date[:10] + ", " + date[11:]
 
+# gives free pages back to the file system
+# incremental vacuum needs auto_vacuum=INCREMENTAL, which only a full VACUUM can
+# switch on, so the first run rewrites the file once
+def maintenance_vacuum(connection):
+    if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+        return "full vacuum, incremental from now on"
 
-# add the parse data function to jinja2 template
-app.jinja_env.globals.update(parse_date=parse_date)
+    pages = app.config["DB_VACUUM_PAGES"]
+    free = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
 
+    # the pragma frees one page per step and execute() only steps once,
+    # executescript() runs it to the end
+    connection.connection.driver_connection.executescript(
+        "PRAGMA incremental_vacuum" + (f"({int(pages)})" if pages else "")
+    )
 
-# database response class
-class DBResponse:
-    def __init__(self, success, message):
-        self.success = success
-        self.message = message
+    freed = free - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return f"{freed} of {free} free page(s) released"
 
-    def to_dict(self):
-        return {"success": self.success, "message": self.message}
 
+# copies the wal file into the database and truncates it
+def maintenance_checkpoint(connection):
+    if connection.exec_driver_sql("PRAGMA journal_mode").scalar() != "wal":
+        return "skipped, not in wal mode"
 
-# tables
-class Person(db.Model):
-    __tablename__ = "Person"
+    busy, log, checkpointed = connection.exec_driver_sql(
+        "PRAGMA wal_checkpoint(TRUNCATE)"
+    ).first()
+    if busy:
+        return f"busy, {checkpointed} of {log} page(s) copied"
+    return f"{checkpointed} page(s) copied"
+
+
+# checks the file for corruption, the result is "ok" when nothing is wrong
+def maintenance_integrity(connection):
+    problems = connection.exec_driver_sql("PRAGMA integrity_check").scalars().all()
+    return "; ".join(problems[:10])
+
+
+MAINTENANCE_STEPS = {
+    "analyze": maintenance_analyze,
+    "vacuum": maintenance_vacuum,
+    "checkpoint": maintenance_checkpoint,
+    "integrity": maintenance_integrity,
+}
+
+
+# this function runs maintenance steps on the current course database
+# returns the size before and after, and the result and time of every step
+def maintain_database(steps=None) -> dict:
+    steps = steps or app.config["DB_MAINTENANCE_STEPS"]
+    unknown = set(steps) - set(MAINTENANCE_STEPS)
+    if unknown:
+        raise ValueError(f"Unknown maintenance step: {', '.join(sorted(unknown))}")
+
+    engine = db.session.get_bind()
+    if engine.dialect.name != "sqlite":
+        raise ValueError("Maintenance is only supported for SQLite databases")
+
+    # VACUUM can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        report = {"before": database_stats(connection), "steps": []}
+
+        for step in steps:
+            started = time.perf_counter()
+            result = MAINTENANCE_STEPS[step](connection)
+            report["steps"].append(
+                {
+                    "step": step,
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "result": result,
+                }
+            )
 
-    username = db.Column(db.String(20), primary_key=True)
-    last_name = db.Column(db.String(20), nullable=False)
-    first_name = db.Column(db.String(20), nullable=False)
-    password = db.Column(db.String(20), nullable=False)
-    user_type = db.Column(db.String(20), nullable=False)
+        report["after"] = database_stats(connection)
 
-    def __repr__(self):
-        return f"Person('{self.username}', '{self.first_name}')"
+    return report
 
 
-class Grades(db.Model):
-    __tablename__ = "Grades"
+@app.cli.command("db-maintain")
+@click.option(
+    "--step",
+    "steps",
+    multiple=True,
+    type=click.Choice(list(MAINTENANCE_STEPS)),
+    help="Run only this step, can be repeated. Runs every step by default.",
+)
+@click.option(
+    "--course", default=None, help="Course key, the default database if unset."
+)
+@click.option(
+    "--all-courses", is_flag=True, help="Also maintain every course database."
+)
+def db_maintain_command(steps, course, all_courses):
+    """Analyze, vacuum, checkpoint and check the database."""
+    courses = [course]
+    if all_courses:
+        folder = app.config["COURSES_FOLDER"]
+        courses = [None] + sorted(
+            name[:-3]
+            for name in (os.listdir(folder) if os.path.isdir(folder) else [])
+            if name.endswith(".db") and COURSE_KEY.match(name[:-3])
+        )
+    elif course and not course_engines.exists(course):
+        raise click.ClickException(f"Unknown course: {course}")
+
+    for key in courses:
+        with course_context(key):
+            try:
+                report = maintain_database(steps)
+            except ValueError as error:
+                raise click.ClickException(str(error))
+
+        click.echo(f"[{key or 'default'}]")
+        for step in report["steps"]:
+            click.echo(
+                f"  {step['step']:<12}{step['seconds']:>8.3f}s  {step['result']}"
+            )
 
-    student_username = db.Column(
-        db.String(20), db.ForeignKey("Person.username"), primary_key=True
+        before, after = report["before"], report["after"]
+        click.echo(
+            f"  size        {before['file_bytes']:,} -> {after['file_bytes']:,} bytes, "
+            f"{before['page_count']} -> {after['page_count']} pages, "
+            f"{after['freelist_count']} free"
+        )
+
+
+# GRADE CHANGE LOG
+# every grade write appends to GradeChanges in the same transaction, so anything
+# derived from grades can keep a cursor into the log and apply only the new entries
+# instead of rescanning Grades. On sqlite writers are serialized, so entries become
+# visible in seq order; a consumer on postgresql should stay a few seconds behind
+# the newest entry, because sequence numbers can commit out of order there
+
+
+# this function appends grade changes to the log
+# it does not commit, so the entries land in the same transaction as the write
+def log_grade_changes(changes):
+    changed_by = session.get("name") if has_request_context() else None
+    changed_at = datetime.utcnow()
+    db.session.execute(
+        db.insert(GradeChanges),
+        [
+            dict(change, changed_by=changed_by, changed_at=changed_at)
+            for change in changes
+        ],
     )
-    assessment_name = db.Column(
-        db.String(30), db.ForeignKey("Assessments.assessment_name"), primary_key=True
+
+
+# this function reads the log entries after a seq, oldest first
+def read_grade_changes(after=0, limit=None, student=None, assessment=None) -> list:
+    statement = (
+        db.select(*GradeChanges.__table__.c)
+        .where(GradeChanges.seq > after)
+        .order_by(GradeChanges.seq)
+        .limit(limit or app.config["GRADE_CHANGES_BATCH"])
     )
-    assessment_type = db.Column(db.String(20), nullable=False)
-    grade = db.Column(db.Integer, default=None)
+    if student:
+        statement = statement.where(GradeChanges.student_username == student)
+    if assessment:
+        statement = statement.where(GradeChanges.assessment_name == assessment)
+    return read_rows(statement)
+
+
+# this function feeds the log entries a consumer has not seen yet to apply(entries)
+# each batch is applied and the cursor moved in one transaction, so a failure never
+# applies an entry twice, and two runs of the same consumer can't both apply a batch
+def consume_grade_changes(name, apply, batch_size=None) -> int:
+    batch_size = batch_size or app.config["GRADE_CHANGES_BATCH"]
+
+    db.session.execute(
+        dialect_insert(ChangeCursors)
+        .values(name=name, position=0, updated_at=datetime.utcnow())
+        .on_conflict_do_nothing()
+    )
+    db.session.commit()
+
+    applied = 0
+    while True:
+        position = db.session.execute(
+            db.select(ChangeCursors.position).where(ChangeCursors.name == name)
+        ).scalar_one()
+        changes = read_grade_changes(after=position, limit=batch_size)
+        if not changes:
+            db.session.rollback()
+            break
+
+        # move the cursor only if nobody else moved it since we read it
+        moved = db.session.execute(
+            db.update(ChangeCursors)
+            .where(ChangeCursors.name == name, ChangeCursors.position == position)
+            .values(position=changes[-1].seq, updated_at=datetime.utcnow())
+        ).rowcount
+        if not moved:
+            db.session.rollback()
+            break
+
+        apply(changes)
+        db.session.commit()
+        applied += len(changes)
 
+        if len(changes) < batch_size:
+            break
 
-class Regrades(db.Model):
-    __tablename__ = "Regrades"
+    return applied
 
-    regrade_id = db.Column(db.Integer, primary_key=True)
-    assessment_name = db.Column(
-        db.String(30), db.ForeignKey("Assessments.assessment_name"), nullable=False
+
+# this function adds log entries to the per assessment running totals
+def apply_grade_stats(changes):
+    deltas = {}
+    for change in changes:
+        total, count = deltas.get(change.assessment_name, (0, 0))
+        # a missing grade (None) is not part of the average
+        total += (change.new_grade or 0) - (change.old_grade or 0)
+        count += (change.new_grade is not None) - (change.old_grade is not None)
+        deltas[change.assessment_name] = (total, count)
+
+    statement = dialect_insert(GradeStats).values(
+        [
+            {"assessment_name": name, "total": total, "count": count}
+            for name, (total, count) in deltas.items()
+        ]
     )
-    student_username = db.Column(
-        db.String(20), db.ForeignKey("Person.username"), nullable=False
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["assessment_name"],
+            set_={
+                "total": GradeStats.total + statement.excluded.total,
+                "count": GradeStats.count + statement.excluded.count,
+            },
+        )
     )
-    description = db.Column(db.String(1000), nullable=False)
-    status = db.Column(db.Boolean, default=False, nullable=False)
 
 
-class Assessments(db.Model):
+# this function returns the average of every assessment, from the running totals
+def grade_averages() -> dict:
+    consume_grade_changes("grade_stats", apply_grade_stats)
+    rows = read_rows(
+        db.select(GradeStats.assessment_name, GradeStats.total, GradeStats.count)
+    )
+    return {
+        name: round(total / count, 2) if count else None for name, total, count in rows
+    }
+
+
+# this function returns every change to one grade, oldest first
+def grade_history(student, assessment) -> list:
+    return read_rows(
+        db.select(
+            GradeChanges.seq,
+            GradeChanges.old_grade,
+            GradeChanges.new_grade,
+            GradeChanges.source,
+            GradeChanges.regrade_id,
+            GradeChanges.changed_by,
+            GradeChanges.changed_at,
+        )
+        .where(
+            GradeChanges.student_username == student,
+            GradeChanges.assessment_name == assessment,
+        )
+        .order_by(GradeChanges.seq)
+    )
 
-    __tablename__ = "Assessments"
 
-    assessment_name = db.Column(db.String(30), primary_key=True)
-    assessment_type = db.Column(db.String(20), nullable=False)
-    due_date = db.Column(db.String(20))
-    location = db.Column(db.String(20))
-    weight = db.Column(db.REAL)
-    handout_link = db.Column(db.String(100))
-    solutions_link = db.Column(db.String(100))
-    description = db.Column(db.String(1000), nullable=False)
+# FEEDBACK DIGEST
+# the instructor feedback page shows response counts per week and the terms that
+# come up most in each answer. Both are counters updated with every submission,
+# so the page reads a few small rows however much feedback there is
 
 
-class Feedback(db.Model):
+# the questions of the feedback form, as (column, what the digest calls it)
+FEEDBACK_FIELDS = (
+    ("instructor_like", "What students like about your teaching"),
+    ("instructor_improve", "How your teaching could improve"),
+    ("labs_like", "What students like about the labs"),
+    ("labs_improve", "How the labs could improve"),
+)
 
-    __tablename__ = "Feedback"
+FEEDBACK_TERM = re.compile(r"[a-z][a-z'-]*[a-z]")
+
+# words too common to say anything about the feedback
+FEEDBACK_STOPWORDS = frozenset("""
+    about after again all also and any are because been before being but can
+    could did does doing don't during each few for from had has have having her
+    here hers him his how i'm into it's its just like more most much not now off
+    once only other our out over own really same she should some such than that
+    the their them then there these they this those through too under until very
+    was way were what when where which while who why will with would you your
+    """.split())
+
+
+# this function returns the distinct terms of an answer
+def feedback_terms(text) -> set:
+    terms = set()
+    for term in FEEDBACK_TERM.findall((text or "").lower()):
+        if term.endswith("'s"):
+            term = term[:-2]
+        if 3 <= len(term) <= 40 and term not in FEEDBACK_STOPWORDS:
+            terms.add(term)
+    return terms
+
+
+# this function returns the week a response belongs to, as the date of its monday
+# in the course's timezone
+def feedback_period(submitted_at) -> str:
+    if submitted_at is None:
+        return "earlier"
+
+    zone = course_timezone()
+    if zone is not None:
+        submitted_at = submitted_at.replace(tzinfo=timezone.utc).astimezone(zone)
+    return (submitted_at.date() - timedelta(days=submitted_at.weekday())).isoformat()
+
+
+# this function adds an upsert of counters for every key, in chunks
+# rows are sorted, so concurrent writers always lock them in the same order
+def add_to_counters(model, keys, counts, column="responses"):
+    rows = [dict(zip(keys, key), **{column: count}) for key, count in counts.items()]
+    rows.sort(key=lambda row: tuple(row[name] for name in keys))
+
+    for start in range(0, len(rows), 500):
+        statement = dialect_insert(model).values(rows[start : start + 500])
+        db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={column: getattr(model, column) + statement.excluded[column]},
+            )
+        )
 
-    id = db.Column(db.Integer, primary_key=True)
-    instructor_username = db.Column(
-        db.String(20), db.ForeignKey("Person.username"), nullable=False
+
+# this function adds new feedback rows to the digest
+# it does not commit, so the digest changes in the same transaction as the rows
+def update_feedback_digest(rows):
+    periods = Counter()
+    terms = Counter()
+
+    for row in rows:
+        instructor = row["instructor_username"]
+        periods[(instructor, feedback_period(row.get("submitted_at")))] += 1
+        for field, _ in FEEDBACK_FIELDS:
+            for term in feedback_terms(row.get(field)):
+                terms[(instructor, field, term)] += 1
+
+    add_to_counters(FeedbackPeriods, ("instructor_username", "period"), periods)
+    add_to_counters(FeedbackTerms, ("instructor_username", "field", "term"), terms)
+
+
+# this function builds the digest from the feedback sent before it existed
+def backfill_feedback_digest():
+    if db.session.execute(db.select(FeedbackPeriods.period).limit(1)).first():
+        return
+
+    columns = [Feedback.instructor_username, Feedback.submitted_at] + [
+        getattr(Feedback, field) for field, _ in FEEDBACK_FIELDS
+    ]
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Feedback.id, *columns)
+            .where(Feedback.id > last_id)
+            .order_by(Feedback.id)
+            .limit(1000)
+        ).all()
+        if not rows:
+            break
+        update_feedback_digest([row._asdict() for row in rows])
+        last_id = rows[-1].id
+
+    db.session.commit()
+
+
+# this function reads an instructor's digest: totals, recent weeks and top terms
+def feedback_digest(instructor) -> dict:
+    total = db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(FeedbackPeriods.responses), 0)).where(
+            FeedbackPeriods.instructor_username == instructor
+        )
+    ).scalar()
+
+    periods = read_rows(
+        db.select(FeedbackPeriods.period, FeedbackPeriods.responses)
+        .where(FeedbackPeriods.instructor_username == instructor)
+        .order_by(FeedbackPeriods.period == "earlier", FeedbackPeriods.period.desc())
+        .limit(app.config["FEEDBACK_DIGEST_PERIODS"])
     )
-    instructor_like = db.Column(db.String(1000))
-    instructor_improve = db.Column(db.String(1000))
-    labs_like = db.Column(db.String(1000))
-    labs_improve = db.Column(db.String(1000))
+
+    terms = []
+    for field, label in FEEDBACK_FIELDS:
+        top = read_rows(
+            db.select(FeedbackTerms.term, FeedbackTerms.responses)
+            .where(
+                FeedbackTerms.instructor_username == instructor,
+                FeedbackTerms.field == field,
+            )
+            .order_by(FeedbackTerms.responses.desc(), FeedbackTerms.term)
+            .limit(app.config["FEEDBACK_DIGEST_TERMS"])
+        )
+        terms.append((label, top))
+
+    return {"total": total, "periods": periods, "terms": terms}
+
+
+# LAYOUT FRAGMENTS
+# the header (with the navigation) and the footer of template.html only depend on
+# whether someone is logged in and as what, so each is rendered once per role and
+# url prefix and reused, and a page request only renders its own body
+
+
+# rendered fragments by (name, role, script root)
+layout_fragments = {}
+layout_fragments_lock = threading.Lock()
+
+
+# this function returns the role the layout is drawn for
+def layout_role() -> str:
+    if "name" not in session:
+        return "anonymous"
+    return session.get("user_type", "student")
+
+
+# this function returns a rendered layout fragment (templates/layout_<name>.html)
+# fragments get no page context, only the role, so they are the same for everyone
+# with that role. The cache is skipped while templates are reloaded on change
+def layout_fragment(name):
+    role = layout_role()
+    key = (name, role, request.script_root)
+
+    cache = app.config["LAYOUT_FRAGMENT_CACHE"] and not app.jinja_env.auto_reload
+    html = layout_fragments.get(key) if cache else None
+    if html is None:
+        template = app.jinja_env.get_template(f"layout_{name}.html")
+        html = Markup(template.render(role=role))
+        if cache:
+            with layout_fragments_lock:
+                layout_fragments[key] = html
+    return html
+
+
+app.jinja_env.globals.update(layout_fragment=layout_fragment)
+
+
+# GRADE CHARTS
+# the instructor grades page shows a histogram per assessment. Each svg is built
+# from one grouped query and saved under CHARTS_FOLDER, named after the last grade
+# change of its assessment, so a chart is only drawn again after its grades change
+# and its url can be cached by browsers for good
+
+
+# this function returns the last grade change of every assessment, in one query
+# the change log only grows, so this is a version number for each assessment's data
+def chart_versions() -> dict:
+    rows = read_rows(
+        db.select(GradeChanges.assessment_name, db.func.max(GradeChanges.seq)).group_by(
+            GradeChanges.assessment_name
+        )
+    )
+    return {name: version for name, version in rows}
+
+
+# this function returns the chart version of one assessment, None if it does not exist
+def chart_version(assessment):
+    if not db.session.get(Assessments, assessment):
+        return None
+
+    version = db.session.execute(
+        db.select(db.func.max(GradeChanges.seq)).where(
+            GradeChanges.assessment_name == assessment
+        )
+    ).scalar()
+    return version or 0
+
+
+# this function returns how many grades fall in each bucket of an assessment
+def chart_buckets(assessment) -> list:
+    size = app.config["CHART_BUCKET"]
+    last = 100 // size  # 100 and over share the last bar
+
+    # integer division and case are the same on every backend, min() with two
+    # arguments is a scalar on sqlite but an aggregate on postgresql
+    bucket = db.case(
+        (Grades.grade >= last * size, last),
+        (Grades.grade < 0, 0),
+        else_=Grades.grade // size,
+    ).label("bucket")
+
+    counts = [0] * (last + 1)
+    rows = read_rows(
+        db.select(bucket, db.func.count()).where(
+            Grades.assessment_name == assessment, Grades.grade.is_not(None)
+        )
+        # by the output name, so the bound numbers in the case aren't compared
+        .group_by(db.literal_column("bucket"))
+    )
+    for index, count in rows:
+        counts[index] = count
+    return counts
+
+
+# this function draws a histogram as a small standalone svg
+def histogram_svg(title, counts) -> str:
+    size = app.config["CHART_BUCKET"]
+    width, height, bottom, top = 440, 200, 24, 16
+    bar = width / len(counts)
+    tallest = max(counts) or 1
+    plot = height - bottom - top
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}" font-family="sans-serif" font-size="11">',
+        f"<title>{escape(title)}</title>",
+        f'<line x1="0" y1="{height - bottom}" x2="{width}" y2="{height - bottom}" '
+        'stroke="gray"/>',
+    ]
+    for index, count in enumerate(counts):
+        x = index * bar
+        bar_height = plot * count / tallest
+        low = index * size
+        label = f"{low}+" if index == len(counts) - 1 else f"{low}-{low + size - 1}"
+        if count:
+            parts.append(
+                f'<rect x="{x + 2:.1f}" y="{height - bottom - bar_height:.1f}" '
+                f'width="{bar - 4:.1f}" height="{bar_height:.1f}" fill="#007fa3"/>'
+                f'<text x="{x + bar / 2:.1f}" y="{height - bottom - bar_height - 3:.1f}" '
+                f'text-anchor="middle">{count}</text>'
+            )
+        parts.append(
+            f'<text x="{x + bar / 2:.1f}" y="{height - 8}" text-anchor="middle" '
+            f'fill="gray">{label}</text>'
+        )
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+# this function returns the path of an assessment's chart for a version, drawing
+# and saving it first if needed. Older versions of the chart are removed
+def grade_chart(assessment, version) -> str:
+    folder = os.path.join(app.config["CHARTS_FOLDER"], current_course() or "")
+    prefix = hashlib.sha1(assessment.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(folder, f"{prefix}-{version}.svg")
+
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        svg = histogram_svg(
+            f"Grade distribution of {assessment}", chart_buckets(assessment)
+        )
+
+        # write to a temporary name first, so a chart is never served half written
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(svg)
+        os.replace(temporary, path)
+
+        for name in os.listdir(folder):
+            if name.startswith(prefix + "-") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except FileNotFoundError:
+                    pass
+
+    return path
 
 
 # HELPER FUNCTIONS
 
 
 # this function queries grades and returns them as a dict, where keys are assessments
+# the averages come from the running totals, after applying the newest changes
 def make_grades_dict():
-    all_grades = Grades.query.order_by(Grades.assessment_type.asc())
+    all_grades = read_rows(
+        db.select(
+            Grades.assessment_name, Grades.student_username, Grades.grade
+        ).order_by(Grades.assessment_type.asc())
+    )
 
     grades_by_assessment = {}
-    grades_avg = {}
-    grades_count = {}
-
     for grade in all_grades:
-        if grade.assessment_name not in grades_by_assessment:
-            grades_by_assessment[grade.assessment_name] = [grade]
-            grades_avg[grade.assessment_name] = grade.grade
-            grades_count[grade.assessment_name] = 1
-        else:
-            grades_by_assessment[grade.assessment_name].append(grade)
-            grades_avg[grade.assessment_name] += grade.grade
-            grades_count[grade.assessment_name] += 1
-
-    for assessment in grades_avg:
-        grades_avg[assessment] = round(
-            grades_avg[assessment] / grades_count[assessment], 2
-        )
+        grades_by_assessment.setdefault(grade.assessment_name, []).append(grade)
 
-    return grades_by_assessment, grades_avg
+    return grades_by_assessment, grade_averages()
 
 
 # like the previous function but for regrades
-def make_regrades_dict():
-    all_regrades = Regrades.query.filter(Regrades.status == 0)
+# the open requests are counted and paged in sql, in a single query
+# returns (regrades by assessment, open count by assessment), oldest requests first
+def make_regrades_dict(page=1, page_size=None):
+    page_size = page_size or app.config["REGRADE_PAGE_SIZE"]
+
+    by_assessment = {"partition_by": Regrades.assessment_name}
+    open_queue = (
+        db.select(
+            Regrades.regrade_id,
+            Regrades.assessment_name,
+            Regrades.student_username,
+            db.func.row_number()
+            .over(order_by=Regrades.regrade_id, **by_assessment)
+            .label("position"),
+            db.func.count().over(**by_assessment).label("open_count"),
+            db.func.min(Regrades.regrade_id).over(**by_assessment).label("oldest"),
+        )
+        .where(Regrades.status.is_(False))
+        .subquery()
+    )
+
+    rows = db.session.execute(
+        db.select(open_queue)
+        .where(
+            open_queue.c.position > (page - 1) * page_size,
+            open_queue.c.position <= page * page_size,
+        )
+        .order_by(open_queue.c.oldest, open_queue.c.position)
+    )
 
     regrades_by_assessment = {}
-    # grades_avg = {}
     regrades_count = {}
 
-    for regrade in all_regrades:
-        if regrade.assessment_name not in regrades_by_assessment:
-            regrades_by_assessment[regrade.assessment_name] = [regrade]
-            regrades_count[regrade.assessment_name] = 1
-        else:
-            regrades_by_assessment[regrade.assessment_name].append(regrade)
-            regrades_count[regrade.assessment_name] += 1
+    for regrade in rows:
+        regrades_by_assessment.setdefault(regrade.assessment_name, []).append(regrade)
+        regrades_count[regrade.assessment_name] = regrade.open_count
 
-    return regrades_by_assessment
+    return regrades_by_assessment, regrades_count
+
+
+# this function counts the open regrade requests of each assessment
+# used where only the numbers are shown, so no request is loaded
+def count_open_regrades() -> dict:
+    counts = db.session.execute(
+        db.select(Regrades.assessment_name, db.func.count())
+        .where(Regrades.status.is_(False))
+        .group_by(Regrades.assessment_name)
+        .order_by(Regrades.assessment_name)
+    )
+    return dict(counts.all())
 
 
 # calculates a students final grade given their grades db query tuple
@@ -160,8 +2555,9 @@ def calculate_overall_mark(grades):
     mark = 0
 
     for grade in grades:
-        mark += (grade.grade / 100) * grade.weight
-        total_weight += grade.weight
+        weight = grade.weight or 0
+        mark += (grade.grade / 100) * weight
+        total_weight += weight
 
     if total_weight == 0:
         return 0
@@ -170,6 +2566,156 @@ def calculate_overall_mark(grades):
     return final_mark
 
 
+# a small thread safe lru cache, its size is read from the config
+# with a ttl setting, entries also expire that many seconds after they were stored
+class LRUCache:
+    def __init__(self, size_setting, ttl_setting=None):
+        self.size_setting = size_setting
+        self.ttl_setting = ttl_setting
+        self.items = OrderedDict()  # key -> (value, expires or None)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+                self.items.pop(key, None)
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        expires = None
+        if self.ttl_setting:
+            expires = time.monotonic() + app.config[self.ttl_setting]
+
+        with self.lock:
+            self.items[key] = (value, expires)
+            self.items.move_to_end(key)
+            while len(self.items) > app.config[self.size_setting]:
+                self.items.popitem(last=False)
+
+    def discard(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.items.pop(key, None)
+
+    # the counters /api/cache_stats reports
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+# this function returns the letter grade of a mark
+def letter_grade(mark) -> str:
+    for letter, minimum in app.config["GRADE_SCALE"]:
+        if mark >= minimum:
+            return letter
+    return app.config["GRADE_SCALE"][-1][0]
+
+
+# works out what a student needs on the assessments that are not graded yet
+# rows are (assessment_name, weight, grade) with grade None when not graded.
+# One pass adds up the earned marks and the graded and remaining weight, every
+# target and what-if outcome is then a closed form of those sums
+def what_if(rows, averages) -> dict:
+    earned = graded_weight = remaining_weight = 0
+    remaining = []
+
+    for row in rows:
+        # an assessment without a weight doesn't count towards the mark
+        weight = row.weight or 0
+        if row.grade is None:
+            remaining_weight += weight
+            remaining.append([row.assessment_name, weight])
+        else:
+            earned += row.grade * weight
+            graded_weight += weight
+
+    total_weight = graded_weight + remaining_weight
+    result = {
+        "current_mark": round(earned / graded_weight, 2) if graded_weight else 0,
+        "graded_weight": graded_weight,
+        "remaining_weight": remaining_weight,
+        "remaining": {"fields": ["assessment_name", "weight"], "rows": remaining},
+    }
+    if not total_weight:
+        return result
+
+    # the average needed on the remaining work for each letter
+    targets = []
+    for letter, minimum in app.config["GRADE_SCALE"][:-1]:
+        needed = minimum * total_weight - earned
+
+        if needed <= 0:
+            targets.append([letter, minimum, 0, "secured"])
+        elif needed > 100 * remaining_weight:
+            targets.append([letter, minimum, None, "out of reach"])
+        else:
+            # rounded up, so reaching the shown average is always enough
+            required = math.ceil(needed / remaining_weight * 100) / 100
+            targets.append([letter, minimum, required, "possible"])
+
+    # the final mark for each average on the remaining work
+    outcomes = []
+    for average in averages:
+        final_mark = (earned + average * remaining_weight) / total_weight
+        outcomes.append([average, round(final_mark, 2), letter_grade(final_mark)])
+
+    result["targets"] = {
+        "fields": ["letter", "minimum_mark", "required_average", "status"],
+        "rows": targets,
+    }
+    result["what_if"] = {
+        "fields": ["remaining_average", "final_mark", "letter"],
+        "rows": outcomes,
+    }
+    return result
+
+
+what_if_cache = LRUCache("WHATIF_CACHE_SIZE")
+
+
+# this function returns the what-if results of a student, computed once per change
+# of that student's grades (their last entry in the grade change log) or of the
+# assessments table, so grading other students keeps this entry
+def student_what_if(student: str, averages) -> dict:
+    last_change = db.session.execute(
+        db.select(db.func.max(GradeChanges.seq)).where(
+            GradeChanges.student_username == student
+        )
+    ).scalar()
+    assessments = get_versions(("Assessments",)).get("Assessments", 0)
+    key = (current_course(), student, last_change, assessments, averages)
+
+    result = what_if_cache.get(key)
+    if result is None:
+        rows = db.session.execute(
+            db.select(Assessments.assessment_name, Assessments.weight, Grades.grade)
+            .outerjoin(
+                Grades,
+                (Grades.assessment_name == Assessments.assessment_name)
+                & (Grades.student_username == student),
+            )
+            .order_by(Assessments.due_date, Assessments.assessment_name)
+        ).all()
+
+        result = what_if(rows, averages)
+        what_if_cache.put(key, result)
+
+    return result
+
+
 # resolves a regrade request in the db
 def process_regrade(regrade_id, new_grade):
 
@@ -178,52 +2724,288 @@ def process_regrade(regrade_id, new_grade):
         response = DBResponse(success=False, message="Please fill all the fields")
         return response.to_dict()
 
-    # get the regrade request
-    regrade_tuple = Regrades.query.filter_by(regrade_id=regrade_id).first()
+    # grades are stored as whole numbers
+    try:
+        new_grade = int(new_grade)
+    except ValueError:
+        response = DBResponse(
+            success=False, message="Please enter the grade as a whole number"
+        )
+        return response.to_dict()
+
+    # close the request and get its keys back in a single statement
+    # a request that is already resolved (or missing) matches nothing,
+    # so two instructors can't resolve the same request twice
+    try:
+        resolved = db.session.execute(
+            db.update(Regrades)
+            .where(Regrades.regrade_id == regrade_id, Regrades.status.is_(False))
+            .values(status=True)
+            .returning(
+                Regrades.regrade_id,
+                Regrades.student_username,
+                Regrades.assessment_name,
+            )
+        ).first()
 
-    # get the grade tuple
-    grade_tuple = Grades.query.filter_by(
-        student_username=regrade_tuple.student_username,  # type: ignore
-        assessment_name=regrade_tuple.assessment_name,  # type: ignore
-    ).first()
+        if not resolved:
+            db.session.rollback()
+            response = DBResponse(
+                success=False,
+                message="This regrade request does not exist or was already resolved",
+            )
+            return response.to_dict()
 
-    # update the data
-    regrade_tuple.status = 1  # type: ignore
-    grade_tuple.grade = new_grade  # type: ignore
+        # read the grade being replaced, the update on Regrades already holds the
+        # write lock on sqlite and the row lock keeps it stable on postgresql
+        key = (
+            Grades.student_username == resolved.student_username,
+            Grades.assessment_name == resolved.assessment_name,
+        )
+        old = db.session.execute(
+            db.select(Grades.assessment_type, Grades.grade)
+            .where(*key)
+            .with_for_update()
+        ).first()
+
+        # without a grade there is nothing to change, keep the request open
+        if not old:
+            db.session.rollback()
+            response = DBResponse(
+                success=False,
+                message="This student has no grade for this assessment yet",
+            )
+            return response.to_dict()
+
+        # write the new grade in the same transaction
+        db.session.execute(db.update(Grades).where(*key).values(grade=new_grade))
+
+        log_grade_changes(
+            [
+                {
+                    "student_username": resolved.student_username,
+                    "assessment_name": resolved.assessment_name,
+                    "assessment_type": old.assessment_type,
+                    "old_grade": old.grade,
+                    "new_grade": new_grade,
+                    "source": "regrade",
+                    "regrade_id": resolved.regrade_id,
+                }
+            ]
+        )
 
-    # update db
-    try:
+        bump_versions("Grades", "Regrades")
         db.session.commit()
+
+        # tell the student's open regrade pages
+        event_hub.publish(
+            regrade_channel(resolved.student_username),
+            "regrade",
+            {
+                "assessment": resolved.assessment_name,
+                "status": "resolved",
+                "grade": new_grade,
+            },
+        )
+
         response = DBResponse(success=True, message="Regrade processed")
 
         return response.to_dict()
 
     except Exception as error:
-        response = DBResponse(
-            success=False, message=f"Database Error: {type(error).__name__}"
-        )
+        db.session.rollback()
+        response = DBResponse(success=False, message=db_error_message(error))
 
         return response.to_dict()
 
 
-# this function gets all the assignments
+# this function turns a database exception into a message for the user
+def db_error_message(error) -> str:
+    if "database is locked" in str(error):
+        return "The database is busy right now, please try again in a moment"
+
+    if isinstance(error, IntegrityError):
+        return "This change conflicts with data that is already saved"
+
+    return f"Database Error: {type(error).__name__}"
+
+
+# this function runs a read only select and returns its rows
+# rows are light named tuples, no orm objects are built or tracked
+def read_rows(statement) -> list:
+    return db.session.execute(statement).all()
+
+
+# this function gets all the assignments, with the columns the page shows
 def query_assignments():
-    assignments = Assessments.query.filter_by(assessment_type="assignment").all()
+    assignments = read_rows(
+        db.select(
+            Assessments.assessment_name,
+            Assessments.description,
+            Assessments.weight,
+            Assessments.due_date,
+            Assessments.handout_link,
+            Assessments.solutions_link,
+        ).where(Assessments.assessment_type == "assignment")
+    )
     return assignments
 
 
 # this function gets all the assignments
 def query_labs():
-    labs = Assessments.query.filter_by(assessment_type="lab").all()
+    labs = read_rows(
+        db.select(
+            Assessments.assessment_name,
+            Assessments.description,
+            Assessments.handout_link,
+            Assessments.solutions_link,
+        ).where(Assessments.assessment_type == "lab")
+    )
     return labs
 
 
 # this function gets all the tests
 def query_tests():
-    tests = Assessments.query.filter_by(assessment_type="test").all()
+    tests = read_rows(
+        db.select(
+            Assessments.assessment_name,
+            Assessments.due_date,
+            Assessments.location,
+            Assessments.weight,
+            Assessments.description,
+        ).where(Assessments.assessment_type == "test")
+    )
     return tests
 
 
+# people rows barely change, so the logged in user's profile and the role rosters
+# are cached across requests. add_users() and import_roster() drop the entries they
+# make stale, the ttl bounds how long other worker processes can serve old rows
+profile_cache = LRUCache("PROFILE_CACHE_SIZE", "PROFILE_CACHE_TTL")
+roster_cache = LRUCache("ROSTER_CACHE_SIZE", "ROSTER_CACHE_TTL")
+PEOPLE_CACHES = {"profiles": profile_cache, "rosters": roster_cache}
+
+# requests served and cache lookups made by them, see count_cache_lookups()
+request_cache_stats = Counter()
+request_cache_stats_lock = threading.Lock()
+
+_missing = object()
+
+
+# this function returns a cached value, loading and storing it on a miss
+# None is never stored, so a user created later is not hidden by an old miss
+def cached(cache, key, load):
+    value = cache.get(key, _missing)
+    hit = value is not _missing
+    if not hit:
+        value = load()
+        if value is not None:
+            cache.put(key, value)
+
+    if has_request_context():
+        counts = g.setdefault("cache_lookups", Counter())
+        counts["hits" if hit else "misses"] += 1
+    return value
+
+
+# this function returns the logged in user's profile (no password), None if logged out
+# it is read once per request, and from the profile cache when possible
+def current_user():
+    if "name" not in session:
+        return None
+
+    if "user" not in g:
+        username = session["name"]
+        g.user = cached(
+            profile_cache,
+            (current_course(), username),
+            lambda: db.session.execute(
+                db.select(
+                    Person.username,
+                    Person.first_name,
+                    Person.last_name,
+                    Person.user_type,
+                ).where(Person.username == username)
+            ).first(),
+        )
+    return g.user
+
+
+# this function drops the cached rows a change to these people makes stale
+def invalidate_people(usernames=()):
+    course = current_course()
+    roster_cache.discard(*((course, user_type) for user_type in USER_TYPES))
+    profile_cache.discard(*((course, username) for username in usernames))
+
+
+# every request adds its cache lookups to the totals /api/cache_stats reports
+@app.after_request
+def count_cache_lookups(response):
+    if request.endpoint != "static":
+        lookups = g.get("cache_lookups", Counter())
+        with request_cache_stats_lock:
+            request_cache_stats["requests"] += 1
+            request_cache_stats.update(lookups)
+    return response
+
+
+# this function gets the users of a role, for drop downs
+def query_people(user_type: str):
+    people = cached(
+        roster_cache,
+        (current_course(), user_type),
+        lambda: tuple(
+            read_rows(
+                db.select(Person.username, Person.first_name, Person.last_name).where(
+                    Person.user_type == user_type
+                )
+            )
+        ),
+    )
+    return people
+
+
+# this function gets the feedback sent to an instructor, newest first
+# with a page, only that page is read (and one more row, to tell if there is a next)
+def query_feedback(instructor: str, page=None, page_size=None):
+    statement = (
+        db.select(
+            Feedback.id,
+            Feedback.instructor_like,
+            Feedback.instructor_improve,
+            Feedback.labs_like,
+            Feedback.labs_improve,
+            Feedback.submitted_at,
+        )
+        .where(Feedback.instructor_username == instructor)
+        .order_by(Feedback.id.desc())
+    )
+    if page is not None:
+        page_size = page_size or app.config["FEEDBACK_PAGE_SIZE"]
+        statement = statement.offset((page - 1) * page_size).limit(page_size + 1)
+
+    feedback = read_rows(statement)
+    return feedback
+
+
+# this function gets the next few deadlines, using the due date index
+def query_upcoming_deadlines(limit: int):
+    now = datetime.now(course_timezone()).replace(tzinfo=None)
+
+    deadlines = db.session.execute(
+        db.select(
+            Assessments.assessment_name,
+            Assessments.assessment_type,
+            Assessments.due_date,
+            Assessments.location,
+        )
+        .where(Assessments.due_date >= now)
+        .order_by(Assessments.due_date)
+        .limit(limit)
+    ).all()
+    return deadlines
+
+
 # this function checks if a given username is in the db
 def check_username(username: str):
     user = Person.query.filter_by(username=username).first()
@@ -247,7 +3029,7 @@ def check_grade(assessment: str, student: str):
 # this function checks if a given regrade request is in the db
 def check_regrade(assessment: str, student: str):
     regrade = Regrades.query.filter_by(
-        assessment_name=assessment, student_username=student, status=0
+        assessment_name=assessment, student_username=student, status=False
     ).first()
     return regrade
 
@@ -267,6 +3049,12 @@ def add_assignment(details) -> dict:
         )
         return response.to_dict()
 
+    due_date = parse_form_date(due_date)
+
+    if not due_date:
+        response = DBResponse(success=False, message="Please enter a valid due date")
+        return response.to_dict()
+
     # all fields are non empty, and username and email are unique
     # so, create user
 
@@ -283,6 +3071,7 @@ def add_assignment(details) -> dict:
     # add to db
     try:
         db.session.add(assignment)
+        bump_versions("Assessments")
         db.session.commit()
 
         response = DBResponse(success=True, message="Assignment added")
@@ -328,6 +3117,7 @@ def add_lab(details) -> dict:
     # add to db
     try:
         db.session.add(lab)
+        bump_versions("Assessments")
         db.session.commit()
 
         response = DBResponse(success=True, message="Lab added")
@@ -372,8 +3162,16 @@ def insert_regrade(details) -> dict:
     # add to db
     try:
         db.session.add(regrade)
+        bump_versions("Regrades")
         db.session.commit()
 
+        # other tabs of the student show the new request too
+        event_hub.publish(
+            regrade_channel(student),
+            "regrade",
+            {"assessment": assessment_name, "status": "open"},
+        )
+
         response = DBResponse(success=True, message="Regrade added")
 
         return response.to_dict()
@@ -404,18 +3202,47 @@ def submit_feedback(details) -> dict:
     # all fields are non empty, and username and email are unique
     # so, create user
 
+    row = {
+        "instructor_username": instructor_username,
+        "instructor_like": like_instructor,
+        "instructor_improve": improve_instructor,
+        "labs_like": like_labs,
+        "labs_improve": improve_labs,
+        "submitted_at": datetime.utcnow(),
+    }
+
+    # coalesced path, wait until the batch holding this row is committed
+    if app.config["FEEDBACK_GROUP_COMMIT"]:
+        future = feedback_batcher.submit(row)
+        try:
+            future.result(timeout=app.config["FEEDBACK_ACK_TIMEOUT"])
+            response = DBResponse(success=True, message="Feedback added")
+        except FutureTimeoutError:
+            # a row that is still queued is dropped, so the student can safely
+            # resubmit. A row already being written will still be committed
+            if future.cancel():
+                response = DBResponse(
+                    success=False,
+                    message="Feedback could not be saved in time, please try again",
+                )
+            else:
+                response = DBResponse(
+                    success=True,
+                    message="Feedback received, it will be saved in a moment",
+                )
+        except Exception as error:
+            response = DBResponse(success=False, message=db_error_message(error))
+
+        return response.to_dict()
+
     # create new feedback
-    feedback = Feedback(
-        instructor_username=instructor_username,
-        instructor_like=like_instructor,
-        instructor_improve=improve_instructor,
-        labs_like=like_labs,
-        labs_improve=improve_labs,
-    )  # type: ignore
+    feedback = Feedback(**row)  # type: ignore
 
     # insert to db
     try:
         db.session.add(feedback)
+        update_feedback_digest([row])
+        bump_versions("Feedback")
         db.session.commit()
 
         response = DBResponse(success=True, message="Feedback added")
@@ -440,51 +3267,95 @@ def insert_grade(details) -> dict:
         )
         return response.to_dict()
 
-    if check_grade(assessment_name, student_name):
+    # grades are stored as whole numbers
+    try:
+        grade = int(grade)
+    except ValueError:
         response = DBResponse(
-            success=False,
-            message="This student already has a grade for this assessment. You can update this grade via a regrade request",
+            success=False, message="Please enter the grade as a whole number"
         )
         return response.to_dict()
 
-    user = check_username(student_name)
-
-    if not user:
-        response = DBResponse(
-            success=False,
-            message="This student does not exist in the database",
+    # insert the grade only if the student and assessment exist, and skip it if
+    # the student already has a grade, all in one statement
+    statement = (
+        dialect_insert(Grades)
+        .from_select(
+            ["assessment_name", "assessment_type", "student_username", "grade"],
+            db.select(
+                Assessments.assessment_name,
+                Assessments.assessment_type,
+                Person.username,
+                db.literal(grade, db.Integer),
+            )
+            .join(Person, db.true())
+            .where(
+                Assessments.assessment_name == assessment_name,
+                Person.username == student_name,
+                Person.user_type == "student",
+            ),
         )
-        return response.to_dict()
-
-    if user.user_type == "instructor":
-        response = DBResponse(
-            success=False,
-            message="You can only add grades for students",
+        .on_conflict_do_nothing()
+        .returning(
+            Grades.student_username,
+            Grades.assessment_name,
+            Grades.assessment_type,
+            Grades.grade,
         )
-        return response.to_dict()
-
-    # all fields valid
-    grade = Grades(
-        assessment_name=assessment_name,
-        assessment_type=assessment_type,
-        student_username=student_name,
-        grade=grade,
-    )  # type: ignore
+    )
 
     # insert to db
     try:
-        db.session.add(grade)
+        inserted = db.session.execute(statement).first()
+
+        if not inserted:
+            db.session.rollback()
+            response = DBResponse(
+                success=False, message=grade_rejected_message(details)
+            )
+            return response.to_dict()
+
+        log_grade_changes(
+            [
+                {
+                    "student_username": inserted.student_username,
+                    "assessment_name": inserted.assessment_name,
+                    "assessment_type": inserted.assessment_type,
+                    "new_grade": inserted.grade,
+                    "source": "insert",
+                }
+            ]
+        )
+        bump_versions("Grades")
         db.session.commit()
 
         response = DBResponse(success=True, message="Grade added")
 
         return response.to_dict()
     except Exception as error:
-        response = DBResponse(
-            success=False, message=f"Database Error: {type(error).__name__}"
-        )
+        db.session.rollback()
+        response = DBResponse(success=False, message=db_error_message(error))
+
+        return response.to_dict()
+
+
+# this function explains why insert_grade did not insert anything
+# it only runs on the failure path, so successful writes stay one statement
+def grade_rejected_message(details) -> str:
+    assessment_name, assessment_type, student_name, grade = details
+
+    if check_grade(assessment_name, student_name):
+        return "This student already has a grade for this assessment. You can update this grade via a regrade request"
+
+    user = check_username(student_name)
+
+    if not user:
+        return "This student does not exist in the database"
 
-        return response.to_dict()
+    if user.user_type == "instructor":
+        return "You can only add grades for students"
+
+    return "This assessment does not exist in the database"
 
 
 # this function inserts an new test to the db
@@ -504,6 +3375,12 @@ def add_test(details) -> dict:
         )
         return response.to_dict()
 
+    due_date = parse_form_date(due_date)
+
+    if not due_date:
+        response = DBResponse(success=False, message="Please enter a valid date")
+        return response.to_dict()
+
     # all fields are valid
 
     test = Assessments(
@@ -518,6 +3395,7 @@ def add_test(details) -> dict:
     # insert to db
     try:
         db.session.add(test)
+        bump_versions("Assessments")
         db.session.commit()
 
         response = DBResponse(success=True, message="Test added")
@@ -565,7 +3443,9 @@ def add_users(reg_details) -> dict:
     # add to db
     try:
         db.session.add(user)
+        bump_versions("Person")
         db.session.commit()
+        invalidate_people([username])
 
         response = DBResponse(
             success=True, message="Registration successful! Please login now"
@@ -582,6 +3462,185 @@ def add_users(reg_details) -> dict:
         return response.to_dict()
 
 
+# columns of a roster csv, user_type is optional and defaults to student
+ROSTER_COLUMNS = ("username", "first_name", "last_name", "password")
+USER_TYPES = ("student", "instructor")
+
+
+# this function hashes many passwords across a pool of ROSTER_HASH_WORKERS
+# processes. The workers are spawned, not forked, so they don't inherit the
+# database connections and threads of this process, and they only import bcrypt.
+# Salts are made here with the same rounds as flask-bcrypt, so the hashes check
+# with bcrypt.check_password_hash() like any other
+def hash_passwords(passwords) -> list:
+    rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+    passwords = [password.encode("utf-8") for password in passwords]
+    salts = [bcrypt_salt(rounds) for _ in passwords]
+
+    # starting the workers costs more than a few hashes
+    workers = min(app.config["ROSTER_HASH_WORKERS"], len(passwords))
+    if workers <= 1 or len(passwords) < app.config["ROSTER_HASH_MIN_PARALLEL"]:
+        return [
+            bcrypt_hash(p, salt).decode("utf-8") for p, salt in zip(passwords, salts)
+        ]
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        hashes = pool.map(bcrypt_hash, passwords, salts, chunksize=8)
+        return [hashed.decode("utf-8") for hashed in hashes]
+
+
+# this function creates the accounts listed in a roster csv
+# existing usernames are found up front with one IN query per 500 names,
+# passwords are hashed in parallel by hash_passwords() and every new account is
+# inserted in a single transaction
+def import_roster(lines) -> dict:
+    reader = csv.DictReader(lines)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+
+    missing = [column for column in ROSTER_COLUMNS if column not in reader.fieldnames]
+    if missing:
+        response = DBResponse(
+            success=False,
+            message=f"The roster is missing columns: {', '.join(missing)}",
+        )
+        return response.to_dict()
+
+    rows, invalid, seen = [], [], set()
+    for line, record in enumerate(reader, start=2):
+        record = {key: (value or "").strip() for key, value in record.items() if key}
+        record["user_type"] = record.get("user_type") or "student"
+
+        if any(not record[column] for column in ROSTER_COLUMNS):
+            invalid.append({"line": line, "error": "Please fill all the fields"})
+        elif any(len(record[column]) > 20 for column in ROSTER_COLUMNS[:3]):
+            invalid.append(
+                {"line": line, "error": "Names are limited to 20 characters"}
+            )
+        elif record["user_type"] not in USER_TYPES:
+            invalid.append({"line": line, "error": "Unknown user type"})
+        elif record["username"] in seen:
+            invalid.append({"line": line, "error": "Username repeated in the roster"})
+        else:
+            seen.add(record["username"])
+            rows.append(record)
+
+    # the usernames already in use, one IN query per 500 names, which stays under
+    # sqlite's limit on bound parameters
+    usernames = [row["username"] for row in rows]
+    duplicates = set()
+    for start in range(0, len(usernames), 500):
+        duplicates.update(
+            db.session.execute(
+                db.select(Person.username).where(
+                    Person.username.in_(usernames[start : start + 500])
+                )
+            ).scalars()
+        )
+    rows = [row for row in rows if row["username"] not in duplicates]
+
+    hashes = hash_passwords([row["password"] for row in rows])
+    people = [
+        {
+            "username": row["username"],
+            "first_name": row["first_name"],
+            "last_name": row["last_name"],
+            "password": hashed,
+            "user_type": row["user_type"],
+        }
+        for row, hashed in zip(rows, hashes)
+    ]
+
+    try:
+        if people:
+            db.session.execute(db.insert(Person), people)
+            bump_versions("Person")
+            db.session.commit()
+            invalidate_people([person["username"] for person in people])
+    except Exception as error:
+        db.session.rollback()
+        response = DBResponse(success=False, message=db_error_message(error))
+        return response.to_dict()
+
+    response = DBResponse(success=True, message=f"{len(people)} account(s) created")
+    result = response.to_dict()
+    result.update(created=len(people), duplicates=sorted(duplicates), invalid=invalid)
+    return result
+
+
+@app.cli.command("import-roster")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--course", default=None, help="Course key, the default database if unset."
+)
+def import_roster_command(path, course):
+    """Create the accounts listed in a roster csv."""
+    if course and not course_engines.exists(course):
+        raise click.ClickException(f"Unknown course: {course}")
+
+    started = time.perf_counter()
+    with course_context(course), open(path, newline="", encoding="utf-8-sig") as file:
+        result = import_roster(file)
+
+    if not result["success"]:
+        raise click.ClickException(result["message"])
+
+    click.echo(f"{result['message']} in {time.perf_counter() - started:.1f}s")
+    if result["duplicates"]:
+        click.echo(f"Already registered: {', '.join(result['duplicates'])}")
+    for problem in result["invalid"]:
+        click.echo(f"Line {problem['line']}: {problem['error']}")
+
+
+# JOB HANDLERS
+
+
+# recomputes the average of every assessment
+@job_handler("grade_stats", web=True)
+def grade_stats_job():
+    return grade_averages()
+
+
+# the same as `flask db-maintain`, run with `flask submit-job db_maintenance`
+@job_handler("db_maintenance")
+def db_maintenance_job(steps=None):
+    return maintain_database(steps)
+
+
+# imports a roster uploaded to /import_roster, then deletes the upload
+@job_handler("import_roster")
+def import_roster_job(path):
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        result = import_roster(file)
+
+    os.remove(path)
+    return result
+
+
+# writes every grade to a csv file in the instance folder
+@job_handler("export_grades", web=True)
+def export_grades_job():
+    export_dir = os.path.join(app.instance_path, "exports", current_course() or "")
+    os.makedirs(export_dir, exist_ok=True)
+
+    filename = f"grades-{datetime.utcnow():%Y%m%d-%H%M%S}.csv"
+    rows = db.session.execute(
+        db.select(
+            Grades.student_username,
+            Grades.assessment_name,
+            Grades.assessment_type,
+            Grades.grade,
+        ).order_by(Grades.student_username, Grades.assessment_name)
+    )
+
+    with open(os.path.join(export_dir, filename), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["student_username", "assessment_name", "type", "grade"])
+        writer.writerows(rows)
+
+    return {"file": filename}
+
+
 # these are the routes
 # for each route, pagename is the name of the css file and title is the page title
 # only home, login and register are viewable without login
@@ -591,7 +3650,55 @@ def add_users(reg_details) -> dict:
 @app.route("/home")
 def home():
     pagename = "home"
-    return render_template("home.html", pagename=pagename, title="CSCB20")
+
+    # upcoming deadlines are only shown to logged in users
+    deadlines = []
+    if "name" in session:
+        deadlines = query_upcoming_deadlines(app.config["UPCOMING_DEADLINES"])
+
+    return render_template(
+        "home.html", pagename=pagename, deadlines=deadlines, title="CSCB20"
+    )
+
+
+# handouts, solutions and the syllabus
+# supports range and conditional requests, and X-Accel-Redirect/X-Sendfile offload
+@app.route("/files/<path:filename>")
+def download(filename):
+    folder = app.config["FILES_FOLDER"]
+    path = safe_join(folder, filename)
+
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    solutions = is_solutions_file(filename)
+
+    if solutions and "name" not in session:
+        flash("You must be logged in to view this page")
+        return redirect(url_for("login"))
+
+    if app.config["SENDFILE_BACKEND"] == "nginx":
+        response = proxy_file_response(filename, path)
+    else:
+        # with USE_X_SENDFILE this only sets the X-Sendfile header for apache
+        response = send_from_directory(folder, filename, max_age=0)
+        # werkzeug only says so on a 206, tell clients up front they can resume
+        response.accept_ranges = "bytes"
+        if "X-Sendfile" in response.headers:
+            # mod_xsendfile url-decodes the path (XSendFileUnescape is on by default)
+            response.headers["X-Sendfile"] = urllib.parse.quote(
+                response.headers["X-Sendfile"]
+            )
+
+    # solutions must not be kept by shared caches
+    if solutions:
+        response.headers["Cache-Control"] = "private, no-cache"
+    else:
+        response.headers["Cache-Control"] = (
+            f"public, max-age={app.config['FILES_MAX_AGE']}"
+        )
+
+    return response
 
 
 @app.route("/calendar")
@@ -600,7 +3707,17 @@ def calendar():
         flash("You must be logged in to view this page")
         return render_template("login.html", pagename="login")
 
-    return render_template("calendar.html", pagename="calendar", title="Calendar")
+    personal_feed = None
+    if session["user_type"] == "student":
+        personal_feed = personal_calendar_url(session["name"])
+
+    return render_template(
+        "calendar.html",
+        pagename="calendar",
+        title="Calendar",
+        course_feed=url_for("calendar_feed", _external=True),
+        personal_feed=personal_feed,
+    )
 
 
 @app.route("/lectures")
@@ -619,8 +3736,12 @@ def labs():
         return render_template("login.html", pagename="login")
     pagename = "labs"
 
-    labs = query_labs()
-    return render_template("labs.html", pagename=pagename, labs=labs, title="Labs")
+    return versioned_response(
+        ("Assessments",),
+        lambda: render_template(
+            "labs.html", pagename=pagename, labs=query_labs(), title="Labs"
+        ),
+    )
 
 
 @app.route("/assignments")
@@ -630,14 +3751,15 @@ def assignments():
         return render_template("login.html", pagename="login")
     pagename = "assignments"
 
-    # get all the assignments
-    assignments = query_assignments()
-
-    return render_template(
-        "assignments.html",
-        pagename=pagename,
-        assignments=assignments,
-        title="Assignments",
+    # get all the assignments, only if the page has changed
+    return versioned_response(
+        ("Assessments",),
+        lambda: render_template(
+            "assignments.html",
+            pagename=pagename,
+            assignments=query_assignments(),
+            title="Assignments",
+        ),
     )
 
 
@@ -660,10 +3782,13 @@ def tests():
 
     pagename = "tests"
 
-    # get all the tests
-    tests = query_tests()
-
-    return render_template("tests.html", pagename=pagename, tests=tests, title="Tests")
+    # get all the tests, only if the page has changed
+    return versioned_response(
+        ("Assessments",),
+        lambda: render_template(
+            "tests.html", pagename=pagename, tests=query_tests(), title="Tests"
+        ),
+    )
 
 
 @app.route("/resources")
@@ -686,10 +3811,19 @@ def user():
     pagename = "user"
 
     # get current user
-    person = Person.query.filter_by(username=session["name"]).first()
+    person = current_user()
+
+    # instructors see how many regrade requests are waiting
+    open_regrades = None
+    if session["user_type"] == "instructor":
+        open_regrades = sum(count_open_regrades().values())
 
     return render_template(
-        "user.html", pagename=pagename, user=person, title="My Account"
+        "user.html",
+        pagename=pagename,
+        user=person,
+        open_regrades=open_regrades,
+        title="My Account",
     )
 
 
@@ -717,7 +3851,7 @@ def feedback():
         if session["user_type"] == "student":
 
             # student view
-            instructors = Person.query.filter_by(user_type="instructor").all()
+            instructors = query_people("instructor")
 
             return render_template(
                 "feedback.html",
@@ -726,19 +3860,12 @@ def feedback():
                 title="Feedback",
             )
 
-        # instructor view
+        # instructor view, the digest only, the answers are on feedback_responses
         else:
-            # get all the feedback
-            all_feedback = (
-                Feedback.query.filter_by(instructor_username=session["name"])
-                .order_by(Feedback.id.desc())
-                .all()
-            )
-
             return render_template(
                 "feedback.html",
                 pagename=pagename,
-                all_feedback=all_feedback,
+                digest=feedback_digest(session["name"]),
                 title="Feedback",
             )
 
@@ -760,7 +3887,7 @@ def feedback():
         response = submit_feedback(feedback_tuple)
 
         if not response["success"]:
-            instructors = Person.query.filter_by(user_type="instructor").all()
+            instructors = query_people("instructor")
             return render_template(
                 "feedback.html",
                 pagename=pagename,
@@ -774,6 +3901,36 @@ def feedback():
         return redirect(url_for("feedback"))
 
 
+# the full answers sent to the instructor, one page at a time
+@app.route("/feedback/responses")
+def feedback_responses():
+    pagename = "feedback"
+
+    if "name" not in session:
+        flash("You must be logged in to view this page")
+        return render_template("login.html", pagename="login", title="Feedback")
+
+    # students only have the form
+    if session["user_type"] != "instructor":
+        return redirect(url_for("feedback"))
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    all_feedback = query_feedback(session["name"], page)
+
+    # query_feedback reads one extra row when there is a next page
+    page_size = app.config["FEEDBACK_PAGE_SIZE"]
+    has_next = len(all_feedback) > page_size
+
+    return render_template(
+        "feedback.html",
+        pagename=pagename,
+        all_feedback=all_feedback[:page_size],
+        page=page,
+        has_next=has_next,
+        title="Feedback",
+    )
+
+
 @app.route("/grades")
 def grades():
     pagename = "grades"
@@ -783,32 +3940,77 @@ def grades():
         return render_template("login.html", pagename="login", title="Login")
 
     if session["user_type"] == "student":
-        grades = (
-            db.session.query(Grades.assessment_name, Grades.grade, Assessments.weight)
-            .join(Assessments, Grades.assessment_name == Assessments.assessment_name)
-            .filter(Grades.student_username == session["name"])
-            .all()
-        )
+        return versioned_response(("Grades", "Assessments"), render_student_grades)
+    else:
+        return versioned_response(("Grades",), render_all_grades)
 
-        final_mark = calculate_overall_mark(grades)
 
-        return render_template(
-            "grades.html",
-            pagename=pagename,
-            grades=grades,
-            final_mark=final_mark,
-            title="Grades",
+# renders the grades page of the logged in student
+def render_student_grades():
+    grades = (
+        db.session.query(Grades.assessment_name, Grades.grade, Assessments.weight)
+        .join(Assessments, Grades.assessment_name == Assessments.assessment_name)
+        .filter(Grades.student_username == session["name"])
+        .all()
+    )
+
+    final_mark = calculate_overall_mark(grades)
+
+    return render_template(
+        "grades.html",
+        pagename="grades",
+        grades=grades,
+        final_mark=final_mark,
+        title="Grades",
+    )
+
+
+# renders the grades page of an instructor
+def render_all_grades():
+    grades = make_grades_dict()
+
+    # chart urls carry the version, so a changed chart gets a new url
+    versions = chart_versions()
+    charts = {
+        assessment: url_for(
+            "grade_chart_svg", assessment=assessment, v=versions.get(assessment, 0)
         )
-    else:
-        grades = make_grades_dict()
+        for assessment in grades[0]
+    }
 
-        return render_template(
-            "grades.html",
-            pagename=pagename,
-            grades=grades[0],
-            avgs=grades[1],
-            title="Grades",
+    return render_template(
+        "grades.html",
+        pagename="grades",
+        grades=grades[0],
+        avgs=grades[1],
+        charts=charts,
+        title="Grades",
+    )
+
+
+# the grade distribution of an assessment, as an svg histogram
+# a request for the current version may be cached for good, its url never changes
+@app.route("/charts/<path:assessment>.svg")
+def grade_chart_svg(assessment):
+    if "name" not in session or session["user_type"] != "instructor":
+        abort(403)
+
+    version = chart_version(assessment)
+    if version is None:
+        abort(404)
+
+    path = grade_chart(assessment, version)
+    response = send_from_directory(
+        os.path.dirname(path), os.path.basename(path), mimetype="image/svg+xml"
+    )
+
+    if request.args.get("v", type=int) == version:
+        response.headers["Cache-Control"] = (
+            f"private, max-age={app.config['CHART_MAX_AGE']}, immutable"
         )
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @app.route("/regrades")
@@ -841,7 +4043,7 @@ def regrades():
                 & (Grades.student_username == Regrades.student_username),
             )
             .filter(
-                (Grades.student_username == session["name"]) & (Regrades.status == 1)
+                (Grades.student_username == session["name"]) & Regrades.status.is_(True)
             )
             .all()
         )
@@ -861,7 +4063,8 @@ def regrades():
                 & (Grades.student_username == Regrades.student_username),
             )
             .filter(
-                (Grades.student_username == session["name"]) & (Regrades.status == 0)
+                (Grades.student_username == session["name"])
+                & Regrades.status.is_(False)
             )
             .all()
         )
@@ -871,17 +4074,46 @@ def regrades():
             pagename=pagename,
             resolved_regrades=resolved_regrades,
             unresolved_regrades=unresolved_regrades,
+            events_url=url_for("regrade_events"),
             title=title,
         )
 
     else:  # instructor view
-        regrades = make_regrades_dict()
+        page = max(request.args.get("page", 1, type=int), 1)
+        page_size = app.config["REGRADE_PAGE_SIZE"]
+        regrades, counts = make_regrades_dict(page)
+
+        # a page past the end goes to the last page, not to an empty queue
+        if not regrades and page > 1:
+            longest = max(count_open_regrades().values(), default=0)
+            return redirect(
+                url_for("regrades", page=max(math.ceil(longest / page_size), 1))
+            )
+
+        # there is a next page if any assessment has more requests than shown
+        has_next = any(count > page * page_size for count in counts.values())
 
         return render_template(
-            "regrades.html", pagename=pagename, regrades=regrades, title=title
+            "regrades.html",
+            pagename=pagename,
+            regrades=regrades,
+            counts=counts,
+            page=page,
+            has_next=has_next,
+            title=title,
         )
 
 
+# live updates of the student's regrade requests, as server-sent events
+# the stream holds no database connection, it only waits on the event hub
+@app.route("/regrades/events")
+def regrade_events():
+    if "name" not in session or session["user_type"] != "student":
+        abort(403)
+
+    return event_stream(regrade_channel(session["name"]))
+
+
 # route for each specific regrade request
 @app.route("/regrade/<id>", methods=["GET", "POST"])
 def regrade_id(id: int):
@@ -909,14 +4141,25 @@ def regrade_id(id: int):
                 Regrades.assessment_name == Grades.assessment_name,
             ),
         )
-        .filter(Regrades.status == 0, Regrades.regrade_id == id)
+        .filter(Regrades.status.is_(False), Regrades.regrade_id == id)
         .first()
     )
 
+    # earlier changes to the same grade, from the grade change log
+    history = (
+        grade_history(regrade_req.student_username, regrade_req.assessment_name)
+        if regrade_req
+        else []
+    )
+
     # frontent view
     if request.method == "GET":
         return render_template(
-            "regrade_form.html", pagename=pagename, regrade_req=regrade_req, title=title
+            "regrade_form.html",
+            pagename=pagename,
+            regrade_req=regrade_req,
+            history=history,
+            title=title,
         )
 
     else:
@@ -930,6 +4173,7 @@ def regrade_id(id: int):
                 pagename=pagename,
                 error=response["message"],
                 regrade_req=regrade_req,
+                history=history,
                 title=title,
             )
 
@@ -1024,8 +4268,10 @@ def add_grade():
     pagename = "add_grade"
 
     # query students and assessments
-    students = Person.query.filter_by(user_type="student").all()
-    assessments = Assessments.query.all()
+    students = query_people("student")
+    assessments = read_rows(
+        db.select(Assessments.assessment_name, Assessments.assessment_type)
+    )
 
     if request.method == "GET":
         return render_template(
@@ -1188,11 +4434,14 @@ def login():
             return render_template("login.html", pagename=pagename, title=title)
         else:
             # logged in, set session details
-            user_type = person.user_type
-            session["name"] = username
-            session["user_type"] = user_type
-            session.permanent = True
-            return redirect(url_for("home"))
+            start_session(username, person.user_type)
+            response = redirect(url_for("home"))
+
+            # keep me logged in
+            if request.form.get("Remember"):
+                issue_remember_token(response, username)
+
+            return response
 
 
 @app.route("/logout")
@@ -1200,7 +4449,440 @@ def logout():
     # reset session
     session.pop("name", default=None)
     session.pop("user_type", default=None)
-    return redirect(url_for("home"))
+    session.pop("course", default=None)
+    session.pop("login_at", default=None)
+
+    # this device is not remembered anymore
+    response = redirect(url_for("home"))
+    cookie = request.cookies.get(course_cookie_name(app.config["REMEMBER_ME_COOKIE"]))
+    if cookie:
+        revoke_remember_tokens(cookie=cookie)
+        forget_remember_cookie(response)
+
+    return response
+
+
+# instructors upload a roster csv, the accounts are created by a background job
+@app.route("/import_roster", methods=["GET", "POST"])
+def import_roster_page():
+    title = "Import Roster"
+    pagename = "import_roster"
+
+    if "name" not in session:
+        flash("You must be logged in to view this page")
+        return render_template("login.html", pagename="login", title="Login")
+
+    if session["user_type"] != "instructor":
+        return redirect(url_for("home"))
+
+    if request.method == "GET":
+        return render_template("import_roster.html", pagename=pagename, title=title)
+
+    upload = request.files.get("roster")
+    if not upload or not upload.filename:
+        return render_template(
+            "import_roster.html",
+            pagename=pagename,
+            error="Please choose a csv file",
+            title=title,
+        )
+
+    # the job reads the file from the instance folder
+    folder = os.path.join(app.instance_path, "imports", current_course() or "")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"roster-{secrets.token_hex(8)}.csv")
+    upload.save(path)
+
+    job_id = submit_job("import_roster", {"path": path}, submitted_by=session["name"])
+
+    return render_template(
+        "import_roster.html",
+        pagename=pagename,
+        status_url=url_for("job_status", job_id=job_id),
+        title=title,
+    )
+
+
+# revokes every remember-me token of the user, then logs out
+@app.route("/forget_devices")
+def forget_devices():
+    if "name" not in session:
+        flash("You must be logged in to view this page")
+        return render_template("login.html", pagename="login", title="Login")
+
+    revoke_remember_tokens(username=session["name"])
+    flash("You will need to log in again on every device")
+    return logout()
+
+
+# submit a background job, returns right away with the job id
+@app.route("/jobs", methods=["POST"])
+def jobs():
+    if "name" not in session or session["user_type"] != "instructor":
+        return api_error("Only instructors can submit jobs", 403)
+
+    kind = request.form.get("kind", "")
+
+    if kind not in JOB_HANDLERS:
+        return api_error("Unknown job kind", 400)
+
+    if kind not in WEB_JOB_KINDS:
+        return api_error("This job kind cannot be submitted from the web", 403)
+
+    job_id = submit_job(kind, submitted_by=session["name"])
+
+    return api_response(
+        {
+            "success": True,
+            "job_id": job_id,
+            "status_url": url_for("job_status", job_id=job_id),
+        },
+        202,
+    )
+
+
+# poll the status of a background job
+@app.route("/jobs/<int:job_id>")
+def job_status(job_id: int):
+    if "name" not in session or session["user_type"] != "instructor":
+        return api_error("Only instructors can view jobs", 403)
+
+    job = db.session.execute(
+        db.select(
+            Jobs.id,
+            Jobs.kind,
+            Jobs.status,
+            Jobs.attempts,
+            Jobs.max_attempts,
+            Jobs.result,
+            Jobs.error,
+            Jobs.created_at,
+            Jobs.updated_at,
+        ).where(Jobs.id == job_id)
+    ).first()
+
+    if not job:
+        return api_error("This job does not exist", 404)
+
+    payload = job._asdict()
+    payload["result"] = json.loads(job.result) if job.result else None
+
+    return api_response(payload)
+
+
+# course wide deadline feed, deadlines are not private
+@app.route("/calendar.ics")
+def calendar_feed():
+    return calendar_response(
+        "course",
+        ("Assessments",),
+        lambda: build_calendar("CSCB20 Deadlines"),
+        "public, max-age=300",
+    )
+
+
+# personal feed of a student, the token in the link identifies them
+@app.route("/calendar/<token>.ics")
+def personal_calendar_feed(token):
+    try:
+        username = calendar_signer().loads(token)
+    except BadSignature:
+        return (
+            render_template(
+                "error.html", pagename="error", error="Unknown calendar", title="Error"
+            ),
+            404,
+        )
+
+    return calendar_response(
+        ("student", username),
+        ("Assessments", "Grades", "Regrades"),
+        lambda: build_calendar(
+            f"CSCB20 Deadlines ({username})", student_calendar_notes(username)
+        ),
+        "private, max-age=300",
+    )
+
+
+# JSON API
+# read only, rows are sent as plain arrays with the field names listed once
+
+
+# the fields each api resource can return, in their default order
+API_FIELDS = {
+    "assessments": {
+        "assessment_name": Assessments.assessment_name,
+        "assessment_type": Assessments.assessment_type,
+        "due_date": Assessments.due_date,
+        "location": Assessments.location,
+        "weight": Assessments.weight,
+        "handout_link": Assessments.handout_link,
+        "solutions_link": Assessments.solutions_link,
+        "description": Assessments.description,
+    },
+    "grades": {
+        "student_username": Grades.student_username,
+        "assessment_name": Grades.assessment_name,
+        "assessment_type": Grades.assessment_type,
+        "grade": Grades.grade,
+        "weight": Assessments.weight,
+    },
+    "regrades": {
+        "regrade_id": Regrades.regrade_id,
+        "assessment_name": Regrades.assessment_name,
+        "student_username": Regrades.student_username,
+        "description": Regrades.description,
+        "status": Regrades.status,
+    },
+}
+
+
+# this function turns values json can't handle (like dates) into strings
+def api_json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+# this function builds a compact json response
+def api_response(payload, status=200):
+    body = json.dumps(payload, separators=(",", ":"), default=api_json_default)
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+# this function sends an api error
+def api_error(message, status):
+    return api_response({"success": False, "message": message}, status)
+
+
+# this function picks the columns asked for with ?fields=a,b
+# returns the field names and columns, or None if a field does not exist
+def api_select_fields(resource):
+    available = API_FIELDS[resource]
+    requested = request.args.get("fields", "")
+
+    if not requested:
+        names = list(available)
+    else:
+        names = [name.strip() for name in requested.split(",") if name.strip()]
+
+    if any(name not in available for name in names):
+        return None
+
+    return names, [available[name] for name in names]
+
+
+# this function runs a select and serializes the raw tuple rows
+# no orm objects are built, rows go straight from the cursor to json
+def api_rows(names, statement, **extra):
+    rows = db.session.execute(statement).all()
+    payload = {"fields": names, "rows": [list(row) for row in rows]}
+    payload.update(extra)
+    return api_response(payload)
+
+
+@app.route("/api/assessments/<assessment_type>")
+def api_assessments(assessment_type):
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+
+    if assessment_type not in ("assignment", "lab", "test", "all"):
+        return api_error("Unknown assessment type", 404)
+
+    fields = api_select_fields("assessments")
+    if fields is None:
+        return api_error("Unknown field requested", 400)
+    names, columns = fields
+
+    statement = db.select(*columns).order_by(Assessments.assessment_name)
+    if assessment_type != "all":
+        statement = statement.where(Assessments.assessment_type == assessment_type)
+
+    return versioned_response(("Assessments",), lambda: api_rows(names, statement))
+
+
+@app.route("/api/deadlines")
+def api_deadlines():
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+
+    limit = request.args.get("limit", app.config["UPCOMING_DEADLINES"], type=int)
+    limit = max(1, min(limit, 100))
+
+    deadlines = query_upcoming_deadlines(limit)
+
+    response = api_response(
+        {
+            "fields": ["assessment_name", "assessment_type", "due_date", "location"],
+            "rows": [list(row) for row in deadlines],
+        }
+    )
+    response.headers["Cache-Control"] = "private, max-age=60"
+    return response
+
+
+@app.route("/api/grades")
+def api_grades():
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+
+    # students only ever see their own grades
+    if session["user_type"] == "student":
+        student = session["name"]
+    else:
+        student = request.args.get("student")
+
+    fields = api_select_fields("grades")
+    if fields is None:
+        return api_error("Unknown field requested", 400)
+    names, columns = fields
+
+    statement = db.select(*columns).join(
+        Assessments, Grades.assessment_name == Assessments.assessment_name
+    )
+    if student:
+        statement = statement.where(Grades.student_username == student)
+    statement = statement.order_by(Grades.student_username, Grades.assessment_name)
+
+    # the overall mark only makes sense for a single student
+    def render():
+        if not student:
+            return api_rows(names, statement)
+
+        marks = db.session.execute(
+            db.select(Grades.grade, Assessments.weight)
+            .join(Assessments, Grades.assessment_name == Assessments.assessment_name)
+            .where(Grades.student_username == student)
+        ).all()
+        return api_rows(names, statement, overall_mark=calculate_overall_mark(marks))
+
+    return versioned_response(("Grades", "Assessments"), render)
+
+
+@app.route("/api/regrades")
+def api_regrades():
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+
+    fields = api_select_fields("regrades")
+    if fields is None:
+        return api_error("Unknown field requested", 400)
+    names, columns = fields
+
+    statement = db.select(*columns).order_by(Regrades.regrade_id)
+
+    # students only ever see their own regrades
+    if session["user_type"] == "student":
+        statement = statement.where(Regrades.student_username == session["name"])
+    elif request.args.get("student"):
+        statement = statement.where(
+            Regrades.student_username == request.args["student"]
+        )
+
+    status = request.args.get("status")
+    if status == "open":
+        statement = statement.where(Regrades.status.is_(False))
+    elif status == "resolved":
+        statement = statement.where(Regrades.status.is_(True))
+    elif status:
+        return api_error("Status must be open or resolved", 400)
+
+    return versioned_response(("Regrades",), lambda: api_rows(names, statement))
+
+
+# what a student needs on the remaining assessments for each letter grade,
+# and the final mark for a few averages (add one with ?average=)
+@app.route("/api/whatif")
+def api_whatif():
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+
+    # students only ever see their own marks
+    if session["user_type"] == "student":
+        student = session["name"]
+    else:
+        student = request.args.get("student")
+        if not student:
+            return api_error("Please choose a student with ?student=", 400)
+
+    averages = list(app.config["WHATIF_AVERAGES"])
+    if "average" in request.args:
+        average = request.args.get("average", type=float)
+        if average is None or not 0 <= average <= 100:
+            return api_error("The average must be a number from 0 to 100", 400)
+        averages = sorted(set(averages) | {average})
+
+    return versioned_response(
+        ("Grades", "Assessments"),
+        lambda: api_response(student_what_if(student, tuple(averages))),
+    )
+
+
+# the grade change log after a cursor, oldest first
+# pass the returned "next" back as ?after= to read only what changed since
+@app.route("/api/grade_changes")
+def api_grade_changes():
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+
+    after = request.args.get("after", 0, type=int)
+    limit = request.args.get("limit", app.config["GRADE_CHANGES_PAGE"], type=int)
+    if after < 0 or not 0 < limit <= app.config["GRADE_CHANGES_BATCH"]:
+        return api_error(
+            f"after must be 0 or more and limit 1 to "
+            f"{app.config['GRADE_CHANGES_BATCH']}",
+            400,
+        )
+
+    # students only ever see their own grades
+    if session["user_type"] == "student":
+        student = session["name"]
+    else:
+        student = request.args.get("student")
+
+    changes = read_grade_changes(
+        after, limit, student=student, assessment=request.args.get("assessment")
+    )
+    names = list(GradeChanges.__table__.c.keys())
+    return api_response(
+        {
+            "fields": names,
+            "rows": [list(change) for change in changes],
+            "next": changes[-1].seq if changes else after,
+        }
+    )
+
+
+# hit rates of the people caches, and what they save per request
+@app.route("/api/cache_stats")
+def api_cache_stats():
+    if "name" not in session:
+        return api_error("You must be logged in to use the api", 401)
+    if session["user_type"] != "instructor":
+        return api_error("Only instructors can view cache stats", 403)
+
+    with request_cache_stats_lock:
+        totals = dict(request_cache_stats)
+    requests = totals.get("requests", 0)
+    hits = totals.get("hits", 0)
+    lookups = hits + totals.get("misses", 0)
+
+    return api_response(
+        {
+            "caches": {name: cache.stats() for name, cache in PEOPLE_CACHES.items()},
+            "requests": {
+                "count": requests,
+                "lookups": lookups,
+                # every hit is a people query this process did not run
+                "queries_saved": hits,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "queries_saved_per_request": (
+                    round(hits / requests, 3) if requests else None
+                ),
+            },
+            "pid": os.getpid(),
+        }
+    )
 
 
 # handle page not found errors
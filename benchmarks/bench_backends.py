@@ -0,0 +1,231 @@
+# benchmark: the same read and write mix against different database backends
+#
+# usage:
+#   python benchmarks/bench_backends.py
+#   python benchmarks/bench_backends.py --url postgresql://localhost/course_bench
+#   python benchmarks/bench_backends.py --start-postgres
+#
+# sqlite always runs on a fresh temp file, and every --url database is emptied
+# first. --start-postgres creates and starts a throwaway cluster with
+# initdb/pg_ctl (they must be on PATH, and psycopg2 must be installed). Each
+# backend runs in its own process, because the app binds its engine when it is
+# imported.
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# runs the workload in this process against DATABASE_URL and prints json results
+def worker(students, clients, operations):
+    sys.path.insert(0, ROOT)
+    import app as course_app
+
+    app, db = course_app.app, course_app.db
+
+    # start from empty tables, then seed students and assessments
+    with course_app.course_context(None):
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.execute(
+            db.insert(course_app.Person),
+            [
+                {
+                    "username": f"student{i}",
+                    "first_name": "Bench",
+                    "last_name": str(i),
+                    "password": "x",
+                    "user_type": "student",
+                }
+                for i in range(students)
+            ],
+        )
+        db.session.execute(
+            db.insert(course_app.Assessments),
+            [
+                {
+                    "assessment_name": f"Assignment {i}",
+                    "assessment_type": "assignment",
+                    "weight": 10,
+                    "description": "bench",
+                }
+                for i in range(clients)
+            ],
+        )
+        db.session.commit()
+
+    timings = {"insert_grade": [], "process_regrade": [], "read_grades": []}
+    errors = []
+    lock = threading.Lock()
+
+    def client(number):
+        assessment = f"Assignment {number}"
+        for i in range(operations):
+            student = f"student{i % students}"
+
+            with app.app_context():
+                started = time.perf_counter()
+                response = course_app.insert_grade(
+                    (assessment, "assignment", student, "70")
+                )
+                inserted = time.perf_counter() - started
+
+                course_app.insert_regrade((assessment, student, "bench"))
+                regrade_id = db.session.execute(
+                    db.select(course_app.Regrades.regrade_id).where(
+                        course_app.Regrades.assessment_name == assessment,
+                        course_app.Regrades.student_username == student,
+                        course_app.Regrades.status.is_(False),
+                    )
+                ).scalar()
+
+                started = time.perf_counter()
+                course_app.process_regrade(regrade_id, "80")
+                processed = time.perf_counter() - started
+
+                started = time.perf_counter()
+                db.session.execute(
+                    db.select(course_app.Grades.grade).where(
+                        course_app.Grades.student_username == student
+                    )
+                ).all()
+                read = time.perf_counter() - started
+
+            with lock:
+                timings["insert_grade"].append(inserted)
+                timings["process_regrade"].append(processed)
+                timings["read_grades"].append(read)
+                if not response["success"]:
+                    errors.append(response["message"])
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+
+    result = {"ops_per_second": clients * operations * 3 / total, "errors": len(errors)}
+    for name, values in timings.items():
+        result[name + "_p50_ms"] = statistics.median(values) * 1000
+
+    print(json.dumps(result))
+
+
+# creates and starts a temporary postgresql cluster, returns its url and folder
+def start_postgres():
+    folder = tempfile.mkdtemp(prefix="bench_pg_")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    data = os.path.join(folder, "data")
+    subprocess.run(
+        ["initdb", "-D", data, "-U", "bench", "--auth=trust"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        [
+            "pg_ctl",
+            "-D",
+            data,
+            "-l",
+            os.path.join(folder, "log"),
+            "-o",
+            f"-p {port} -k {folder} -c listen_addresses=127.0.0.1",
+            "-w",
+            "start",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        ["createdb", "-h", "127.0.0.1", "-p", str(port), "-U", "bench", "course"],
+        check=True,
+    )
+
+    return f"postgresql://bench@127.0.0.1:{port}/course", folder
+
+
+def stop_postgres(folder):
+    subprocess.run(
+        ["pg_ctl", "-D", os.path.join(folder, "data"), "-m", "fast", "stop"],
+        stdout=subprocess.DEVNULL,
+    )
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", action="append", default=[])
+    parser.add_argument("--start-postgres", action="store_true")
+    parser.add_argument("--students", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=50)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.students, args.clients, args.operations)
+        return
+
+    sqlite_folder = tempfile.mkdtemp(prefix="bench_sqlite_")
+    urls = ["sqlite:///" + os.path.join(sqlite_folder, "course.db")] + args.url
+
+    postgres_folder = None
+    if args.start_postgres:
+        url, postgres_folder = start_postgres()
+        urls.append(url)
+
+    try:
+        print(f"{'backend':<12}{'ops/s':>10}{'insert':>10}{'regrade':>10}{'read':>10}")
+        for url in urls:
+            completed = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--worker",
+                    f"--students={args.students}",
+                    f"--clients={args.clients}",
+                    f"--operations={args.operations}",
+                ],
+                env=dict(os.environ, DATABASE_URL=url),
+                capture_output=True,
+                text=True,
+            )
+
+            backend = url.split(":", 1)[0]
+            if completed.returncode != 0:
+                print(
+                    f"{backend:<12}failed: {completed.stderr.strip().splitlines()[-1]}"
+                )
+                continue
+
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(
+                f"{backend:<12}{result['ops_per_second']:>10.0f}"
+                f"{result['insert_grade_p50_ms']:>10.2f}"
+                f"{result['process_regrade_p50_ms']:>10.2f}"
+                f"{result['read_grades_p50_ms']:>10.2f}"
+                + (f"  ({result['errors']} errors)" if result["errors"] else "")
+            )
+    finally:
+        shutil.rmtree(sqlite_folder, ignore_errors=True)
+        if postgres_folder:
+            stop_postgres(postgres_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmark: feedback submissions with one commit per row vs group commit
+#
+# usage: python benchmarks/bench_feedback.py [--clients 32] [--per-client 25]
+#
+# every mode runs against a fresh copy of instance/course.db in a temp folder,
+# so the real database is never written to
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# point the app at a throwaway database before importing it
+workdir = tempfile.mkdtemp(prefix="bench_feedback_")
+shutil.copy(os.path.join(ROOT, "instance", "course.db"), workdir)
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "course.db")
+
+sys.path.insert(0, ROOT)
+import app as course_app  # noqa: E402
+
+
+# submits feedback from many threads at once, like a class opening the form together
+def run(clients, per_client, group_commit):
+    app = course_app.app
+    app.config["FEEDBACK_GROUP_COMMIT"] = group_commit
+
+    with course_app.course_context(None):
+        instructor = course_app.Person.query.filter_by(user_type="instructor").first()
+        instructor = instructor.username if instructor else "instructor"
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(clients)
+
+    def client(number):
+        start_line.wait()
+        for i in range(per_client):
+            details = (instructor, f"like {number}-{i}", "improve", "labs", "more")
+            started = time.perf_counter()
+            with app.app_context():
+                response = course_app.submit_feedback(details)
+            elapsed = time.perf_counter() - started
+
+            with lock:
+                latencies.append(elapsed)
+                if not response["success"]:
+                    errors.append(response["message"])
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rows": len(latencies),
+        "seconds": total,
+        "rows_per_second": len(latencies) / total,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--per-client", type=int, default=25)
+    args = parser.parse_args()
+
+    try:
+        results = {
+            "commit per row": run(args.clients, args.per_client, False),
+            "group commit": run(args.clients, args.per_client, True),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.clients} clients x {args.per_client} submissions")
+    print(f"{'mode':<16}{'rows/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<16}{result['rows_per_second']:>10.0f}{result['p50_ms']:>10.1f}"
+            f"{result['p95_ms']:>10.1f}{result['errors']:>8}"
+        )
+
+    speedup = (
+        results["group commit"]["rows_per_second"]
+        / results["commit per row"]["rows_per_second"]
+    )
+    print(f"group commit throughput: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# benchmark: template time per route with the layout rendered per request vs cached
+#
+# usage: python benchmarks/bench_layout.py [--repeat 200]
+#
+# runs against a seeded throwaway database. For each route and role it times only
+# the rendering of the page template (from before_render_template to
+# template_rendered, so view code and queries outside the template don't count),
+# first with LAYOUT_FRAGMENT_CACHE off and then on, and reports the medians.
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+workdir = tempfile.mkdtemp(prefix="bench_layout_")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "course.db")
+
+sys.path.insert(0, ROOT)
+import app as course_app  # noqa: E402
+from flask import before_render_template, template_rendered  # noqa: E402
+
+app, db = course_app.app, course_app.db
+
+# (role, route) pairs, anonymous pages first
+ROUTES = [
+    ("anonymous", "/home"),
+    ("anonymous", "/login"),
+    ("student", "/home"),
+    ("student", "/lectures"),
+    ("student", "/grades"),
+    ("student", "/user"),
+    ("instructor", "/grades"),
+    ("instructor", "/feedback"),
+    ("instructor", "/user"),
+]
+
+
+# adds one student and one instructor, both with the password "bench"
+def seed():
+    with course_app.course_context(None):
+        password = course_app.bcrypt.generate_password_hash("bench").decode("utf-8")
+        db.session.execute(
+            db.insert(course_app.Person),
+            [
+                {
+                    "username": role,
+                    "first_name": "Bench",
+                    "last_name": role.title(),
+                    "password": password,
+                    "user_type": role,
+                }
+                for role in ("student", "instructor")
+            ],
+        )
+        db.session.commit()
+
+
+# times the outermost template of every request, in seconds
+class TemplateTimer:
+    def __init__(self):
+        self.started = []
+        self.timings = []
+        before_render_template.connect(self.start, app)
+        template_rendered.connect(self.stop, app)
+
+    def start(self, sender, template, context, **extra):
+        self.started.append(time.perf_counter())
+
+    def stop(self, sender, template, context, **extra):
+        elapsed = time.perf_counter() - self.started.pop()
+        if not self.started:
+            self.timings.append(elapsed)
+
+
+def client_for(role):
+    client = app.test_client()
+    if role != "anonymous":
+        client.post("/login", data={"Username": role, "Password": "bench"})
+    return client
+
+
+# returns the median template time of a route, in milliseconds
+def measure(timer, client, route, repeat):
+    client.get(route)  # warm up the jinja and fragment caches
+    timer.timings.clear()
+    for _ in range(repeat):
+        client.get(route, headers={"Cache-Control": "no-cache"})
+    return statistics.median(timer.timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    try:
+        seed()
+        timer = TemplateTimer()
+        clients = {
+            role: client_for(role) for role in ("anonymous", "student", "instructor")
+        }
+
+        results = {}
+        for cached in (False, True):
+            app.config["LAYOUT_FRAGMENT_CACHE"] = cached
+            course_app.layout_fragments.clear()
+            for role, route in ROUTES:
+                results[(role, route, cached)] = measure(
+                    timer, clients[role], route, args.repeat
+                )
+
+        print(f"{'role':<12}{'route':<11}{'per request':>13}{'cached':>9}{'saved':>8}")
+        for role, route in ROUTES:
+            before, after = results[(role, route, False)], results[(role, route, True)]
+            print(
+                f"{role:<12}{route:<11}{before:>10.3f} ms{after:>6.3f} ms"
+                f"{(1 - after / before):>8.0%}"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# benchmark: read only listings as orm entities vs light rows
+#
+# usage: python benchmarks/bench_read_rows.py [--rows 2000] [--repeat 50]
+#
+# runs against a seeded throwaway database. For each listing it compares the old
+# orm query (full entities in the identity map) with the row query the pages use
+# now, and reports the time per call and the peak memory of one call.
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+workdir = tempfile.mkdtemp(prefix="bench_rows_")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "course.db")
+
+sys.path.insert(0, ROOT)
+import app as course_app  # noqa: E402
+
+app, db = course_app.app, course_app.db
+Assessments, Grades, Feedback = (
+    course_app.Assessments,
+    course_app.Grades,
+    course_app.Feedback,
+)
+
+
+# fills the database with a term's worth of assessments, grades and feedback
+def seed(rows):
+    students = max(rows // 20, 1)
+
+    db.session.execute(
+        db.insert(course_app.Person),
+        [
+            {
+                "username": f"student{i}",
+                "first_name": "Bench",
+                "last_name": str(i),
+                "password": "x",
+                "user_type": "student",
+            }
+            for i in range(students)
+        ]
+        + [
+            {
+                "username": "instructor",
+                "first_name": "Bench",
+                "last_name": "Instructor",
+                "password": "x",
+                "user_type": "instructor",
+            }
+        ],
+    )
+    db.session.execute(
+        db.insert(Assessments),
+        [
+            {
+                "assessment_name": f"{kind.title()} {i}",
+                "assessment_type": kind,
+                "weight": 5,
+                "description": "A description of the assessment " * 4,
+                "handout_link": "handout.pdf",
+                "solutions_link": "solutions.pdf",
+            }
+            for kind in ("assignment", "lab", "test")
+            for i in range(20)
+        ],
+    )
+    db.session.execute(
+        db.insert(Grades),
+        [
+            {
+                "student_username": f"student{i % students}",
+                "assessment_name": f"Assignment {i // students % 20}",
+                "assessment_type": "assignment",
+                "grade": i % 100,
+            }
+            for i in range(min(rows, students * 20))
+        ],
+    )
+    db.session.execute(
+        db.insert(Feedback),
+        [
+            {
+                "instructor_username": "instructor",
+                "instructor_like": "Clear explanations " * 5,
+                "instructor_improve": "More examples " * 5,
+                "labs_like": "Hands on " * 5,
+                "labs_improve": "Longer labs " * 5,
+            }
+            for _ in range(rows)
+        ],
+    )
+    db.session.commit()
+
+
+# the queries the pages used before, building orm entities
+def orm_assignments():
+    return Assessments.query.filter_by(assessment_type="assignment").all()
+
+
+def orm_grades():
+    return Grades.query.order_by(Grades.assessment_type.asc()).all()
+
+
+def orm_feedback():
+    return (
+        Feedback.query.filter_by(instructor_username="instructor")
+        .order_by(Feedback.id.desc())
+        .all()
+    )
+
+
+# the row queries the pages use now
+def row_grades():
+    return course_app.read_rows(
+        db.select(
+            Grades.assessment_name, Grades.student_username, Grades.grade
+        ).order_by(Grades.assessment_type.asc())
+    )
+
+
+CASES = [
+    ("assignments", orm_assignments, course_app.query_assignments),
+    ("grades", orm_grades, row_grades),
+    ("feedback", orm_feedback, lambda: course_app.query_feedback("instructor")),
+]
+
+
+# times a query, every call in a fresh session like a fresh request
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.remove()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    db.session.remove()
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return statistics.median(timings) * 1000, peak / 1024, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        with course_app.course_context(None):
+            seed(args.rows)
+
+            print(f"{'listing':<13}{'kind':<6}{'rows':>7}{'ms':>9}{'peak KiB':>11}")
+            for name, orm_query, row_query in CASES:
+                for kind, func in (("orm", orm_query), ("rows", row_query)):
+                    ms, peak, count = measure(func, args.repeat)
+                    print(f"{name:<13}{kind:<6}{count:>7}{ms:>9.2f}{peak:>11.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+# load and soak test: many clients against the app under a multi-process server
+#
+# usage:
+#   python benchmarks/loadtest.py [--clients 32] [--duration 30] [--workers 4]
+#   python benchmarks/loadtest.py --duration 1800 --report-every 60   # soak
+#   python benchmarks/loadtest.py --server gunicorn                    # needs gunicorn
+#
+# seeds a throwaway database, starts the app on it in a separate server process
+# (werkzeug's forking server by default, or gunicorn with --workers processes), and
+# lets --clients threads browse like students and instructors at a deadline:
+# logging in, reading /grades, submitting and resolving regrades and entering
+# grades. It then reports throughput, p50/p95/p99 latency per action, and how many
+# responses were server errors or "database is locked" failures.
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "loadtest"
+
+# what each kind of user does, with how often (weights)
+STUDENT_MIX = {
+    "grades": 50,
+    "assignments": 20,
+    "whatif": 10,
+    "submit_regrade": 10,
+    "login": 10,
+}
+INSTRUCTOR_MIX = {
+    "grades": 25,
+    "enter_grade": 40,
+    "regrades": 15,
+    "resolve_regrade": 15,
+    "login": 5,
+}
+
+# how the app words a failed write when sqlite stays locked
+LOCKED_MARKERS = (b"database is locked", b"The database is busy right now")
+
+REGRADE_LINK = re.compile(rb'/regrade/(\d+)"')
+
+
+# fills the database with a class: students, instructors, assessments and grades
+def seed(url, students, instructors, assessments):
+    os.environ["DATABASE_URL"] = url
+    sys.path.insert(0, ROOT)
+    import app as course_app
+
+    app, db = course_app.app, course_app.db
+
+    with course_app.course_context(None):
+        # one hash for everyone, bcrypt is too slow to hash every seeded account
+        password = course_app.bcrypt.generate_password_hash(PASSWORD).decode("utf-8")
+        db.session.execute(
+            db.insert(course_app.Person),
+            [
+                {
+                    "username": f"student{i}",
+                    "first_name": "Load",
+                    "last_name": str(i),
+                    "password": password,
+                    "user_type": "student",
+                }
+                for i in range(students)
+            ]
+            + [
+                {
+                    "username": f"instructor{i}",
+                    "first_name": "Load",
+                    "last_name": f"Instructor {i}",
+                    "password": password,
+                    "user_type": "instructor",
+                }
+                for i in range(instructors)
+            ],
+        )
+        db.session.execute(
+            db.insert(course_app.Assessments),
+            [
+                {
+                    "assessment_name": f"Assignment {i}",
+                    "assessment_type": "assignment",
+                    "weight": 100 / assessments,
+                    "description": "load test",
+                }
+                for i in range(assessments)
+            ],
+        )
+        # the first half is graded already, instructors enter the rest
+        db.session.execute(
+            db.insert(course_app.Grades),
+            [
+                {
+                    "student_username": f"student{i}",
+                    "assessment_name": f"Assignment {a}",
+                    "assessment_type": "assignment",
+                    "grade": random.randint(50, 100),
+                }
+                for i in range(students)
+                for a in range(assessments // 2)
+            ],
+        )
+        db.session.commit()
+
+        # log the seeded grades, like an upgrade of an existing course would
+        course_app.backfill_grade_changes()
+
+
+# runs the app in this process, the parent process waits for it to answer
+def serve(port, workers):
+    sys.path.insert(0, ROOT)
+    import app as course_app
+    from werkzeug.serving import run_simple
+
+    # forked workers must not share the connections opened while importing
+    with course_app.app.app_context():
+        course_app.db.engine.dispose()
+
+    run_simple(
+        "127.0.0.1",
+        port,
+        course_app.app,
+        threaded=False,
+        processes=workers,
+        use_reloader=False,
+    )
+
+
+# starts the server process and waits until it answers
+def start_server(kind, port, workers, env):
+    if kind == "gunicorn":
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            f"--workers={workers}",
+            f"--bind=127.0.0.1:{port}",
+            "--log-level=warning",
+            "app:app",
+        ]
+    else:
+        command = [
+            sys.executable,
+            __file__,
+            "--serve",
+            f"--port={port}",
+            f"--workers={workers}",
+        ]
+
+    server = subprocess.Popen(
+        command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(
+                "server exited: " + server.stderr.read().decode(errors="replace")
+            )
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/login", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.2)
+
+    server.kill()
+    raise SystemExit("server did not start in 30 seconds")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# collects every request's outcome, shared by all clients
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)  # action -> seconds
+        self.outcomes = defaultdict(lambda: defaultdict(int))  # action -> outcome -> n
+        self.interval = defaultdict(int)  # outcome -> n, since the last report
+
+    def add(self, action, outcome, elapsed):
+        with self.lock:
+            self.latencies[action].append(elapsed)
+            self.outcomes[action][outcome] += 1
+            self.interval[outcome] += 1
+
+    def take_interval(self):
+        with self.lock:
+            interval, self.interval = self.interval, defaultdict(int)
+        return interval
+
+
+# one simulated user with its own cookies
+class Client:
+    def __init__(self, base, username, user_type, config, results):
+        self.base = base
+        self.username = username
+        self.user_type = user_type
+        self.config = config
+        self.results = results
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    # sends one request and records how it went
+    def request(self, action, path, form=None):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        started = time.perf_counter()
+        body = b""
+        try:
+            with self.opener.open(self.base + path, data=data, timeout=60) as response:
+                body = response.read()
+            outcome = "ok"
+            if any(marker in body for marker in LOCKED_MARKERS):
+                outcome = "locked"
+        except urllib.error.HTTPError as error:
+            body = error.read()
+            if any(marker in body for marker in LOCKED_MARKERS):
+                outcome = "locked"
+            else:
+                outcome = f"http_{error.code}"
+        except OSError:
+            outcome = "connection"
+
+        self.results.add(action, outcome, time.perf_counter() - started)
+        return body
+
+    def login(self):
+        self.request(
+            "login", "/login", {"Username": self.username, "Password": PASSWORD}
+        )
+
+    def grades(self):
+        self.request("grades", "/grades")
+
+    def assignments(self):
+        self.request("assignments", "/assignments")
+
+    def whatif(self):
+        self.request("whatif", "/api/whatif")
+
+    def regrades(self):
+        self.request("regrades", "/regrades")
+
+    def submit_regrade(self):
+        graded = random.randrange(max(self.config.assessments // 2, 1))
+        self.request(
+            "submit_regrade",
+            "/add_regrade",
+            {
+                "assessment_name": f"Assignment {graded}",
+                "description": "Please have another look at question 2",
+            },
+        )
+
+    def enter_grade(self):
+        self.request(
+            "enter_grade",
+            "/add_grade",
+            {
+                "assessment_name": f"Assignment {random.randrange(self.config.assessments)}",
+                "student_name": f"student{random.randrange(self.config.students)}",
+                "grade": str(random.randint(40, 100)),
+            },
+        )
+
+    # opens the regrade queue and resolves one of the requests on it
+    def resolve_regrade(self):
+        ids = REGRADE_LINK.findall(self.request("regrades", "/regrades"))
+        if ids:
+            regrade_id = random.choice(ids).decode()
+            self.request(
+                "resolve_regrade",
+                f"/regrade/{regrade_id}",
+                {"new_grade": str(random.randint(60, 100))},
+            )
+
+    def run(self, stop_at):
+        mix = STUDENT_MIX if self.user_type == "student" else INSTRUCTOR_MIX
+        actions, weights = list(mix), list(mix.values())
+
+        self.login()
+        while time.monotonic() < stop_at:
+            getattr(self, random.choices(actions, weights)[0])()
+            if self.config.think_time:
+                time.sleep(random.expovariate(1 / self.config.think_time))
+
+
+# the q-th percentile of sorted values, nearest rank
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+# prints the table of results and returns them as a dict
+def report(results, seconds):
+    summary = {"seconds": round(seconds, 1), "actions": {}}
+    total = locked = errors = 0
+
+    print(
+        f"{'action':<17}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'locked':>8}{'errors':>8}"
+    )
+    for action in sorted(results.latencies):
+        values = sorted(results.latencies[action])
+        outcomes = results.outcomes[action]
+        action_locked = outcomes.get("locked", 0)
+        action_errors = sum(
+            count
+            for outcome, count in outcomes.items()
+            if outcome not in ("ok", "locked")
+        )
+        row = {
+            "requests": len(values),
+            "per_second": len(values) / seconds,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "locked": action_locked,
+            "errors": action_errors,
+            "outcomes": dict(outcomes),
+        }
+        summary["actions"][action] = row
+        total += len(values)
+        locked += action_locked
+        errors += action_errors
+
+        print(
+            f"{action:<17}{row['requests']:>9}{row['per_second']:>8.1f}"
+            f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+            f"{action_locked:>8}{action_errors:>8}"
+        )
+
+    summary.update(
+        requests=total,
+        per_second=total / seconds,
+        locked_rate=locked / total if total else 0,
+        error_rate=errors / total if total else 0,
+    )
+    print(
+        f"total {total} requests, {summary['per_second']:.1f} req/s, "
+        f"database is locked: {locked} ({summary['locked_rate']:.2%}), "
+        f"other errors: {errors} ({summary['error_rate']:.2%})"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--instructor-share", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds")
+    parser.add_argument("--report-every", type=float, default=0, help="seconds")
+    parser.add_argument(
+        "--server", choices=("werkzeug", "gunicorn"), default="werkzeug"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--assessments", type=int, default=10)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.workers)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    url = "sqlite:///" + os.path.join(workdir, "course.db")
+    instructors = max(1, round(args.clients * args.instructor_share))
+    server = None
+
+    try:
+        seed(url, args.students, instructors, args.assessments)
+
+        port = free_port()
+        env = dict(os.environ, DATABASE_URL=url)
+        env.pop("PROFILE_REQUESTS", None)
+        server = start_server(args.server, port, args.workers, env)
+        print(
+            f"{args.server} with {args.workers} worker(s), {args.clients} clients "
+            f"({instructors} instructors) for {args.duration:.0f}s"
+        )
+
+        results = Results()
+        clients = [
+            Client(
+                f"http://127.0.0.1:{port}",
+                f"instructor{n}" if n < instructors else f"student{n % args.students}",
+                "instructor" if n < instructors else "student",
+                args,
+                results,
+            )
+            for n in range(args.clients)
+        ]
+
+        started = time.monotonic()
+        stop_at = started + args.duration
+        threads = [
+            threading.Thread(target=client.run, args=(stop_at,), daemon=True)
+            for client in clients
+        ]
+        for thread in threads:
+            thread.start()
+
+        # a soak run prints a line per interval, so slowdowns over time show up
+        last_report = started
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.2)
+            now = time.monotonic()
+            if args.report_every and now - last_report >= args.report_every:
+                interval = results.take_interval()
+                count = sum(interval.values())
+                locked = interval.get("locked", 0)
+                print(
+                    f"[{now - started:>7.0f}s] "
+                    f"{count / (now - last_report):>7.1f} req/s, "
+                    f"locked {locked}, errors {count - interval.get('ok', 0) - locked}"
+                )
+                last_report = now
+
+        summary = report(results, time.monotonic() - started)
+        summary.update(server=args.server, workers=args.workers, clients=args.clients)
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(summary, file, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
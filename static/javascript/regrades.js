@@ -0,0 +1,15 @@
+// reload the regrades page when one of the student's requests changes
+// the server pushes the change over server-sent events, so the page doesn't poll
+window.addEventListener("DOMContentLoaded", function () {
+  const page = document.querySelector("[data-events-url]");
+
+  if (!page || !window.EventSource) {
+    return;
+  }
+
+  const source = new EventSource(page.dataset.eventsUrl);
+  source.addEventListener("regrade", function () {
+    source.close();
+    window.location.reload();
+  });
+});
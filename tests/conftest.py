@@ -0,0 +1,136 @@
+# fixtures for the tests that use the flask test client
+# tests run against a throwaway sqlite file, or against TEST_DATABASE_URL, e.g.
+# TEST_DATABASE_URL=postgresql://localhost/course_test python -m pytest -q
+# every table is emptied before each test, so never point it at a real database.
+# DATABASE_URL is not used on purpose, it may be the production database
+import os
+import shutil
+import sys
+import tempfile
+
+import bcrypt
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="course_tests_")
+
+# app.py reads these when it is imported
+os.environ["DATABASE_URL"] = os.environ.get(
+    "TEST_DATABASE_URL", "sqlite:///" + os.path.join(WORKDIR, "course.db")
+)
+os.environ["COURSES_FOLDER"] = os.path.join(WORKDIR, "courses")
+sys.path.insert(0, ROOT)
+
+import app as course_app  # noqa: E402
+
+# the selenium scripts drive a browser against a running server
+try:
+    import selenium  # noqa: F401
+except ImportError:
+    collect_ignore = ["test_add_regrade.py", "test_login.py", "test_register.py"]
+
+PASSWORD = "password"
+
+# one cheap hash for every account, bcrypt checks any cost
+PASSWORD_HASH = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(4)).decode()
+
+
+@pytest.fixture(scope="session")
+def app():
+    course_app.app.config.update(
+        TESTING=True, CHARTS_FOLDER=os.path.join(WORKDIR, "charts")
+    )
+
+    # creates the tables of the default course
+    with course_app.course_context(None):
+        pass
+
+    yield course_app.app
+
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+# every test starts with empty tables and caches. No app context is kept open,
+# each request of the test client must get its own
+@pytest.fixture(autouse=True)
+def db(app):
+    with app.app_context():
+        for table in reversed(course_app.db.metadata.sorted_tables):
+            if table.name != "DataVersions":
+                course_app.db.session.execute(table.delete())
+        course_app.db.session.commit()
+
+    for cache in (course_app.what_if_cache, *course_app.PEOPLE_CACHES.values()):
+        cache.items.clear()
+        cache.hits = cache.misses = 0
+    course_app.layout_fragments.clear()
+    course_app.calendar_cache.clear()
+
+    return course_app.db
+
+
+# adds people, students by default, all with the password PASSWORD
+@pytest.fixture
+def add_people(app, db):
+    def add(*usernames, user_type="student"):
+        with app.app_context():
+            db.session.execute(
+                db.insert(course_app.Person),
+                [
+                    {
+                        "username": username,
+                        "first_name": username,
+                        "last_name": "Test",
+                        "password": PASSWORD_HASH,
+                        "user_type": user_type,
+                    }
+                    for username in usernames
+                ],
+            )
+            course_app.bump_versions("Person")
+            db.session.commit()
+
+    return add
+
+
+# adds assessments, given as (name, weight)
+@pytest.fixture
+def add_assessments(app, db):
+    def add(*assessments, assessment_type="assignment"):
+        with app.app_context():
+            db.session.execute(
+                db.insert(course_app.Assessments),
+                [
+                    {
+                        "assessment_name": name,
+                        "assessment_type": assessment_type,
+                        "weight": weight,
+                        "description": name,
+                    }
+                    for name, weight in assessments
+                ],
+            )
+            course_app.bump_versions("Assessments")
+            db.session.commit()
+
+    return add
+
+
+# returns a test client logged in as a user, who is added the first time
+@pytest.fixture
+def login(app, add_people):
+    added = set()
+
+    def login(username, user_type="student", remember=False):
+        if username not in added:
+            add_people(username, user_type=user_type)
+            added.add(username)
+        client = app.test_client()
+        data = {"Username": username, "Password": PASSWORD}
+        if remember:
+            data["Remember"] = "on"
+        response = client.post("/login", data=data)
+        assert response.status_code == 302
+        return client
+
+    return login
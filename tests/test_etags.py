@@ -0,0 +1,65 @@
+# version-keyed etags of database-backed pages, see versioned_response()
+import app as course_app
+
+
+def revalidate(client, path, etag):
+    return client.get(path, headers={"If-None-Match": etag})
+
+
+def test_unchanged_pages_get_a_304(login, add_assessments):
+    client = login("alice")
+    add_assessments(("Assignment 1", 10))
+
+    for path in ("/assignments", "/grades", "/api/assessments/assignment"):
+        first = client.get(path)
+        assert first.status_code == 200
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        response = revalidate(client, path, first.headers["ETag"])
+        assert response.status_code == 304
+        assert response.data == b""
+
+
+def test_writes_change_the_etag(app, login, add_people, add_assessments):
+    client = login("instructor", user_type="instructor")
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+    etag = client.get("/grades").headers["ETag"]
+
+    with app.app_context():
+        details = ("Assignment 1", "assignment", "alice", "80")
+        assert course_app.insert_grade(details)["success"]
+
+    response = revalidate(client, "/grades", etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert b"alice" in response.data
+
+
+def test_etags_depend_on_the_user(login, add_assessments):
+    alice, bob = login("alice"), login("bob")
+    add_assessments(("Assignment 1", 10))
+    etag = alice.get("/grades").headers["ETag"]
+
+    response = revalidate(bob, "/grades", etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_etags_depend_on_the_query(app, login, add_people, add_assessments):
+    client = login("instructor", user_type="instructor")
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+    with app.app_context():
+        course_app.insert_grade(("Assignment 1", "assignment", "alice", "80"))
+        course_app.insert_regrade(("Assignment 1", "alice", "question 2"))
+
+    etag = client.get("/api/regrades?status=open").headers["ETag"]
+
+    # the same tables, but another filter, must not be answered from the cache
+    response = revalidate(client, "/api/regrades?status=resolved", etag)
+    assert response.status_code == 200
+    assert response.get_json()["rows"] == []
+
+    response = revalidate(client, "/api/regrades?status=open", etag)
+    assert response.status_code == 304
@@ -0,0 +1,127 @@
+# course file downloads, see download()
+import pytest
+
+import app as course_app
+from app import Assessments
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def files(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "FILES_FOLDER", str(tmp_path))
+    (tmp_path / "handout.pdf").write_bytes(CONTENT)
+    (tmp_path / "week 1 notes.pdf").write_bytes(CONTENT)
+    (tmp_path / "solutions.pdf").write_bytes(CONTENT)
+    return tmp_path
+
+
+def test_download(app, files):
+    response = app.test_client().get("/files/handout.pdf")
+
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+
+def test_unchanged_files_get_a_304(app, files):
+    client = app.test_client()
+    first = client.get("/files/handout.pdf")
+
+    by_etag = client.get(
+        "/files/handout.pdf", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    by_date = client.get(
+        "/files/handout.pdf",
+        headers={"If-Modified-Since": first.headers["Last-Modified"]},
+    )
+
+    for response in (by_etag, by_date):
+        assert response.status_code == 304
+        assert response.data == b""
+
+    # a changed file is sent again
+    (files / "handout.pdf").write_bytes(CONTENT + b"v2")
+    response = client.get(
+        "/files/handout.pdf", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert response.status_code == 200
+    assert response.data == CONTENT + b"v2"
+
+
+def test_ranges_get_a_206(app, files):
+    client = app.test_client()
+
+    response = client.get("/files/handout.pdf", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.data == CONTENT[100:200]
+
+    response = client.get("/files/handout.pdf", headers={"Range": "bytes=-24"})
+    assert response.status_code == 206
+    assert response.data == CONTENT[-24:]
+
+    response = client.get("/files/handout.pdf", headers={"Range": "bytes=5000-"})
+    assert response.status_code == 416
+
+
+def test_if_range_resumes_only_the_same_file(app, files):
+    client = app.test_client()
+    etag = client.get("/files/handout.pdf").headers["ETag"]
+
+    response = client.get(
+        "/files/handout.pdf", headers={"Range": "bytes=1000-", "If-Range": etag}
+    )
+    assert response.status_code == 206
+    assert response.data == CONTENT[1000:]
+
+    # the file changed since, so the whole new file is sent
+    (files / "handout.pdf").write_bytes(CONTENT + b"v2")
+    response = client.get(
+        "/files/handout.pdf", headers={"Range": "bytes=1000-", "If-Range": etag}
+    )
+    assert response.status_code == 200
+    assert response.data == CONTENT + b"v2"
+
+
+def test_solutions_need_a_login(app, files, login, add_assessments):
+    add_assessments(("Assignment 1", 10))
+    with app.app_context():
+        course_app.db.session.execute(
+            course_app.db.update(Assessments).values(solutions_link="week 1 notes.pdf")
+        )
+        course_app.db.session.commit()
+
+    for filename in ("solutions.pdf", "week%201%20notes.pdf"):
+        response = app.test_client().get(f"/files/{filename}")
+        assert response.status_code == 302
+        assert response.headers["Location"].endswith("/login")
+
+        response = login("alice").get(f"/files/{filename}")
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "private, no-cache"
+
+
+def test_missing_files_and_paths_outside_the_folder(app, files):
+    client = app.test_client()
+
+    for path in ("/files/nothing.pdf", "/files/../conftest.py"):
+        response = client.get(path)
+        assert b"Page not found" in response.data
+        assert "ETag" not in response.headers
+
+
+def test_nginx_offload(app, files, monkeypatch):
+    monkeypatch.setitem(app.config, "SENDFILE_BACKEND", "nginx")
+
+    response = app.test_client().get("/files/week%201%20notes.pdf")
+
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == (
+        "/protected/files/week%201%20notes.pdf"
+    )
+    assert response.headers["Content-Type"] == "application/pdf"
@@ -0,0 +1,105 @@
+# the grade change log, see read_grade_changes() and consume_grade_changes()
+import app as course_app
+
+STUDENTS = ("alice", "bob", "carol")
+ASSESSMENTS = (("Assignment 1", 50), ("Assignment 2", 50))
+
+
+def grade_everyone(app):
+    with app.app_context():
+        for assessment, _ in ASSESSMENTS:
+            for mark, student in enumerate(STUDENTS, start=70):
+                details = (assessment, "assignment", student, str(mark))
+                assert course_app.insert_grade(details)["success"]
+
+
+# reads the whole log a page at a time, returns the pages
+def read_pages(client, limit, query=""):
+    pages, after = [], 0
+    while True:
+        page = client.get(f"/api/grade_changes?after={after}&limit={limit}{query}")
+        assert page.status_code == 200
+        page = page.get_json()
+        if not page["rows"]:
+            assert page["next"] == after
+            return pages
+
+        seq = page["fields"].index("seq")
+        assert page["next"] == page["rows"][-1][seq]
+        pages.append(page)
+        after = page["next"]
+
+
+def test_pages_follow_the_cursor(app, login, add_people, add_assessments):
+    instructor = login("instructor", user_type="instructor")
+    add_people(*STUDENTS)
+    add_assessments(*ASSESSMENTS)
+    grade_everyone(app)
+
+    pages = read_pages(instructor, limit=4)
+
+    assert [len(page["rows"]) for page in pages] == [4, 2]
+    seqs = [row[0] for page in pages for row in page["rows"]]
+    assert seqs == sorted(seqs) and len(set(seqs)) == 6
+
+    # a new change shows up after the last cursor, and only it
+    add_people("dave")
+    with app.app_context():
+        details = ("Assignment 1", "assignment", "dave", "50")
+        assert course_app.insert_grade(details)["success"]
+
+    page = instructor.get(f"/api/grade_changes?after={pages[-1]['next']}").get_json()
+    student = page["fields"].index("student_username")
+    assert [row[student] for row in page["rows"]] == ["dave"]
+
+
+def test_filters_and_students(app, login, add_people, add_assessments):
+    instructor = login("instructor", user_type="instructor")
+    alice = login("alice")
+    add_people("bob", "carol")
+    add_assessments(*ASSESSMENTS)
+    grade_everyone(app)
+
+    def students(pages):
+        index = pages[0]["fields"].index("student_username")
+        return {row[index] for page in pages for row in page["rows"]}
+
+    # students only ever read their own changes, whatever they ask for
+    assert students(read_pages(alice, limit=1, query="&student=bob")) == {"alice"}
+    assert students(read_pages(instructor, limit=1, query="&student=bob")) == {"bob"}
+
+    pages = read_pages(instructor, limit=10, query="&assessment=Assignment 2")
+    assert len(pages[0]["rows"]) == 3
+
+
+def test_bad_cursors(login):
+    instructor = login("instructor", user_type="instructor")
+    batch = course_app.app.config["GRADE_CHANGES_BATCH"]
+
+    for query in ("after=-1", "limit=0", f"limit={batch + 1}"):
+        assert instructor.get(f"/api/grade_changes?{query}").status_code == 400
+
+    assert course_app.app.test_client().get("/api/grade_changes").status_code == 401
+
+
+def test_consumers_apply_every_change_once(app, add_people, add_assessments):
+    add_people(*STUDENTS, "dave")
+    add_assessments(*ASSESSMENTS)
+    grade_everyone(app)
+    applied = []
+
+    with app.app_context():
+        consume = course_app.consume_grade_changes
+        assert consume("test", applied.extend, batch_size=4) == 6
+        assert consume("test", applied.extend, batch_size=4) == 0
+
+        details = ("Assignment 2", "assignment", "dave", "50")
+        assert course_app.insert_grade(details)["success"]
+
+        assert consume("test", applied.extend, batch_size=4) == 1
+
+        # another consumer has its own cursor
+        assert consume("other", lambda changes: None) == 7
+
+    assert [change.seq for change in applied] == sorted({c.seq for c in applied})
+    assert [change.student_username for change in applied][-1] == "dave"
@@ -0,0 +1,200 @@
+# grade writes and regrade resolution, see insert_grade() and process_regrade()
+import re
+
+import app as course_app
+from app import GradeChanges, Grades, GradeStats, Regrades
+
+
+def grades(db):
+    return db.session.execute(
+        db.select(Grades.student_username, Grades.assessment_name, Grades.grade)
+    ).all()
+
+
+def changes(db):
+    return db.session.execute(
+        db.select(
+            GradeChanges.source, GradeChanges.old_grade, GradeChanges.new_grade
+        ).order_by(GradeChanges.seq)
+    ).all()
+
+
+# the averages on the instructor grades page
+def page_averages(client):
+    page = client.get("/grades").get_data(as_text=True)
+    return dict(re.findall(r"<h2>(.*?)</h2>\s*<h3>Average = (.*?)</h3>", page))
+
+
+# the averages recomputed from every grade
+def recomputed_averages(db):
+    rows = db.session.execute(
+        db.select(Grades.assessment_name, db.func.avg(Grades.grade)).group_by(
+            Grades.assessment_name
+        )
+    ).all()
+    return {name: str(round(float(average), 2)) for name, average in rows}
+
+
+def add_regrade(db, assessment, student):
+    db.session.add(
+        Regrades(
+            assessment_name=assessment,
+            student_username=student,
+            description="please check question 2",
+            status=False,
+        )
+    )
+    db.session.commit()
+    return db.session.execute(db.select(Regrades.regrade_id)).scalar()
+
+
+def test_add_grade_form(app, db, login, add_people, add_assessments):
+    instructor = login("instructor", user_type="instructor")
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+
+    response = instructor.post(
+        "/add_grade",
+        data={
+            "assessment_name": "Assignment 1",
+            "student_name": "alice",
+            "grade": "75",
+        },
+    )
+
+    assert b"Grade added!" in response.data
+    with app.app_context():
+        assert grades(db) == [("alice", "Assignment 1", 75)]
+
+
+def test_insert_grade_keeps_the_first_grade(app, db, add_people, add_assessments):
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+
+    with app.app_context():
+        details = ("Assignment 1", "assignment", "alice", "75")
+        assert course_app.insert_grade(details)["success"]
+
+        # the second insert hits the unique key and does nothing
+        response = course_app.insert_grade(
+            ("Assignment 1", "assignment", "alice", "90")
+        )
+
+        assert not response["success"]
+        assert "already has a grade" in response["message"]
+        assert grades(db) == [("alice", "Assignment 1", 75)]
+        assert changes(db) == [("insert", None, 75)]
+
+
+def test_insert_grade_rejects_unknown_rows(app, db, add_people, add_assessments):
+    add_people("alice")
+    add_people("bob", user_type="instructor")
+    add_assessments(("Assignment 1", 10))
+
+    with app.app_context():
+        cases = [
+            (("Assignment 1", "assignment", "carol", "75"), "does not exist"),
+            (
+                ("Assignment 1", "assignment", "bob", "75"),
+                "only add grades for students",
+            ),
+            (
+                ("Assignment 9", "assignment", "alice", "75"),
+                "assessment does not exist",
+            ),
+            (("Assignment 1", "assignment", "alice", "7.5"), "whole number"),
+        ]
+        for details, message in cases:
+            response = course_app.insert_grade(details)
+            assert not response["success"]
+            assert message in response["message"]
+
+        assert grades(db) == []
+        assert changes(db) == []
+
+
+def test_resolve_regrade_form(app, db, login, add_people, add_assessments):
+    instructor = login("instructor", user_type="instructor")
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+
+    with app.app_context():
+        course_app.insert_grade(("Assignment 1", "assignment", "alice", "60"))
+        regrade_id = add_regrade(db, "Assignment 1", "alice")
+
+    response = instructor.post(f"/regrade/{regrade_id}", data={"new_grade": "70"})
+
+    assert response.status_code == 302
+    with app.app_context():
+        assert grades(db) == [("alice", "Assignment 1", 70)]
+        assert changes(db) == [("insert", None, 60), ("regrade", 60, 70)]
+
+
+def test_process_regrade_only_resolves_once(app, db, add_people, add_assessments):
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+
+    with app.app_context():
+        course_app.insert_grade(("Assignment 1", "assignment", "alice", "60"))
+        regrade_id = add_regrade(db, "Assignment 1", "alice")
+
+        assert course_app.process_regrade(regrade_id, "70")["success"]
+
+        # a second instructor submitting the same request changes nothing
+        response = course_app.process_regrade(regrade_id, "95")
+
+        assert not response["success"]
+        assert "already resolved" in response["message"]
+        assert grades(db) == [("alice", "Assignment 1", 70)]
+        assert changes(db) == [("insert", None, 60), ("regrade", 60, 70)]
+
+
+def test_process_regrade_without_a_grade(app, db, add_people, add_assessments):
+    add_people("alice")
+    add_assessments(("Assignment 1", 10))
+
+    with app.app_context():
+        regrade_id = add_regrade(db, "Assignment 1", "alice")
+
+        response = course_app.process_regrade(regrade_id, "70")
+
+        assert not response["success"]
+        assert "no grade" in response["message"]
+
+        # the request stays open and no grade or change is written
+        assert db.session.get(Regrades, regrade_id).status is False
+        assert grades(db) == []
+        assert changes(db) == []
+
+
+def test_grade_page_averages_match_a_recompute(
+    app, db, login, add_people, add_assessments
+):
+    instructor = login("instructor", user_type="instructor")
+    add_people("alice", "bob", "carol")
+    add_assessments(("Assignment 1", 10), ("Exam", 50))
+
+    with app.app_context():
+        for details in [
+            ("Assignment 1", "alice", "60"),
+            ("Assignment 1", "bob", "75"),
+            ("Assignment 1", "carol", "82"),
+            ("Exam", "alice", "91"),
+        ]:
+            course_app.insert_grade((details[0], "assignment", *details[1:]))
+
+        assert page_averages(instructor) == recomputed_averages(db)
+
+        # later writes are caught up from the change log on the next view
+        course_app.insert_grade(("Exam", "assignment", "bob", "40"))
+        course_app.process_regrade(add_regrade(db, "Assignment 1", "alice"), "70")
+
+        averages = page_averages(instructor)
+        assert averages == recomputed_averages(db)
+        assert averages == {"Assignment 1": "75.67", "Exam": "65.5"}
+
+        # read from the running totals, not from a scan of Grades
+        stats = db.session.execute(
+            db.select(GradeStats.assessment_name, GradeStats.total, GradeStats.count)
+        ).all()
+        assert sorted(stats) == [("Assignment 1", 227, 3), ("Exam", 131, 2)]
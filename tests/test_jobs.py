@@ -0,0 +1,88 @@
+# the background job runner, see submit_job() and wait_for_jobs()
+import pytest
+
+import app as course_app
+from app import Jobs
+
+calls = []
+
+
+# fails until it has been called `failures` times
+@course_app.job_handler("test_flaky")
+def flaky_job(failures=0):
+    calls.append(failures)
+    if len(calls) <= failures:
+        raise RuntimeError("not yet")
+    return {"calls": len(calls)}
+
+
+@pytest.fixture(autouse=True)
+def quick_retries(app, monkeypatch):
+    monkeypatch.setitem(app.config, "JOB_RETRY_DELAY", 0.05)
+    calls.clear()
+
+
+def job(app, job_id):
+    with app.app_context():
+        return course_app.db.session.get(Jobs, job_id)
+
+
+def test_wait_for_jobs_includes_retries(app):
+    with app.app_context():
+        job_id = course_app.submit_job("test_flaky", {"failures": 2})
+
+    course_app.wait_for_jobs()
+
+    finished = job(app, job_id)
+    assert (finished.status, finished.attempts) == ("done", 3)
+    assert finished.result == '{"calls": 3}'
+    assert course_app.job_retries == set()
+
+
+def test_jobs_fail_after_their_last_attempt(app):
+    with app.app_context():
+        job_id = course_app.submit_job("test_flaky", {"failures": 5}, max_attempts=2)
+
+    course_app.wait_for_jobs()
+
+    failed = job(app, job_id)
+    assert (failed.status, failed.attempts) == ("failed", 2)
+    assert failed.error == "RuntimeError: not yet"
+
+
+def test_jobs_run_after_waiting(app):
+    course_app.wait_for_jobs()
+
+    with app.app_context():
+        job_id = course_app.submit_job("test_flaky")
+    course_app.wait_for_jobs()
+
+    assert job(app, job_id).status == "done"
+
+
+def test_web_job_kinds(login):
+    instructor = login("instructor", user_type="instructor")
+
+    assert instructor.post("/jobs", data={"kind": "grade_stats"}).status_code == 202
+    assert instructor.post("/jobs", data={"kind": "test_flaky"}).status_code == 403
+    assert instructor.post("/jobs", data={"kind": "nope"}).status_code == 400
+    assert login("alice").post("/jobs", data={"kind": "grade_stats"}).status_code == 403
+
+    course_app.wait_for_jobs()
+
+
+def test_submit_job_command(app):
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(
+        args=["submit-job", "test_flaky", "--payload", '{"failures": 1}']
+    )
+    assert result.exit_code == 0
+    assert "(test_flaky) done after 2 attempt(s)" in result.output
+
+    result = runner.invoke(args=["submit-job", "test_flaky", "--payload", "[1]"])
+    assert result.exit_code != 0
+    assert "must be a json object" in result.output
+
+    result = runner.invoke(args=["submit-job", "nope"])
+    assert "Unknown job kind" in result.output
@@ -0,0 +1,88 @@
+# the svg build step, see tools/optimize_svgs.py
+import xml.etree.ElementTree as ET
+
+from tools.optimize_svgs import (
+    DEFAULT_STYLES,
+    clean,
+    clean_style,
+    minify_path,
+    round_numbers,
+)
+
+SVG = '<svg xmlns="http://www.w3.org/2000/svg">{}</svg>'
+
+
+def cleaned(body):
+    root = ET.fromstring(SVG.format(body))
+    clean(root, 2, set(), is_root=True)
+    return [dict(element.attrib) for element in root.iter()][1:]
+
+
+def test_round_numbers():
+    assert round_numbers("0 0 24.1234 24.0", 2) == "0 0 24.12 24"
+    assert round_numbers("10,20.555", 1) == "10 20.6"
+    assert round_numbers("1e2", 2) == "100"
+
+
+def test_round_numbers_keeps_units():
+    assert round_numbers("100%", 2) == "100%"
+    assert round_numbers("33.3333%", 2) == "33.33%"
+    assert round_numbers("1.5em", 2) == "1.5em"
+    assert round_numbers("10.256mm", 2) == "10.26mm"
+
+
+def test_round_numbers_in_transforms():
+    assert (
+        round_numbers("translate(1.2345 2) scale(2)", 2) == "translate(1.23,2)scale(2)"
+    )
+    assert round_numbers("matrix(1 0 0 1 -0.5 .25)", 2) == "matrix(1,0,0,1,-.5,.25)"
+
+
+def test_clean_style_drops_defaults():
+    element = ET.Element("path", style="fill:red; stroke:none;opacity:1;stroke-width:2")
+
+    inherited = clean_style(element, DEFAULT_STYLES)
+
+    assert element.attrib == {"fill": "red", "stroke-width": "2"}
+    assert inherited["stroke-width"] == "2"
+    assert inherited["stroke"] == "none"
+
+
+def test_clean_style_keeps_defaults_that_override_a_parent():
+    [group, inner, path, sibling] = cleaned(
+        '<g style="stroke:red;stroke-width:3">'
+        '<g><path style="stroke:none;opacity:1" d="M0 0L1 1"/></g>'
+        '<path style="stroke:red;stroke-width:1" d="M0 0L1 1"/>'
+        "</g>"
+    )
+
+    assert group == {"stroke": "red", "stroke-width": "3"}
+    assert inner == {}
+    # stroke:none undoes the group's stroke, opacity is not inherited
+    assert path == {"stroke": "none", "d": "m0 0 1 1"}
+    assert sibling == {"stroke": "red", "stroke-width": "1", "d": "m0 0 1 1"}
+
+
+def test_clean_style_drops_defaults_at_the_top():
+    [path] = cleaned('<path style="stroke:none;fill-rule:nonzero" d="M0 0L1 1"/>')
+
+    assert path == {"d": "m0 0 1 1"}
+
+
+def test_minify_path():
+    # rounded as absolute positions, then written in the shorter form
+    assert minify_path("M 10.004 10 H 20 V 20 Z", 2) == "m10 10h10v10z"
+    assert minify_path("m1.004 1l1.004 1l1.004 1", 2) == "m1 1 1.01 1 1 1"
+    assert minify_path("M0 0l0.333 0.333l0.333 0.333", 2) == "m0 0 .33.33.34.34"
+
+
+def test_minify_path_drops_zero_length_lines():
+    assert minify_path("M10 10l0 0l5 5h0v0z", 2) == "m10 10 5 5z"
+    assert minify_path("M10 10h5h0.001v0L15 10", 2) == "m10 10h5"
+    assert minify_path("M0 0 0 0 5 5", 2) == "m0 0 5 5"
+
+
+def test_minify_path_keeps_dots():
+    # a subpath that is a single zero length line draws a dot with round caps
+    assert minify_path("M1 1l0 0", 2) == "m1 1 0 0"
+    assert minify_path("M1 1h0M5 5l1 1", 2) == "m1 1h0m4 4 1 1"
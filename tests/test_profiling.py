@@ -0,0 +1,32 @@
+# the slow request profiler, see profiled_phase() and `flask profile-summary`
+import json
+
+import app as course_app
+
+
+def test_profiled_phase_keeps_the_function_name():
+    @course_app.profiled_phase("db")
+    def load_rows():
+        """Loads the rows."""
+
+    assert load_rows.__name__ == "load_rows"
+    assert load_rows.__doc__ == "Loads the rows."
+    assert course_app.bcrypt.check_password_hash.__name__ == "check_password_hash"
+
+
+def test_profile_summary_with_instant_requests(app, tmp_path, monkeypatch):
+    log = tmp_path / "slow_requests.jsonl"
+    monkeypatch.setitem(app.config, "PROFILE_LOG", str(log))
+    entry = {
+        "endpoint": "home",
+        "path": "/home",
+        "ms": 0,
+        "phases_ms": {"db": 0, "template": 0, "hashing": 0, "other": 0},
+        "stacks": {},
+    }
+    log.write_text(json.dumps(entry) + "\n")
+
+    result = app.test_cli_runner().invoke(args=["profile-summary"])
+
+    assert result.exit_code == 0, result.output
+    assert "home: 1 slow request(s), median 0 ms" in result.output
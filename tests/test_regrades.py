@@ -0,0 +1,54 @@
+# the instructor regrade queue and its pages, see make_regrades_dict()
+import app as course_app
+
+
+def add_requests(app, db, assessment, *students):
+    with app.app_context():
+        for student in students:
+            db.session.add(
+                course_app.Regrades(
+                    assessment_name=assessment,
+                    student_username=student,
+                    description="please check question 2",
+                    status=False,
+                )
+            )
+        db.session.commit()
+
+
+def test_regrade_pages(app, db, login, add_people, add_assessments, monkeypatch):
+    monkeypatch.setitem(app.config, "REGRADE_PAGE_SIZE", 2)
+    instructor = login("instructor", user_type="instructor")
+    add_people("alice", "bob", "carol")
+    add_assessments(("Assignment 1", 10), ("Assignment 2", 10))
+    add_requests(app, db, "Assignment 1", "alice", "bob", "carol")
+    add_requests(app, db, "Assignment 2", "alice")
+
+    first = instructor.get("/regrades").get_data(as_text=True)
+    assert "Next page" in first and "Previous page" not in first
+
+    second = instructor.get("/regrades?page=2").get_data(as_text=True)
+    assert "carol" in second
+    assert "Next page" not in second and "Previous page" in second
+
+
+def test_pages_past_the_end_go_to_the_last_page(
+    app, db, login, add_people, add_assessments, monkeypatch
+):
+    monkeypatch.setitem(app.config, "REGRADE_PAGE_SIZE", 2)
+    instructor = login("instructor", user_type="instructor")
+    add_people("alice", "bob", "carol")
+    add_assessments(("Assignment 1", 10))
+    add_requests(app, db, "Assignment 1", "alice", "bob", "carol")
+
+    response = instructor.get("/regrades?page=9")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/regrades?page=2"
+
+    # with nothing open there is only the first page
+    with app.app_context():
+        db.session.execute(db.update(course_app.Regrades).values(status=True))
+        db.session.commit()
+
+    response = instructor.get("/regrades?page=3")
+    assert response.headers["Location"] == "/regrades?page=1"
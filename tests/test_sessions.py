@@ -0,0 +1,124 @@
+# sliding sessions and remember-me tokens, see restore_session()
+import time
+from datetime import datetime
+
+import app as course_app
+from app import RememberTokens
+
+COOKIE = course_app.app.config["REMEMBER_ME_COOKIE"]
+
+
+def logged_in(client) -> bool:
+    return client.get("/api/grade_changes").status_code == 200
+
+
+def tokens(app, db):
+    with app.app_context():
+        return db.session.execute(
+            db.select(RememberTokens.username, RememberTokens.validator_hash)
+        ).all()
+
+
+# a new browser that only has the remember-me cookie of another one
+def returning_client(app, cookie):
+    client = app.test_client()
+    client.set_cookie(COOKIE, cookie)
+    return client
+
+
+def test_remember_me_issues_a_token(app, db, login):
+    client = login("alice", remember=True)
+    cookie = client.get_cookie(COOKIE)
+
+    selector, validator = cookie.value.split(":")
+    assert cookie.http_only
+
+    # only a keyed hash of the validator is stored
+    [(username, validator_hash)] = tokens(app, db)
+    assert username == "alice"
+    assert validator not in validator_hash
+    assert selector not in validator_hash
+
+
+def test_without_remember_me_there_is_no_token(app, db, login):
+    client = login("alice")
+
+    assert client.get_cookie(COOKIE) is None
+    assert tokens(app, db) == []
+
+
+def test_token_restores_the_session(app, login):
+    cookie = login("alice", remember=True).get_cookie(COOKIE).value
+    client = returning_client(app, cookie)
+
+    assert logged_in(client)
+    with client.session_transaction() as session:
+        assert session["name"] == "alice"
+        assert session["user_type"] == "student"
+
+
+def test_token_restores_an_expired_session(app, login):
+    client = login("alice", remember=True)
+    max_age = app.config["SESSION_MAX_AGE"].total_seconds()
+
+    with client.session_transaction() as session:
+        session["login_at"] = time.time() - max_age - 60
+
+    assert logged_in(client)
+    with client.session_transaction() as session:
+        assert time.time() - session["login_at"] < 60
+
+
+def test_expired_sessions_end_without_a_token(app, login):
+    client = login("alice")
+    max_age = app.config["SESSION_MAX_AGE"].total_seconds()
+
+    with client.session_transaction() as session:
+        session["login_at"] = time.time() - max_age - 60
+
+    assert not logged_in(client)
+
+
+def test_bad_tokens_are_forgotten(app, db, login):
+    cookie = login("alice", remember=True).get_cookie(COOKIE).value
+    selector = cookie.split(":")[0]
+
+    for bad in (f"{selector}:wrong", "unknown:token", "garbage"):
+        client = returning_client(app, bad)
+        assert not logged_in(client)
+        assert client.get_cookie(COOKIE) is None
+
+    # expired tokens don't log anyone in either
+    with app.app_context():
+        db.session.execute(
+            db.update(RememberTokens).values(expires_at=datetime(2000, 1, 1))
+        )
+        db.session.commit()
+
+    assert not logged_in(returning_client(app, cookie))
+
+
+def test_logout_revokes_the_token(app, db, login):
+    client = login("alice", remember=True)
+    cookie = client.get_cookie(COOKIE).value
+
+    client.get("/logout")
+
+    assert client.get_cookie(COOKIE) is None
+    assert tokens(app, db) == []
+    assert not logged_in(returning_client(app, cookie))
+
+
+def test_forget_devices_revokes_every_token(app, db, login):
+    laptop = login("alice", remember=True)
+    phone = login("alice", remember=True)
+    other = login("bob", remember=True)
+    cookies = [client.get_cookie(COOKIE).value for client in (laptop, phone)]
+    assert len(tokens(app, db)) == 3
+
+    laptop.get("/forget_devices")
+
+    assert [username for username, _ in tokens(app, db)] == ["bob"]
+    for cookie in cookies:
+        assert not logged_in(returning_client(app, cookie))
+    assert logged_in(returning_client(app, other.get_cookie(COOKIE).value))
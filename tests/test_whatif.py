@@ -0,0 +1,126 @@
+# the what-if calculator and its cache, see student_what_if()
+import app as course_app
+from app import Assessments
+
+
+def rows(result, table):
+    return [list(row) for row in result[table]["rows"]]
+
+
+def targets(client):
+    result = client.get("/api/whatif").get_json()
+    return {row[0]: row[2:] for row in rows(result, "targets")}
+
+
+def grade(app, student, assessment, mark):
+    with app.app_context():
+        details = (assessment, "assignment", student, str(mark))
+        assert course_app.insert_grade(details)["success"]
+
+
+def test_what_if(app, login, add_assessments):
+    student = login("alice")
+    add_assessments(("Assignment 1", 20), ("Assignment 2", 30), ("Exam", 50))
+    grade(app, "alice", "Assignment 1", 80)
+    grade(app, "alice", "Assignment 2", 90)
+
+    result = student.get("/api/whatif?average=75").get_json()
+
+    # (80 * 20 + 90 * 30) / 50 so far, with the exam's 50 still to come
+    assert result["current_mark"] == 86
+    assert result["graded_weight"] == 50
+    assert result["remaining_weight"] == 50
+    assert rows(result, "remaining") == [["Exam", 50]]
+
+    required = {row[0]: row[2:] for row in rows(result, "targets")}
+    assert required["A+"] == [94, "possible"]
+    assert required["B+"] == [68, "possible"]
+    assert required["D-"] == [14, "possible"]
+    assert "F" not in required
+
+    outcomes = {row[0]: row[1:] for row in rows(result, "what_if")}
+    assert outcomes[75] == [80.5, "A-"]
+    assert outcomes[100] == [93, "A+"]
+
+
+def test_what_if_secured_and_out_of_reach(app, login, add_assessments):
+    alice, bob = login("alice"), login("bob")
+    add_assessments(("Assignment 1", 80), ("Exam", 20))
+    grade(app, "alice", "Assignment 1", 95)
+    grade(app, "bob", "Assignment 1", 40)
+
+    assert targets(alice)["B-"] == [0, "secured"]
+    assert targets(alice)["A+"] == [70, "possible"]
+    assert targets(bob)["A+"] == [None, "out of reach"]
+    assert targets(bob)["D-"] == [90, "possible"]
+
+
+def test_what_if_without_weights(app, login, add_assessments):
+    student = login("alice")
+    add_assessments(("Assignment 1", 50), ("Quiz", None), ("Survey", None))
+    grade(app, "alice", "Assignment 1", 80)
+    grade(app, "alice", "Quiz", 20)
+
+    result = student.get("/api/whatif?average=75").get_json()
+
+    # weightless assessments count for nothing, graded or not
+    assert result["current_mark"] == 80
+    assert result["graded_weight"] == 50
+    assert result["remaining_weight"] == 0
+    assert rows(result, "remaining") == [["Survey", 0]]
+    assert targets(student)["A-"] == [0, "secured"]
+    assert b"Current Overall Grade = 80.0" in student.get("/grades").data
+
+
+def test_what_if_only_averages_in_range(login):
+    student = login("alice")
+
+    assert student.get("/api/whatif?average=101").status_code == 400
+    assert student.get("/api/whatif?average=abc").status_code == 400
+
+
+def test_what_if_cache(app, db, login, add_people, add_assessments):
+    student = login("alice")
+    add_people("bob")
+    add_assessments(("Assignment 1", 50), ("Assignment 2", 50))
+    grade(app, "alice", "Assignment 1", 60)
+    cache = course_app.what_if_cache
+
+    assert targets(student)["B"] == [86, "possible"]
+    assert targets(student)["B"] == [86, "possible"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # another student's grade does not touch alice's entry
+    grade(app, "bob", "Assignment 1", 90)
+    targets(student)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # her own grade changes do
+    with app.app_context():
+        db.session.add(
+            course_app.Regrades(
+                assessment_name="Assignment 1",
+                student_username="alice",
+                description="question 3",
+                status=False,
+            )
+        )
+        db.session.commit()
+        regrade_id = db.session.execute(db.select(course_app.Regrades.regrade_id))
+        assert course_app.process_regrade(regrade_id.scalar(), "80")["success"]
+
+    assert targets(student)["B"] == [66, "possible"]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # and so do changes to the assessments
+    with app.app_context():
+        db.session.execute(
+            db.update(Assessments)
+            .where(Assessments.assessment_name == "Assignment 2")
+            .values(weight=150)
+        )
+        course_app.bump_versions("Assessments")
+        db.session.commit()
+
+    assert targets(student)["B"] == [70.67, "possible"]
+    assert (cache.hits, cache.misses) == (2, 3)
@@ -0,0 +1,437 @@
+# build step: optimize the svgs in static/images and build the icon sprite
+#
+# usage: python tools/optimize_svgs.py [--precision 2] [--sprite-max-bytes 2048]
+#                                      [--image-precision 1]
+#
+# every static/images/<name>.svg is optimized: editor metadata stripped, numbers
+# rounded, path data collapsed and whitespace removed. Optimized files up to
+# --sprite-max-bytes become <symbol>s in templates/icons.html, so pages can
+# inline them with <use href="#icon-<name>"> instead of requesting each one.
+# Larger files are written to static/images/<name>.min.svg, rounded to
+# --image-precision decimals since they are only shown as images.
+# Run it again after changing an image.
+
+import argparse
+import os
+import re
+import xml.etree.ElementTree as ET
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES = os.path.join(ROOT, "static", "images")
+SPRITE = os.path.join(ROOT, "templates", "icons.html")
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+# only these namespaces are kept, everything else is editor data
+KEEP_NAMESPACES = (SVG_NS, XLINK_NS)
+
+# elements that never affect rendering
+DROP_TAGS = {"metadata", "title", "desc"}
+
+# attributes that don't change rendering, on the root or anywhere
+DROP_ROOT_ATTRIBUTES = {"version", "x", "y", "enable-background", "id"}
+DROP_ATTRIBUTES = {"enable-background", f"{{{XML_NS}}}space"}
+
+# style declarations that are already the default
+DEFAULT_STYLES = {
+    "fill-opacity": "1",
+    "stroke-opacity": "1",
+    "opacity": "1",
+    "stroke": "none",
+    "fill-rule": "nonzero",
+    "stroke-width": "1",
+}
+
+# the defaults above that children inherit, opacity applies to one element only
+INHERITED_STYLES = {name for name in DEFAULT_STYLES if name != "opacity"}
+
+# attributes holding lists of numbers
+NUMBER_ATTRIBUTES = {
+    "points",
+    "viewBox",
+    "transform",
+    "x",
+    "y",
+    "x1",
+    "y1",
+    "x2",
+    "y2",
+    "cx",
+    "cy",
+    "r",
+    "rx",
+    "ry",
+    "width",
+    "height",
+}
+
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+# a number and its unit, like 100% or 1.5em
+LENGTH = re.compile(f"({NUMBER.pattern})([a-zA-Z%]*)")
+PATH_TOKEN = re.compile(r"[MmZzLlHhVvCcSsQqTtAa]|" + NUMBER.pattern)
+
+
+# formats a number with at most `precision` decimals and no needless characters
+def format_number(value: float, precision: int) -> str:
+    text = f"{round(value, precision):.{precision}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        text = "0"
+    if text.startswith("0."):
+        text = text[1:]
+    elif text.startswith("-0."):
+        text = "-" + text[2:]
+    return text
+
+
+# joins numbers with the fewest separators the svg grammar allows
+def join_numbers(numbers) -> str:
+    out = ""
+    for number in numbers:
+        if (
+            out
+            and out[-1] not in "MmZzLlHhVvCcSsQqTtAa"
+            and not (
+                number.startswith("-")
+                or (number.startswith(".") and re.search(r"[.eE]\d*$", out))
+            )
+        ):
+            out += " "
+        out += number
+    return out
+
+
+# how many numbers each path command takes
+PATH_ARGUMENTS = {
+    "m": 2,
+    "l": 2,
+    "h": 1,
+    "v": 1,
+    "c": 6,
+    "s": 4,
+    "q": 4,
+    "t": 2,
+    "a": 7,
+    "z": 0,
+}
+
+
+# splits path data into (command, numbers) segments, one per drawn segment
+def parse_path(d: str):
+    segments = []
+    command = None
+    numbers = []
+
+    def flush():
+        count = PATH_ARGUMENTS[command.lower()]
+        if count == 0:
+            segments.append((command, []))
+            return
+        for start in range(0, len(numbers), count):
+            # extra pairs after a moveto are implicit linetos
+            repeat = command
+            if start and command in "Mm":
+                repeat = "L" if command == "M" else "l"
+            segments.append((repeat, numbers[start : start + count]))
+
+    for token in PATH_TOKEN.findall(d):
+        if token.isalpha():
+            if command:
+                flush()
+            command, numbers = token, []
+        else:
+            numbers.append(float(token))
+
+    if command:
+        flush()
+
+    return segments
+
+
+# converts parsed segments to absolute coordinates, without any rounding
+def absolute_path(segments):
+    x = y = start_x = start_y = 0.0
+    absolute = []
+
+    for command, numbers in segments:
+        lower = command.lower()
+        dx, dy = (x, y) if command.islower() else (0.0, 0.0)
+        values = list(numbers)
+
+        if lower == "z":
+            x, y = start_x, start_y
+        elif lower == "h":
+            values[0] += dx
+            x = values[0]
+        elif lower == "v":
+            values[0] += dy
+            y = values[0]
+        elif lower == "a":
+            values[5] += dx
+            values[6] += dy
+            x, y = values[5], values[6]
+        else:
+            for i in range(0, len(values), 2):
+                values[i] += dx
+                values[i + 1] += dy
+            x, y = values[-2], values[-1]
+
+        if lower == "m":
+            start_x, start_y = x, y
+        absolute.append((lower, values))
+
+    return absolute
+
+
+# rounds numbers and collapses the path data of a d attribute
+# coordinates are rounded as absolute positions, so rounding errors don't add up
+# along relative paths, then each segment is written in whichever of its absolute
+# or relative forms is shorter, and repeated command letters are left out.
+# Lines that are zero length after rounding are dropped
+def minify_path(d: str, precision: int) -> str:
+    x = y = start_x = start_y = 0.0
+    out = ""
+    previous = None
+
+    segments = absolute_path(parse_path(d))
+    for index, (lower, values) in enumerate(segments):
+        if lower == "z":
+            x, y = start_x, start_y
+            if previous != "z":
+                out += "z"
+            previous = "z"
+            continue
+
+        absolute = [round(value, precision) for value in values]
+        if lower == "a":
+            absolute[3:5] = [int(flag) for flag in values[3:5]]
+
+        # the same segment relative to the current (already rounded) point
+        offsets = list(absolute)
+        if lower == "h":
+            offsets[0] = round(offsets[0] - x, precision)
+        elif lower == "v":
+            offsets[0] = round(offsets[0] - y, precision)
+        elif lower == "a":
+            offsets[5] = round(offsets[5] - x, precision)
+            offsets[6] = round(offsets[6] - y, precision)
+        else:
+            for i in range(0, len(offsets), 2):
+                offsets[i] = round(offsets[i] - x, precision)
+                offsets[i + 1] = round(offsets[i + 1] - y, precision)
+
+        # lines that don't move draw nothing, unless one is all a subpath draws
+        # (a dot, with round line caps)
+        following = segments[index + 1][0] if index + 1 < len(segments) else "m"
+        alone = previous in (None, "M", "m", "z") and following in "mz"
+        if lower in "lhv" and not any(offsets) and not alone:
+            continue
+
+        options = []
+        for letter, numbers in ((lower.upper(), absolute), (lower, offsets)):
+            text = join_numbers(format_number(n, precision) for n in numbers)
+            # a letter can be left out when it would repeat the previous one
+            implicit = {"M": "L", "m": "l"}.get(previous, previous)
+            if letter != implicit or out[-1:] in ("Z", "z", ""):
+                text = letter + text
+            else:
+                # a leading number may need a separator from the previous one
+                text = join_numbers([out, text])[len(out) :]
+            options.append((letter, text))
+
+        # ties go to the relative form, which keeps the letters the same
+        letter, text = min(options, key=lambda option: len(option[1]))
+        if len(options[1][1]) == len(text):
+            letter, text = options[1]
+
+        out += text
+        previous = letter
+
+        # move the current point to the end of the segment
+        if lower == "h":
+            x = absolute[0]
+        elif lower == "v":
+            y = absolute[0]
+        else:
+            x, y = absolute[-2], absolute[-1]
+        if lower == "m":
+            start_x, start_y = x, y
+
+    return out
+
+
+# rounds every number in an attribute, keeping the units and function names
+def round_numbers(value: str, precision: int) -> str:
+    # transforms keep their function names, with the arguments comma separated
+    if "(" in value:
+        value = re.sub(
+            r"\(([^)]*)\)",
+            lambda match: "("
+            + ",".join(
+                format_number(float(n), precision)
+                for n in NUMBER.findall(match.group(1))
+            )
+            + ")",
+            value,
+        )
+        return re.sub(r"\s*([()])\s*", r"\1", value).strip()
+
+    # other lists hold numbers or lengths, which keep their unit
+    return " ".join(
+        format_number(float(number), precision) + unit
+        for number, unit in LENGTH.findall(value)
+    )
+
+
+# moves style declarations to attributes and drops the defaults
+# a default is only dropped when the element would inherit it anyway, a
+# stroke:none under a group with a stroke must stay. Returns the inherited
+# styles for the children
+def clean_style(element, inherited):
+    style = element.attrib.pop("style", None) or ""
+
+    for declaration in style.split(";"):
+        if ":" not in declaration:
+            continue
+        name, value = (part.strip() for part in declaration.split(":", 1))
+        if DEFAULT_STYLES.get(name) == value and inherited.get(name, value) == value:
+            continue
+        element.set(name, value)
+
+    return {name: element.get(name, inherited[name]) for name in INHERITED_STYLES}
+
+
+# returns the ids that are referenced, so their elements keep them
+def referenced_ids(root) -> set:
+    ids = set()
+    for element in root.iter():
+        for value in element.attrib.values():
+            ids.update(re.findall(r"url\(#([^)]+)\)", value))
+            if value.startswith("#"):
+                ids.add(value[1:])
+    return ids
+
+
+# strips and rounds an element tree in place
+def clean(element, precision, keep_ids, is_root=False, inherited=None):
+    if inherited is None:
+        inherited = {name: DEFAULT_STYLES[name] for name in INHERITED_STYLES}
+    inherited = clean_style(element, inherited)
+
+    for child in list(element):
+        namespace, _, tag = child.tag.rpartition("}")
+        if (
+            not isinstance(child.tag, str)
+            or namespace.lstrip("{") not in KEEP_NAMESPACES
+            or tag in DROP_TAGS
+        ):
+            element.remove(child)
+            continue
+
+        clean(child, precision, keep_ids, inherited=inherited)
+
+        # groups and defs left empty have no effect
+        if tag in ("g", "defs") and len(child) == 0:
+            element.remove(child)
+
+    for name in list(element.attrib):
+        namespace = name[1:].split("}")[0] if name.startswith("{") else SVG_NS
+        if (
+            namespace not in KEEP_NAMESPACES
+            or name in DROP_ATTRIBUTES
+            or (is_root and name in DROP_ROOT_ATTRIBUTES)
+            or (name == "id" and element.attrib[name] not in keep_ids)
+        ):
+            del element.attrib[name]
+
+    for name, value in element.attrib.items():
+        if name == "d":
+            element.set(name, minify_path(value, precision))
+        elif name in NUMBER_ATTRIBUTES:
+            element.set(name, round_numbers(value, precision))
+
+    # whitespace between tags is not needed
+    element.text = element.text.strip() or None if element.text else None
+    element.tail = None
+
+
+# optimizes one svg file and returns the cleaned root element
+def optimize(path, precision):
+    root = ET.parse(path).getroot()
+    clean(root, precision, referenced_ids(root), is_root=True)
+    return root
+
+
+# serializes an element without namespace prefixes on svg elements
+def serialize(element) -> str:
+    return ET.tostring(element, encoding="unicode").replace(" />", "/>")
+
+
+# builds the <symbol> for an icon from its optimized root element
+def make_symbol(name, root) -> str:
+    symbol = ET.Element(f"{{{SVG_NS}}}symbol", {"id": f"icon-{name}"})
+    if "viewBox" in root.attrib:
+        symbol.set("viewBox", root.attrib["viewBox"])
+    symbol.extend(list(root))
+
+    # the sprite's outer <svg> declares the namespace once
+    return serialize(symbol).replace(f' xmlns="{SVG_NS}"', "")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--precision", type=int, default=2)
+    parser.add_argument("--sprite-max-bytes", type=int, default=2048)
+    parser.add_argument("--image-precision", type=int, default=1)
+    args = parser.parse_args()
+
+    ET.register_namespace("", SVG_NS)
+    ET.register_namespace("xlink", XLINK_NS)
+
+    symbols = []
+    for filename in sorted(os.listdir(IMAGES)):
+        if not filename.endswith(".svg") or filename.endswith(".min.svg"):
+            continue
+
+        name = filename[:-4]
+        source = os.path.join(IMAGES, filename)
+        root = optimize(source, args.precision)
+        minified = serialize(root)
+        target = os.path.join(IMAGES, name + ".min.svg")
+
+        in_sprite = len(minified.encode("utf-8")) <= args.sprite_max_bytes
+        if in_sprite:
+            symbols.append(make_symbol(name, root))
+
+            # icons are only used from the sprite, an old .min.svg is stale
+            if os.path.exists(target):
+                os.remove(target)
+        else:
+            root = optimize(source, args.image_precision)
+            minified = serialize(root)
+            with open(target, "w") as file:
+                file.write(minified)
+
+        before, after = os.path.getsize(source), len(minified.encode("utf-8"))
+
+        print(
+            f"{filename:<18}{before:>9} B -> {after:>8} B"
+            + ("  (sprite)" if in_sprite else "")
+        )
+
+    with open(SPRITE, "w") as file:
+        file.write("{# generated by tools/optimize_svgs.py, do not edit #}\n")
+        file.write(
+            f'<svg xmlns="{SVG_NS}" style="display: none">'
+            + "".join(symbols)
+            + "</svg>\n"
+        )
+
+    print(f"{len(symbols)} icon(s) written to templates/icons.html")
+
+
+if __name__ == "__main__":
+    main()